@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+    LoRaWAN codec benchmark - no radio hardware is needed
+
+    Checks the codec against published test vectors then times
+
+        JoinRequest creation
+        JoinAccept decrypt plus MIC check (with and without a CFList)
+        session key derivation
+        unconfirmed uplink encode
+        confirmed downlink decode with FOpts
+
+    for a range of FRMPayload sizes. Results are written as JSON so runs can
+    be saved and compared when the codec is changed.
+
+    The vectors are the AES-128 example from FIPS-197, the AES-CMAC examples
+    from RFC 4493 and the data frame example from the lora-packet library.
+    The JoinAccept is built here, as a network server would, so that check is
+    a round trip rather than a published vector.
+
+    usage: python3 benchCODEC.py [-n frames] [-o results.json]
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import timeit
+
+from dragino.LoRaWAN import new, new_session, SessionCrypto
+from dragino.LoRaWAN.MHDR import MHDR
+from dragino.LoRaWAN.AES_CMAC import AES_CMAC_Context
+from dragino.LoRaWAN.JoinAcceptPayload import AES, ENC_MODE
+
+SIZES = [0, 11, 51, 115, 222]
+
+APPKEY = list(bytes.fromhex("000102030405060708090a0b0c0d0e0f"))
+APPEUI = [0x70, 0xB3, 0xD5, 0x7E, 0xD0, 0x00, 0x00, 0x01]
+DEVEUI = [0x00, 0x11, 0x22, 0x33, 0x44, 0x55, 0x66, 0x77]
+DEVNONCE = [0x12, 0x34]
+DEVADDR = [0x26, 0x01, 0x1B, 0xDA]
+CFLIST = bytes.fromhex("184f84e85684b85e84886684") + bytes(4)
+
+
+# FIPS-197 appendix C.1
+FIPS197 = {
+    'key': "000102030405060708090a0b0c0d0e0f",
+    'plaintext': "00112233445566778899aabbccddeeff",
+    'ciphertext': "69c4e0d86a7b0430d8cdb78070b4c55a",
+}
+
+# RFC 4493 section 4
+RFC4493_KEY = "2b7e151628aed2a6abf7158809cf4f3c"
+RFC4493_MSG = ("6bc1bee22e409f96e93d7e117393172aae2d8a571e03ac9c9eb76fac45af8e51"
+               "30c81c46a35ce411e5fbc1191a0a52eff69f2445df4f9b17ad2b417be66c3710")
+RFC4493 = [
+    (0, "bb1d6929e95937287fa37d129b756746"),
+    (16, "070a16b46b4d4144f79bdd9dd04a287c"),
+    (40, "dfa66747de9ae63030ca32611497c827"),
+    (64, "51f0bebf7e3b9d92fc49741779363cfe"),
+]
+
+# lora-packet README data frame
+LORA_PACKET = {
+    'packet': "40F17DBE4900020001954378762B11FF0D",
+    'nwkskey': "44024241ed4ce9a68c6a8bc055233fd3",
+    'appskey': "ec925802ae430ca77fd3dd73cb2cc588",
+    'devaddr': [0x49, 0xBE, 0x7D, 0xF1],
+    'fcnt': 2,
+    'fport': 1,
+    'payload': b"test",
+}
+
+
+def check_vectors():
+    """ :return: dict of vector name to True/False """
+    results = {}
+
+    cipher = AES.new(bytes.fromhex(FIPS197['key']), ENC_MODE)
+    results['fips197_aes128'] = \
+        cipher.encrypt(bytes.fromhex(FIPS197['plaintext'])).hex() == FIPS197['ciphertext']
+
+    cmac = AES_CMAC_Context(bytes.fromhex(RFC4493_KEY))
+    msg = bytes.fromhex(RFC4493_MSG)
+    for length, tag in RFC4493:
+        results[f'rfc4493_cmac_{length}'] = cmac.encode(msg[:length]).hex() == tag
+
+    v = LORA_PACKET
+    nwkskey = list(bytes.fromhex(v['nwkskey']))
+    appskey = list(bytes.fromhex(v['appskey']))
+    packet = bytes.fromhex(v['packet'])
+
+    lorawan = new(nwkskey, appskey)
+    lorawan.read(packet)
+    results['lora_packet_decode'] = (lorawan.valid_mic()
+                                     and lorawan.get_payload_bytes() == v['payload']
+                                     and list(reversed(lorawan.get_devaddr())) == v['devaddr'])
+
+    lorawan = new(nwkskey, appskey)
+    lorawan.create(MHDR.UNCONF_DATA_UP, {'devaddr': v['devaddr'], 'fcnt': v['fcnt'],
+                                         'data': list(v['payload']), 'fport': v['fport']})
+    results['lora_packet_encode'] = lorawan.to_bytes() == packet
+
+    session = SessionCrypto(nwkskey, appskey, v['devaddr'])
+    lorawan = new_session(session)
+    lorawan.create(MHDR.UNCONF_DATA_UP, {'devaddr': v['devaddr'], 'fcnt': v['fcnt'],
+                                         'data': list(v['payload']), 'fport': v['fport']})
+    results['lora_packet_encode_session'] = lorawan.to_bytes() == packet
+
+    accept = join_accept(APPKEY, CFLIST)
+    lorawan = new([], APPKEY)
+    lorawan.read(accept)
+    clear = lorawan.get_payload_bytes()
+    results['join_accept_round_trip'] = (lorawan.valid_mic()
+                                         and clear[:3] == b'\x01\x02\x03'
+                                         and lorawan.get_devaddr() == DEVADDR
+                                         and clear[12:] == CFLIST)
+    return results
+
+
+def join_accept(appkey, cflist=b''):
+    """ a JoinAccept as the network server sends it """
+    mhdr = bytes((MHDR.JOIN_ACCEPT,))
+    clear = b''.join((b'\x01\x02\x03',             # appnonce
+                      b'\x13\x00\x00',             # netid
+                      bytes(reversed(DEVADDR)),
+                      b'\x00',                     # dlsettings
+                      b'\x01',                     # rxdelay
+                      cflist))
+    mic = AES_CMAC_Context(bytes(appkey)).mic(mhdr + clear)
+    return mhdr + AES.new(bytes(appkey), ENC_MODE).decrypt(clear + mic)
+
+
+def downlinks(session, size, count=16):
+    """ confirmed downlinks carrying a LinkADRReq and DevStatusReq in FOpts """
+    frames = []
+    for fcnt in range(count):
+        lorawan = new_session(session)
+        lorawan.create(MHDR.CONF_DATA_DOWN, {'devaddr': DEVADDR, 'fcnt': fcnt,
+                                             'data': bytes(range(size)), 'fport': 1,
+                                             'fopts': [0x03, 0x51, 0xFF, 0x00, 0x01, 0x06]})
+        frames.append(lorawan.to_bytes())
+    return frames
+
+
+def run(fn, n):
+    """ :return: microseconds per call """
+    return timeit.timeit(fn, number=n) / n * 1e6
+
+
+def benchmark(n):
+    results = []
+
+    def record(name, size, us):
+        results.append({'case': name, 'size': size, 'us_per_op': round(us, 3)})
+
+    def join_request():
+        lorawan = new(APPKEY)
+        lorawan.create(MHDR.JOIN_REQUEST,
+                       {'deveui': DEVEUI, 'appeui': APPEUI, 'devnonce': DEVNONCE})
+        return lorawan.to_bytes()
+    record('join_request_create', 18, run(join_request, n))
+
+    for cflist in (b'', CFLIST):
+        accept = join_accept(APPKEY, cflist)
+
+        def decode_accept():
+            lorawan = new([], APPKEY)
+            lorawan.read(accept)
+            lorawan.get_payload_bytes()
+            return lorawan.valid_mic()
+        record('join_accept_decrypt_mic', 12 + len(cflist), run(decode_accept, n))
+
+    lorawan = new([], APPKEY)
+    lorawan.read(join_accept(APPKEY))
+    lorawan.get_payload_bytes()
+    record('session_key_derive', 16, run(lambda: lorawan.derive_session_keys(DEVNONCE), n))
+
+    nwkskey, appskey = lorawan.derive_session_keys(DEVNONCE)
+    session = SessionCrypto(nwkskey, appskey, DEVADDR)
+
+    for size in SIZES:
+        data = bytes(range(size))
+
+        def uplink_keys():
+            lorawan = new(nwkskey, appskey)
+            lorawan.create(MHDR.UNCONF_DATA_UP, {'devaddr': DEVADDR, 'fcnt': 1,
+                                                 'data': data, 'fport': 1})
+            return lorawan.to_bytes()
+
+        def uplink_session():
+            lorawan = new_session(session)
+            lorawan.create(MHDR.UNCONF_DATA_UP, {'devaddr': DEVADDR, 'fcnt': 1,
+                                                 'data': data, 'fport': 1})
+            return lorawan.to_bytes()
+
+        record('uplink_encode', size, run(uplink_keys, n))
+        record('uplink_encode_session', size, run(uplink_session, n))
+
+        frames = downlinks(session, size)
+
+        def downlink():
+            for raw in frames:
+                lorawan = new_session(session)
+                lorawan.read(raw)
+                if lorawan.valid_mic():
+                    lorawan.get_payload_bytes()
+        record('conf_downlink_decode_fopts', size, run(downlink, n // len(frames) or 1) / len(frames))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LoRaWAN codec benchmark")
+    parser.add_argument('-n', type=int, default=5000, help="operations per case")
+    parser.add_argument('-o', help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    vectors = check_vectors()
+    failed = [name for name, ok in vectors.items() if not ok]
+    for name in failed:
+        print(f"test vector {name} failed", file=sys.stderr)
+
+    report = {
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'operations': args.n,
+        'vectors': vectors,
+        'results': [] if failed else benchmark(args.n),
+    }
+
+    if args.o:
+        with open(args.o, "w") as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+    if failed:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+    FRMPayload encryption benchmark - no radio hardware is needed
+
+    Times the per-frame cost of encrypting (or decrypting, which is the same
+    operation) FRMPayloads of 11 to 242 bytes using the AES_CTR keystream engine
+    and, for comparison, the original per-byte method which built the A blocks
+    one list element at a time and XORed in a Python loop.
+
+    Both methods are checked to give the same ciphertext before timing.
+
+    usage: python3 benchKEYSTREAM.py [number of frames per size]
+"""
+import sys
+import timeit
+
+from dragino.LoRaWAN.AES_CTR import AES_CTR, AES, ENC_MODE
+
+KEY = bytes(range(16))
+DEVADDR = bytes([0x04, 0x03, 0x02, 0x26])   # as sent on air
+FCNT = (1234).to_bytes(2, 'little')
+SIZES = [11, 16, 51, 115, 222, 242]
+
+
+def original(key, direction, devaddr, fcnt, data):
+    """ the method used before AES_CTR was added """
+    k = (len(data) + 15) // 16
+    a = []
+    for i in range(k):
+        a += [0x01]
+        a += [0x00, 0x00, 0x00, 0x00]
+        a += [direction]
+        a += devaddr
+        a += fcnt
+        a += [0x00]
+        a += [0x00]
+        a += [0x00]
+        a += [i + 1]
+    s = AES.new(bytes(key), ENC_MODE).encrypt(bytes(a))
+    padded = bytearray()
+    for i in range(k):
+        idx = (i + 1) * 16
+        padded += (data[idx - 16:idx] + bytearray(16))[:16]
+    payload = []
+    for i in range(len(data)):
+        payload += [s[i] ^ padded[i]]
+    return list(map(int, payload))
+
+
+def engine(key, direction, devaddr, fcnt, data):
+    """ a new cipher per frame, as DataPayload does without a session """
+    return AES_CTR(key).crypt(AES_CTR.nonce(direction, devaddr, fcnt), data)
+
+
+ctr = AES_CTR(KEY)
+
+def engine_cached(key, direction, devaddr, fcnt, data):
+    """ cipher kept for the session """
+    return ctr.crypt(AES_CTR.nonce(direction, devaddr, fcnt), data)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    methods = [original, engine, engine_cached]
+
+    print(f"{'bytes':>5} " + " ".join(f"{m.__name__:>14}" for m in methods) + "   (us per frame)")
+    for size in SIZES:
+        data = bytearray(range(size))
+        expected = bytes(original(KEY, 0, DEVADDR, FCNT, data))
+        row = []
+        for m in methods:
+            if bytes(m(KEY, 0, DEVADDR, FCNT, data)) != expected:
+                print(f"{m.__name__} gives a different result for {size} bytes")
+                exit(1)
+            t = timeit.timeit(lambda: m(KEY, 0, DEVADDR, FCNT, data), number=n)
+            row.append(t / n * 1e6)
+        print(f"{size:>5} " + " ".join(f"{t:>14.2f}" for t in row))
+
+
+if __name__ == "__main__":
+    main()
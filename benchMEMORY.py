@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+    Memory footprint of decoded LoRaWAN frames - no radio hardware is needed
+
+    Decodes N downlink frames, keeping every PhyPayload alive as capture/replay
+    tooling does, and reports the bytes allocated per decoded frame using
+    tracemalloc.
+
+    "before" uses dict-backed copies of the codec classes (how they were
+    before __slots__ was added), "after" uses the classes as shipped.
+
+    usage: python3 benchMEMORY.py [number of frames]
+"""
+import sys
+import tracemalloc
+from contextlib import contextmanager
+
+from dragino.LoRaWAN import new, SessionCrypto
+from dragino.LoRaWAN.MHDR import MHDR
+from dragino.LoRaWAN.PhyPayload import PhyPayload
+from dragino.LoRaWAN.MacPayload import MacPayload
+from dragino.LoRaWAN.FHDR import FHDR
+from dragino.LoRaWAN.Direction import Direction
+from dragino.LoRaWAN.DataPayload import DataPayload
+from dragino.LoRaWAN.JoinRequestPayload import JoinRequestPayload
+from dragino.LoRaWAN.JoinAcceptPayload import JoinAcceptPayload
+
+CLASSES = [PhyPayload, MacPayload, FHDR, MHDR, Direction, DataPayload,
+           JoinRequestPayload, JoinAcceptPayload]
+
+NWKSKEY = list(range(16))
+APPSKEY = list(range(16, 32))
+DEVADDR = [0x26, 0x01, 0x02, 0x03]
+
+
+def dict_backed(cls):
+    """ a copy of cls without __slots__ """
+    skip = set(getattr(cls, '__slots__', ())) | {'__slots__', '__dict__', '__weakref__'}
+    ns = {k: v for k, v in cls.__dict__.items() if k not in skip}
+    return type(cls.__name__, cls.__bases__, ns)
+
+
+@contextmanager
+def without_slots():
+    """ temporarily replace the codec classes in every LoRaWAN module """
+    clones = {cls: dict_backed(cls) for cls in CLASSES}
+    patched = []
+    for name, module in list(sys.modules.items()):
+        if not name.startswith('dragino.LoRaWAN'):
+            continue
+        for attr, value in list(vars(module).items()):
+            if isinstance(value, type) and value in clones:
+                setattr(module, attr, clones[value])
+                patched.append((module, attr, value))
+    try:
+        yield clones[PhyPayload]
+    finally:
+        for module, attr, value in patched:
+            setattr(module, attr, value)
+
+
+def make_frames(n):
+    """ encoded downlinks with FOpts and a 20 byte payload """
+    session = SessionCrypto(NWKSKEY, APPSKEY, DEVADDR)
+    frames = []
+    for i in range(n):
+        lorawan = new(session, session)
+        lorawan.create(MHDR.UNCONF_DATA_DOWN, {'devaddr': DEVADDR, 'fcnt': i & 0xFFFF,
+                                               'data': bytes(20), 'fport': 1, 'fopts': [0x06]})
+        frames.append(lorawan.to_bytes())
+    return frames
+
+
+def measure(phy_class, frames):
+    """ bytes allocated per frame for decoded frames kept alive """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    decoded = []
+    for raw in frames:
+        lorawan = phy_class(NWKSKEY, APPSKEY)
+        lorawan.read(raw)
+        decoded.append(lorawan)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(frames)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    frames = make_frames(n)
+
+    with without_slots() as dict_phy:
+        before = measure(dict_phy, frames)
+    after = measure(PhyPayload, frames)
+
+    print(f"frames decoded: {n}")
+    print(f"before (dict)   : {before:8.1f} bytes/frame")
+    print(f"after (__slots__): {after:8.1f} bytes/frame")
+    print(f"saving          : {100 * (before - after) / before:8.1f} %")
+
+
+if __name__ == "__main__":
+    main()
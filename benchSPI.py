@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+    SPI cost of the driver operations - no radio hardware is needed
+
+    Runs on the SX127x emulator (see dragino/SX127x/emulator.py): joins,
+    then sends uplinks, every other one answered with a downlink in RX1 and
+    the rest followed by the switch to RX2. The SPI round trips and bytes
+    of each operation (configureRadio, on_tx_done, on_rx_done, set_mode...)
+    are written as JSON so runs can be compared when the driver is changed.
+
+    The config file is copied to a temporary directory so the real
+    cache.json is not touched.
+
+    usage: python3 benchSPI.py [-n uplinks] [-o results.json] [--trace trace.json]
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+os.environ["DRAGINO_EMULATOR"] = "1"
+
+from dragino import Dragino
+from dragino.LoRaWAN import new_session
+from dragino.LoRaWAN.MHDR import MHDR
+from dragino.SX127x.emulator import CHIP
+from benchCODEC import join_accept
+
+TIMEOUT = 5     # seconds to wait for the emulated radio
+
+
+def wait_for(condition):
+    end = time.monotonic() + TIMEOUT
+    while not condition():
+        if time.monotonic() > end:
+            raise TimeoutError("the emulated radio did not respond")
+        time.sleep(0.0005)
+
+
+def returned(D, operation, count):
+    """ :return: a condition, the operation has returned count times since D.spi.reset() """
+    return lambda: D.spi.ops.get(operation, [0])[0] >= count
+
+
+def downlink(D, fcnt):
+    lorawan = new_session(D.MAC.getSessionCrypto())
+    lorawan.create(MHDR.UNCONF_DATA_DOWN, {'devaddr': D.MAC.getDevAddr(), 'fcnt': fcnt,
+                                           'data': b'\x01\x02\x03', 'fport': 1})
+    return lorawan.to_bytes()
+
+
+def run(D, uplinks):
+    """ join then send the uplinks, :return: the SPI report per phase """
+    phases = {'init': D.spi.report()}
+
+    D.spi.reset()
+    D.join()
+    wait_for(returned(D, 'on_tx_done', 1))
+    CHIP.receive(join_accept(D.MAC.getAppKey()))
+    wait_for(returned(D, 'on_rx_done', 1))
+    phases['join'] = D.spi.report()
+
+    D.spi.reset()
+    downlinks = 0
+    for i in range(uplinks):
+        D.send_bytes(bytes([i & 0xFF] * 11))
+        wait_for(returned(D, 'on_tx_done', i + 1))
+        if i % 2:
+            D.switchToRX2()
+        else:
+            downlinks += 1
+            CHIP.receive(downlink(D, downlinks))
+            wait_for(returned(D, 'on_rx_done', downlinks))
+    phases['uplinks'] = D.spi.report()
+    return phases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SX127x driver SPI cost")
+    parser.add_argument('-n', type=int, default=20, help="uplinks to send")
+    parser.add_argument('-c', default="dragino.toml", help="config file")
+    parser.add_argument('-o', help="write the JSON results to this file instead of stdout")
+    parser.add_argument('--trace', help="also write a trace of every SPI transfer to this file")
+    args = parser.parse_args()
+
+    config = os.path.abspath(args.c)
+    out = None if args.o is None else os.path.abspath(args.o)
+    trace = None if args.trace is None else os.path.abspath(args.trace)
+
+    os.chdir(tempfile.mkdtemp())
+    shutil.copy(config, "dragino.toml")
+
+    CHIP.time_scale = 0.01  # airtime passes 100 times faster
+    D = Dragino("dragino.toml", logging_level=logging.ERROR)
+    D.verbose = False
+    if trace:
+        D.spi.start_trace(size=1 << 16)
+
+    report = {
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'uplinks': args.n,
+        'operations': run(D, args.n),
+        'modes': D.mode_transition.report(),
+    }
+
+    if trace:
+        D.spi.dump(trace)
+
+    if out:
+        with open(out, "w") as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+    # the RX2 and join retry timers are still running
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+    Decode a capture of raw PHY payloads - no radio hardware is needed
+
+    The capture can be a dragino debug log (the 'raw payload' lines), a file
+    with one hex frame per line or a length prefixed binary file (.bin).
+    One JSON record is printed per frame, see dragino/CaptureDecoder.py.
+
+    usage: python3 decodeCAPTURE.py capture [cache.json ...] [-p processes]
+"""
+import argparse
+import json
+
+from dragino.CaptureDecoder import decode_capture, key_table_from_cache, TEXT, BINARY
+
+
+def main():
+    parser = argparse.ArgumentParser(description="decode a LoRaWAN capture")
+    parser.add_argument('capture', help="capture file")
+    parser.add_argument('caches', nargs='*', help="MAC cache files holding the session keys")
+    parser.add_argument('-f', choices=[TEXT, BINARY], help="capture format, .bin files are binary")
+    parser.add_argument('-p', type=int, default=1, help="worker processes")
+    args = parser.parse_args()
+
+    keys = key_table_from_cache(*args.caches)
+    for record in decode_capture(args.capture, keys, args.f, args.p):
+        print(json.dumps(record))
+
+
+if __name__ == "__main__":
+    main()
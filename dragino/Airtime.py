@@ -0,0 +1,87 @@
+"""
+Airtime.py
+
+LoRa time on air, see Semtech AN1200.13 "LoRa Modem Designer's Guide".
+
+    Tsym      = 2^SF / BW
+    Tpreamble = (preamble + 4.25) * Tsym
+    symbols   = 8 + max(ceil((8PL - 4SF + 28 + 16CRC - 20IH) / (4(SF - 2DE))) * (CR + 4), 0)
+
+where PL is the PHY payload length, IH is 1 for implicit header mode and DE
+is 1 if low data rate optimisation is on (symbol time over 16ms, as the
+driver sets it).
+
+AirtimeTable holds the time on air of every payload length for each data
+rate of a frequency plan so the airtime of a frame is a list lookup. Dragino
+keeps one for its frequency plan and uses it to predict the airtime of each
+uplink before it is sent, see Dragino.uplinkAirTime().
+"""
+
+import math
+from bisect import bisect_right
+from .SX127x.constants import BANDWIDTH_HZ
+
+MAX_PAYLOAD = 255               # bytes, the FIFO size
+LDRO_SYMBOL_TIME = 0.016        # seconds, longer symbols need low data rate optimisation
+UPLINK_OVERHEAD = 13            # MHDR(1) + DevAddr(4) + FCtrl(1) + FCnt(2) + FPort(1) + MIC(4)
+JOIN_REQUEST_LENGTH = 23        # MHDR(1) + AppEUI(8) + DevEUI(8) + DevNonce(2) + MIC(4)
+
+
+def symbol_time(sf, bw):
+    """
+    :param sf: spreading factor 6..12
+    :param bw: bandwidth index 0..9
+    :return: seconds
+    """
+    return (1 << sf) / BANDWIDTH_HZ[bw]
+
+
+def time_on_air(payload_length, sf, bw, cr=1, preamble=8, crc=True, implicit_header=False, ldro=None):
+    """
+    :param payload_length: PHY payload bytes
+    :param sf: spreading factor 6..12
+    :param bw: bandwidth index 0..9
+    :param cr: coding rate 1..4 for 4/5..4/8
+    :param preamble: programmed preamble length in symbols
+    :param crc: payload CRC on
+    :param implicit_header: no explicit header
+    :param ldro: low data rate optimisation, None to work it out from sf and bw
+    :return: seconds
+    """
+    t_sym = symbol_time(sf, bw)
+    if ldro is None:
+        ldro = t_sym > LDRO_SYMBOL_TIME
+    symbols = math.ceil((8 * payload_length - 4 * sf + 28 + 16 * crc - 20 * implicit_header)
+                        / (4 * (sf - 2 * ldro)))
+    return (preamble + 4.25) * t_sym + (8 + max(symbols * (cr + 4), 0)) * t_sym
+
+
+class AirtimeTable(object):
+    """ time on air of every payload length for each data rate """
+
+    def __init__(self, data_rates, cr=1, preamble=8, crc=True, implicit_header=False):
+        """
+        :param data_rates: [(sf, bw)...] indexed by data rate, e.g. the frequency plan's data_rates
+        :param cr, preamble, crc, implicit_header: see time_on_air()
+        """
+        self.data_rates = [tuple(dr) for dr in data_rates]
+        self.tables = [
+            tuple(time_on_air(n, sf, bw, cr, preamble, crc, implicit_header) for n in range(MAX_PAYLOAD + 1))
+            for sf, bw in self.data_rates
+        ]
+
+    def airtime(self, dr, payload_length):
+        """
+        :param dr: data rate index
+        :param payload_length: PHY payload bytes 0..255
+        :return: seconds
+        """
+        return self.tables[dr][payload_length]
+
+    def max_payload(self, dr, airtime):
+        """
+        :param dr: data rate index
+        :param airtime: seconds available
+        :return: the longest PHY payload sent within airtime, -1 if none is
+        """
+        return bisect_right(self.tables[dr], airtime) - 1
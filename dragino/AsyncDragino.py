@@ -0,0 +1,222 @@
+"""
+AsyncDragino.py
+
+asyncio front end for Dragino.
+
+    async def main():
+        D = AsyncDragino("dragino.toml")
+        await D.join()
+        outcome = await D.send("hello")
+        print(outcome.airtime, outcome.window, outcome.downlink)
+
+        async for downlink in D.downlinks():
+            print(downlink.fport, downlink.payload)
+
+    asyncio.run(main())
+
+The radio interrupt callbacks still run on pigpio's thread, which has to
+switch to RX1 in time. What they produce (TxDone, a JOIN_ACCEPT, a downlink,
+a failed join) is passed to the event loop with call_soon_threadsafe(), and
+the RX2 and join retry timers run on the loop (LoopScheduler) instead of a
+threading.Timer each. Sending, including each join retry, runs in the loop's
+default executor as listen before talk may back off.
+
+Other Dragino methods and attributes (registered(), lastAirTime(),
+channelActivity...) are available on the AsyncDragino.
+"""
+
+import asyncio
+from collections import namedtuple
+
+from .dragino import Dragino, DraginoError, DEFAULT_LOG_LEVEL
+from .Scheduler import LoopScheduler
+from .Airtime import time_on_air
+from .Strings import *
+
+TX_TIMEOUT = 2.0        # seconds beyond the predicted airtime to wait for TxDone
+DOWNLINK_LENGTH = 64    # PHY bytes, a downlink starting at the end of RX2 is waited for
+
+# payload bytes, mtype and fport as passed to a downlink callback, timestamp
+# the time.monotonic() time of RxDone and window "RX1" or "RX2"
+Downlink = namedtuple('Downlink', 'payload mtype fport timestamp window')
+
+# airtime measured and predicted, the downlink answering the uplink (None
+# if there was none by the end of RX2) and the window it arrived in
+SendOutcome = namedtuple('SendOutcome', 'airtime predicted window downlink')
+
+
+class _LoopDragino(Dragino):
+    """ Dragino passing its events to the AsyncDragino owning it """
+
+    def __init__(self, owner, *args, **kwargs):
+        self.owner = owner
+        super().__init__(*args, **kwargs)
+
+    def on_tx_done(self):
+        super().on_tx_done()
+        self.owner._post(self.owner._txDone, self.txEnd)
+
+    def _retryJoin(self):
+        # called on the loop by the join retry timer, the JOIN_REQUEST may
+        # wait for a clear channel so it is sent from the executor
+        self.owner.loop.run_in_executor(None, super()._retryJoin)
+
+    def on_joined(self):
+        self.owner._post(self.owner._joined, True)
+
+    def on_join_failed(self):
+        self.owner._post(self.owner._joined, False)
+
+
+class AsyncDragino:
+
+    def __init__(self, config_filename, logging_level=DEFAULT_LOG_LEVEL, enableGPS=False, board=None, loop=None):
+        """
+        :param loop: the event loop, default the running one
+        other parameters as Dragino
+        """
+        self.loop = asyncio.get_running_loop() if loop is None else loop
+        self.dragino = _LoopDragino(
+            self, config_filename, logging_level=logging_level, enableGPS=enableGPS,
+            board=board, scheduler=LoopScheduler(self.loop))
+        self.dragino.setDownlinkCallback(self._downlinkCallback)
+
+        self.lock = asyncio.Lock()      # one join or uplink at a time
+        self.queue = asyncio.Queue()    # every downlink, see downlinks()
+        self.txDoneFuture = None
+        self.joinFuture = None
+        self.answerFuture = None
+
+    def __getattr__(self, name):
+        # registered(), lastAirTime(), MAC...
+        if name == 'dragino':
+            raise AttributeError(name)
+        return getattr(self.dragino, name)
+
+    # called on the radio thread
+
+    def _post(self, func, *args):
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def _downlinkCallback(self, payload, mtype, fport, timestamp=None):
+        D = self.dragino
+        window = None
+        if timestamp is not None and D.txEnd is not None:
+            rx2 = D.MAC.getRX1Delay() + D.config[TTN][RX_WINDOW]
+            window = "RX1" if timestamp - D.txEnd < rx2 else "RX2"
+        self._post(self._downlink, Downlink(bytes(payload), mtype, fport, timestamp, window))
+
+    # called on the loop
+
+    @staticmethod
+    def _resolve(future, result):
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    def _txDone(self, txEnd):
+        self._resolve(self.txDoneFuture, txEnd)
+
+    def _joined(self, joined):
+        self._resolve(self.joinFuture, joined)
+
+    def _downlink(self, downlink):
+        self.queue.put_nowait(downlink)
+        self._resolve(self.answerFuture, downlink)
+
+    # API
+
+    async def join(self):
+        """
+        OTAA join, returns once the JOIN_ACCEPT has been processed. Returns at
+        once if already joined (or using ABP)
+
+        :raises DraginoError: no JOIN_REQUEST sent, or no JOIN_ACCEPT after the join retries
+        """
+        async with self.lock:
+            D = self.dragino
+            if D.registered():
+                return
+            if D.config[TTN][AUTH_MODE] != AUTH_OTAA:
+                raise DraginoError(f"cannot join with auth_mode {D.config[TTN][AUTH_MODE]}")
+
+            self.joinFuture = self.loop.create_future()
+            try:
+                sent = await self.loop.run_in_executor(None, D.join)
+                if not sent:
+                    if D.registered():
+                        return
+                    raise DraginoError("JOIN_REQUEST was not sent, see the log")
+                try:
+                    joined = await asyncio.wait_for(self.joinFuture, self._joinTimeout())
+                except asyncio.TimeoutError:
+                    D.joining = False
+                    raise DraginoError("no JOIN_ACCEPT or join failure reported") from None
+            finally:
+                self.joinFuture = None
+            if not joined:
+                raise DraginoError("no JOIN_ACCEPT, join retries exhausted")
+
+    def _joinTimeout(self):
+        """
+        :return: seconds, the longest the first JOIN_REQUEST and its
+                 retries can take before on_join_failed() is called
+        """
+        D = self.dragino
+        lbt = D.channelActivity
+        attempt = D.config[TTN][JOIN_TIMEOUT] + D.txAirTime + TX_TIMEOUT
+        if lbt.enabled:
+            attempt += lbt.rounds * lbt.backoff[1]
+        return (D.config[TTN][JOIN_RETRIES] + 1) * attempt
+
+    async def send(self, message, port=1):
+        """
+        send an uplink and wait for its receive windows
+
+        :param message: str, bytes or list of ints
+        :param port: 1..254
+        :return: SendOutcome
+        :raises DraginoError: the uplink was not sent (e.g. not joined) or TxDone never came
+        """
+        if isinstance(message, str):
+            message = list(map(ord, message))
+
+        async with self.lock:
+            D = self.dragino
+            self.txDoneFuture = self.loop.create_future()
+            self.answerFuture = self.loop.create_future()
+            try:
+                sent = await self.loop.run_in_executor(None, D.send_bytes, message, port)
+                if not sent:
+                    raise DraginoError("uplink was not sent, see the log")
+
+                try:
+                    await asyncio.wait_for(self.txDoneFuture, D.txAirTime + TX_TIMEOUT)
+                except asyncio.TimeoutError:
+                    raise DraginoError("no TxDone from the radio") from None
+
+                # RX2 opens rx1_delay+rx_window after TxDone and is listened
+                # to for rx_window, a downlink starting then takes its airtime
+                freq, sf, bw = D.MAC.getRX2Settings()
+                end = (D.MAC.getRX1Delay() + 2 * D.config[TTN][RX_WINDOW]
+                       + time_on_air(DOWNLINK_LENGTH, sf, bw, crc=False))
+                try:
+                    downlink = await asyncio.wait_for(asyncio.shield(self.answerFuture), D._sinceTxEnd(end))
+                except asyncio.TimeoutError:
+                    downlink = None
+            finally:
+                self.txDoneFuture = None
+                self.answerFuture = None
+
+            return SendOutcome(D.lastAirTime(), D.txAirTime, downlink and downlink.window, downlink)
+
+    async def downlinks(self):
+        """
+        every downlink received, including those returned by send()
+
+            async for downlink in D.downlinks():
+                ...
+
+        :return: async iterator of Downlink
+        """
+        while True:
+            yield await self.queue.get()
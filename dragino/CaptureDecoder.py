@@ -0,0 +1,286 @@
+"""
+CaptureDecoder.py
+
+Offline decoding of captured PHY payloads.
+
+Captures are read a line or a record at a time and decoded records are
+yielded as they are produced so a capture of any size is decoded in
+constant memory.
+
+Two capture formats are read:-
+
+    text   one frame per line. A line may be bare hex or a dragino debug
+           log line, in which case the text after 'raw payload' is used.
+           That is either hex ("Sending packet raw payload = 40f17d...")
+           or a list of ints ("raw payload [64, 241, 125, ...]").
+           Lines without a frame are skipped.
+
+    binary each frame is preceded by its length as 2 bytes, big endian.
+           See write_binary().
+
+Data frames are decoded with the session keys found in a key table which
+maps the DevAddr (as an int, MSB first, as printed by TTN) to a tuple of
+(nwkskey, appskey). key_table_from_cache() builds one from MAC cache files.
+
+Each record is a dict:-
+
+    index      position of the frame in the capture
+    raw        the frame as a hex string
+    mtype      MHDR message type
+    direction  0 uplink, 1 downlink
+    devaddr    int, data frames only
+    fctrl, fcnt, fopts, fport   data frames only, fopts as hex
+               fcnt is the 32 bit counter rebuilt from the last frame
+               with a valid MIC for the same devaddr and direction
+    mic_ok     True/False, None if there were no keys for the devaddr
+    payload    decrypted FRMPayload as hex, None if mic_ok is not True
+    error      None or the reason the frame could not be decoded
+
+usage:
+
+    from dragino.CaptureDecoder import decode_capture, key_table_from_cache
+
+    keys=key_table_from_cache("cache.json")
+    for record in decode_capture("rx.log", keys, processes=4):
+        print(record)
+
+"""
+
+import json
+import multiprocessing
+import re
+from itertools import islice
+
+from .Strings import *
+from .LoRaWAN import new_session, SessionCrypto
+from .LoRaWAN.HeaderView import HeaderView
+from .LoRaWAN.MHDR import MHDR
+from .LoRaWAN.FHDR import FHDR
+
+TEXT="text"
+BINARY="binary"
+
+LENGTH_BYTES=2  # binary record length prefix
+
+RAW_PAYLOAD=re.compile(r"raw payload\s*=?\s*(.*)$")
+
+def key_table_from_cache(*paths):
+    """
+    build a key table from one or more MAC cache files (cache.json)
+
+    :param paths: cache file names
+    :return: dict devaddr int -> (nwkskey, appskey)
+    """
+    keys={}
+    for path in paths:
+        with open(path, "r") as f:
+            cache=json.load(f)
+        devaddr=int.from_bytes(bytes(cache[DEVADDR]), 'big')
+        keys[devaddr]=(cache[NWKSKEY], cache[APPSKEY])
+    return keys
+
+def parse_line(line):
+    """
+    extract a frame from a line of a text capture
+
+    :param line: str
+    :return: bytes or None if the line has no frame
+    """
+    match=RAW_PAYLOAD.search(line)
+    text=match.group(1) if match else line
+    text=text.strip()
+    if not text:
+        return None
+    try:
+        if text.startswith("["):
+            return bytes(int(v) for v in text.strip("[]").split(","))
+        return bytes.fromhex(text)
+    except ValueError:
+        return None
+
+def read_text(f):
+    """ generator of frames from a text capture """
+    for line in f:
+        frame=parse_line(line)
+        if frame is not None:
+            yield frame
+
+def read_binary(f):
+    """ generator of frames from a length prefixed binary capture """
+    while True:
+        prefix=f.read(LENGTH_BYTES)
+        if len(prefix)<LENGTH_BYTES:
+            return
+        length=int.from_bytes(prefix, 'big')
+        frame=f.read(length)
+        if len(frame)<length:
+            return  # truncated last record
+        yield frame
+
+def write_binary(f, frame):
+    """
+    append a frame to a binary capture
+
+    :param f: file opened with "ab" or "wb"
+    :param frame: bytes, bytearray or list of ints
+    """
+    frame=bytes(frame)
+    f.write(len(frame).to_bytes(LENGTH_BYTES, 'big'))
+    f.write(frame)
+
+def read_capture(path, fmt=None):
+    """
+    generator of the frames in a capture file
+
+    :param path: capture file name
+    :param fmt: TEXT or BINARY, if None files ending in .bin are BINARY
+    """
+    if fmt is None:
+        fmt=BINARY if path.endswith(".bin") else TEXT
+
+    if fmt==BINARY:
+        with open(path, "rb") as f:
+            yield from read_binary(f)
+    else:
+        with open(path, "r", errors="replace") as f:
+            yield from read_text(f)
+
+class FrameDecoder:
+    """
+    decodes single frames, keeping a SessionCrypto per devaddr and the
+    last 32 bit FCnt per devaddr and direction
+    """
+    def __init__(self, keys):
+        """
+        :param keys: dict devaddr int -> (nwkskey, appskey)
+        """
+        self.keys=keys
+        self.sessions={}
+        self.fcnts={}
+
+    def getSession(self, devaddr):
+        session=self.sessions.get(devaddr)
+        if session is None and devaddr in self.keys:
+            nwkskey,appskey=self.keys[devaddr]
+            session=SessionCrypto(nwkskey, appskey, list(devaddr.to_bytes(4, 'big')))
+            self.sessions[devaddr]=session
+        return session
+
+    def decode(self, index, frame):
+        """
+        :param index: position of the frame in the capture
+        :param frame: bytes
+        :return: record dict
+        """
+        record={"index": index, "raw": frame.hex(), "error": None}
+
+        header=HeaderView(frame)
+        if not header.is_valid():
+            record["error"]="too short or malformed"
+            return record
+
+        mtype=header.get_mtype()
+        record["mtype"]=mtype
+        record["direction"]=1 if mtype in (MHDR.JOIN_ACCEPT, MHDR.UNCONF_DATA_DOWN, MHDR.CONF_DATA_DOWN) else 0
+
+        if not header.is_data():
+            return record   # join frames carry no session data
+
+        devaddr=header.get_devaddr()
+        record["devaddr"]=devaddr
+        record["fctrl"]=header.get_fctrl()
+        record["fcnt"]=header.get_fcnt()
+        record["mic_ok"]=None
+        record["payload"]=None
+
+        try:
+            session=self.getSession(devaddr)
+            # the session is only used for crypto, header fields decode without it
+            lorawan=new_session(session)
+            lorawan.read(frame)
+            mac_payload=lorawan.get_mac_payload()
+            fhdr=mac_payload.get_fhdr()
+            record["fopts"]=bytes(fhdr.get_fopts()).hex()
+            record["fport"]=mac_payload.get_fport()
+
+            if session is None:
+                return record
+
+            counter=(devaddr, record["direction"])
+            fhdr.set_fcnt32(FHDR.fcnt32(self.fcnts.get(counter, 0), fhdr.get_fcnt()))
+
+            record["mic_ok"]=lorawan.valid_mic()
+            if record["mic_ok"]:
+                record["fcnt"]=self.fcnts[counter]=fhdr.get_fcnt32()
+                record["payload"]=lorawan.get_payload_bytes().hex()
+        except Exception as e:
+            record["error"]=str(e)
+        return record
+
+# each pool worker has its own decoder, set up by _init_worker
+_worker=None
+
+def _init_worker(keys):
+    global _worker
+    _worker=FrameDecoder(keys)
+
+def _decode_batch(batch):
+    return [_worker.decode(index, frame) for index, frame in batch]
+
+def _batches(frames, size):
+    frames=enumerate(frames)
+    while True:
+        batch=list(islice(frames, size))
+        if not batch:
+            return
+        yield batch
+
+def decode_frames(frames, keys, processes=None, batch=256):
+    """
+    generator of decoded records
+
+    :param frames: iterable of frames (bytes)
+    :param keys: dict devaddr int -> (nwkskey, appskey)
+    :param processes: None or 1 to decode here, otherwise the number of
+                      worker processes
+    :param batch: frames sent to a worker at a time
+
+    Records are yielded in capture order. With a pool only one round of
+    batches is read ahead of the records being yielded so memory use does
+    not grow with the capture size.
+    Each worker rebuilds 32 bit FCnts from the frames it has seen, which
+    is only wrong if a device sends more than 65535 frames between two of
+    that worker's batches.
+    """
+    if not processes or processes<2:
+        decoder=FrameDecoder(keys)
+        for index, frame in enumerate(frames):
+            yield decoder.decode(index, frame)
+        return
+
+    # Pool.imap() reads its whole input up front so the frames are fed a
+    # round at a time. The next round is decoded while this one is yielded.
+    rounds=_batches(frames, batch*processes)
+
+    def submit(pool):
+        work=next(rounds, None)
+        if work is None:
+            return None
+        chunks=[work[i:i+batch] for i in range(0, len(work), batch)]
+        return pool.map_async(_decode_batch, chunks)
+
+    with multiprocessing.Pool(processes, _init_worker, (keys,)) as pool:
+        pending=submit(pool)
+        while pending is not None:
+            results=pending.get()
+            pending=submit(pool)
+            for chunk in results:
+                yield from chunk
+
+def decode_capture(path, keys, fmt=None, processes=None, batch=256):
+    """
+    generator of decoded records from a capture file
+
+    see read_capture() and decode_frames() for the parameters
+    """
+    yield from decode_frames(read_capture(path, fmt), keys, processes, batch)
@@ -0,0 +1,112 @@
+"""
+ChannelActivity.py
+
+Listen before talk settings and statistics.
+
+When enabled Dragino runs channel activity detection (CAD) on the uplink
+channel before transmitting. CAD takes about two symbols and reports if a
+LoRa preamble at the same spreading factor is on the air. A busy channel is
+swapped for another one. After `channels` busy channels in a row the send
+backs off a random time from `backoff` and starts again, after `rounds`
+rounds it transmits anyway rather than lose the message.
+
+The counts show how crowded each channel is and how often a collision was
+avoided, see report().
+"""
+
+import random
+from .Strings import LBT, LBT_CHANNELS, LBT_ROUNDS, LBT_BACKOFF
+
+DEFAULT_CHANNELS = 3            # channels tried per round
+DEFAULT_ROUNDS = 3              # rounds before sending regardless
+DEFAULT_BACKOFF = (0.5, 2.0)    # seconds, random jitter between rounds
+
+
+class ChannelActivity:
+
+    def __init__(self, enabled=False, channels=DEFAULT_CHANNELS, rounds=DEFAULT_ROUNDS, backoff=DEFAULT_BACKOFF):
+        """
+        :param enabled: run CAD before each transmission
+        :param channels: channels to try before backing off
+        :param rounds: back off rounds before transmitting on a busy channel
+        :param backoff: (min,max) seconds
+        """
+        self.enabled = enabled
+        self.channels = max(1, channels)
+        self.rounds = max(1, rounds)
+        self.backoff = tuple(backoff)
+        self.reset()
+
+    @classmethod
+    def fromConfig(cls, ttn):
+        """
+        :param ttn: the config TTN section, lbt keys which are missing take the defaults
+        """
+        return cls(
+            enabled=ttn.get(LBT, False),
+            channels=ttn.get(LBT_CHANNELS, DEFAULT_CHANNELS),
+            rounds=ttn.get(LBT_ROUNDS, DEFAULT_ROUNDS),
+            backoff=ttn.get(LBT_BACKOFF, DEFAULT_BACKOFF),
+            )
+
+    def reset(self):
+        """ clear the statistics """
+        self.perChannel = {}        # freq -> [cads, busy]
+        self.outcomes = dict(
+            clear=0,                # the first channel tried was clear
+            changed_channel=0,      # clear after changing channel
+            backed_off=0,           # clear after one or more back offs
+            sent_busy=0,            # every channel tried was busy
+            )
+        self.backoffs = 0
+        self.backoffTime = 0.0
+        self.timeouts = 0           # CadDone never came
+
+    def record(self, freq, busy):
+        """ count a CAD result """
+        counts = self.perChannel.get(freq)
+        if counts is None:
+            counts = self.perChannel[freq] = [0, 0]
+        counts[0] += 1
+        counts[1] += busy
+
+    def backoffDelay(self):
+        """ :return: seconds to wait before the next round """
+        delay = random.uniform(*self.backoff)
+        self.backoffs += 1
+        self.backoffTime += delay
+        return delay
+
+    def done(self, backoffs, changes, clear=True):
+        """
+        count the outcome of a listen before talk
+
+        :param backoffs: times the send backed off
+        :param changes: channel changes since the last back off
+        :param clear: False if sent on a busy channel
+        """
+        if not clear:
+            self.outcomes['sent_busy'] += 1
+        elif backoffs > 0:
+            self.outcomes['backed_off'] += 1
+        elif changes > 0:
+            self.outcomes['changed_channel'] += 1
+        else:
+            self.outcomes['clear'] += 1
+
+    def report(self):
+        """
+        :return: dict with the outcomes of each transmission, backoffs,
+                 backoff_s (total), timeouts and channels keyed by frequency
+                 each with cads, busy and busy_ratio
+        """
+        return dict(
+            outcomes=dict(self.outcomes),
+            backoffs=self.backoffs,
+            backoff_s=round(self.backoffTime, 3),
+            timeouts=self.timeouts,
+            channels={
+                freq: dict(cads=cads, busy=busy, busy_ratio=round(busy / cads, 3))
+                for freq, (cads, busy) in sorted(self.perChannel.items())
+                },
+            )
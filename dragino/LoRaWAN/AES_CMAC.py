@@ -44,10 +44,8 @@ class AES_CMAC:
         return K1, K2
 
     def xor_128(self, N1, N2):
-        J = b''
-        for i in range(len(N1)):
-            J += bytes([N1[i] ^ N2[i]])
-        return J
+        J = int.from_bytes(N1, 'big') ^ int.from_bytes(N2, 'big')
+        return J.to_bytes(16, 'big')
 
     def pad(self, N):
         const_Bsize = 16
@@ -88,6 +86,76 @@ class AES_CMAC:
 
         return T
 
+class AES_CMAC_Context:
+    """
+    AES-CMAC for one key
+
+    The cipher and the K1/K2 subkeys are computed once when the context is
+    created so each MIC costs only the block encryptions. Blocks are XORed
+    as 128 bit integers.
+
+    PyCryptodome's own CMAC was measured to be slower for LoRaWAN sized
+    messages because it needs a new (or copied) object for every MIC.
+    """
+
+    # above this many blocks one CBC call beats the per-block loop
+    CBC_BLOCKS = 8
+
+    _contexts = {}
+
+    def __init__(self, K):
+        self.key = bytes(K)
+        self.cipher = AES.new(self.key, ENC_MODE)
+        K1, K2 = AES_CMAC().gen_subkey(self.key)
+        self.K1 = int.from_bytes(K1, 'big')
+        self.K2 = int.from_bytes(K2, 'big')
+
+    @classmethod
+    def for_key(cls, K):
+        """
+        return a cached context for the key, creating it if needed
+        """
+        K = bytes(K)
+        ctx = cls._contexts.get(K)
+        if ctx is None:
+            if len(cls._contexts) >= 8:
+                cls._contexts.clear()
+            ctx = cls._contexts[K] = cls(K)
+        return ctx
+
+    def encode(self, M, X=0):
+        """
+        :param M: message (bytes-like)
+        :param X: CBC chaining value to start from as an int. Zero for a
+                  normal CMAC, or the encrypted first block when that has
+                  already been computed
+        :return: 16 byte tag
+        """
+        n = len(M)
+        r = n & 0x0F
+        if n and not r:
+            last = int.from_bytes(M[n - 16:], 'big') ^ self.K1
+            n -= 16
+        else:
+            n -= r
+            last = int.from_bytes(bytes(M[n:]) + b'\x80' + b'\x00' * (15 - r), 'big') ^ self.K2
+
+        if n > 16 * self.CBC_BLOCKS:
+            cbc = AES.new(self.key, AES.MODE_CBC, iv=X.to_bytes(16, 'big'))
+            X = int.from_bytes(cbc.encrypt(bytes(M[:n]))[-16:], 'big')
+        else:
+            encrypt = self.cipher.encrypt
+            for i in range(0, n, 16):
+                X = int.from_bytes(encrypt((X ^ int.from_bytes(M[i:i + 16], 'big')).to_bytes(16, 'big')), 'big')
+
+        return self.cipher.encrypt((X ^ last).to_bytes(16, 'big'))
+
+    def mic(self, M):
+        """
+        the 4 byte LoRaWAN MIC of the message
+        """
+        return self.encode(M)[:4]
+
 if __name__ == "__main__":
     A=AES_CMAC()
     key=bytearray([0x01]*16)
@@ -0,0 +1,74 @@
+#
+# FRMPayload encryption keystream
+#
+# LoRaWAN encrypts FRMPayload with the blocks
+#
+#   A_i = 0x01 | 0x00*4 | Dir | DevAddr(4) | FCnt(4) | 0x00 | i    i=1..k
+#
+# which is AES in counter mode with a 15 byte nonce and a one byte counter
+# starting at 1. All the A_i blocks are encrypted with one cipher call and
+# the payload is XORed with the keystream as a single integer.
+#
+try:
+    # no longer supported
+    from Crypto.Cipher import AES
+
+except:
+    # supported fork of pycrypto
+    from Cryptodome.Cipher import AES
+
+ENC_MODE=AES.MODE_ECB
+
+# counter byte for each block, LoRa payloads never need more than 16 blocks
+_COUNTER = [bytes((i,)) for i in range(256)]
+
+def xor_bytes(data, stream):
+    """
+    XOR data with the first len(data) bytes of stream
+
+    :param data: bytes-like
+    :param stream: bytes-like, at least as long as data
+    :return: bytes
+    """
+    n = len(data)
+    x = int.from_bytes(data, 'big') ^ int.from_bytes(stream[:n], 'big')
+    return x.to_bytes(n, 'big')
+
+class AES_CTR:
+
+    def __init__(self, key):
+        self.cipher = AES.new(bytes(key), ENC_MODE)
+
+    @staticmethod
+    def nonce(direction, devaddr, fcnt):
+        """
+        first 15 bytes of every A_i block
+
+        :param direction: 0 uplink, 1 downlink
+        :param devaddr: 4 bytes as sent on air (LSB first)
+        :param fcnt: frame counter bytes LSB first, the 2 sent on air or all 4
+        """
+        return b''.join((bytes((0x01, 0x00, 0x00, 0x00, 0x00, direction)),
+                         devaddr, fcnt, b'\x00' * (5 - len(fcnt))))
+
+    @staticmethod
+    def blocks(nonce, length):
+        """
+        the A_i blocks needed to cover length bytes
+        """
+        k = (length + 15) >> 4
+        return b''.join([nonce + _COUNTER[i] for i in range(1, k + 1)])
+
+    def keystream(self, nonce, length):
+        """
+        generate enough keystream for length bytes in one cipher call
+        """
+        return self.cipher.encrypt(self.blocks(nonce, length))
+
+    def crypt(self, nonce, data):
+        """
+        encrypt or decrypt data - the operation is the same
+        """
+        if not data:
+            return b''
+        return xor_bytes(data, self.keystream(nonce, len(data)))
@@ -0,0 +1,33 @@
+#
+# encode many uplinks with consecutive frame counters
+#
+# used to flush a backlog of queued sensor readings, e.g. after an outage.
+# The keystream and the first CMAC block of every frame are computed in bulk
+# rather than going through new(), create() and to_bytes() once per frame.
+#
+from .MHDR import MHDR
+from .Direction import Direction
+
+def encode_uplinks(session, frames, fcnt, fctrl=0x00, mtype=MHDR.UNCONF_DATA_UP):
+    """
+    :param session: SessionCrypto for the current session
+    :param frames: list of (fport, payload) pairs, fport 1..254
+    :param fcnt: FCntUp of the first frame, the others follow on
+    :param fctrl: FCtrl flags (ADR etc). The frames carry no FOpts
+    :param mtype: MHDR.UNCONF_DATA_UP or MHDR.CONF_DATA_UP
+    :return: list of raw PHY payloads (bytes) in the same order as frames
+    """
+    if not frames:
+        return []
+
+    direction = Direction.DIRECTION[mtype]
+    header = bytes((mtype,)) + session.devaddr + bytes((fctrl & 0xF0,))
+
+    encrypted = session.crypt_many(direction, fcnt, [bytes(p) for f, p in frames])
+
+    msgs = [b''.join((header, ((fcnt + i) & 0xFFFF).to_bytes(2, 'little'), bytes((fport,)), enc))
+            for i, ((fport, p), enc) in enumerate(zip(frames, encrypted))]
+
+    mics = session.mic_many(direction, fcnt, msgs)
+
+    return [m + mic for m, mic in zip(msgs, mics)]
@@ -1,21 +1,14 @@
 #
 # frm_payload: data(0..N)
 #
-from .AES_CMAC import AES_CMAC
-try:
-    # no longer supported
-    from Crypto.Cipher import AES
-
-except:
-    # supported fork of pycrypto
-    from Cryptodome.Cipher import AES
-
-ENC_MODE=AES.MODE_ECB
-
-import math
+from .AES_CMAC import AES_CMAC_Context
+from .AES_CTR import AES_CTR
+from .SessionCrypto import SessionCrypto
 
 class DataPayload:
 
+    __slots__ = ('mac_payload', 'payload')
+
     def read(self, mac_payload, payload):
         self.mac_payload = mac_payload
         self.payload = payload
@@ -27,93 +20,56 @@ class DataPayload:
     def length(self):
         return len(self.payload)
 
-    def to_raw(self):
+    def to_bytes(self):
         return self.payload
 
+    def to_raw(self):
+        return list(self.payload)
+
     def set_payload(self, key, direction, data):
         self.payload = self.encrypt_payload(key, direction, data)
 
+    def _block_prefix(self, first, direction):
+        """
+        the first 14 bytes shared by the MIC B0 block and the
+        encryption A blocks
+        """
+        fhdr = self.mac_payload.get_fhdr()
+        return b''.join((bytes((first, 0x00, 0x00, 0x00, 0x00, direction)),
+                         fhdr.get_devaddr(), self._fcnt().to_bytes(4, 'little')))
+
+    def _fcnt(self):
+        return self.mac_payload.get_fhdr().get_fcnt32()
+
     def compute_mic(self, key, direction, mhdr):
-        mic = [0x49]
-        mic += [0x00, 0x00, 0x00, 0x00]
-        mic += [direction]
-        mic += self.mac_payload.get_fhdr().get_devaddr()
-        mic += self.mac_payload.get_fhdr().get_fcnt()
-        mic += [0x00]
-        mic += [0x00]
-        mic += [0x00]
-        mic += [1 + self.mac_payload.length()]
-        mic += [mhdr.to_raw()]
-        mic += self.mac_payload.to_raw()
-
-        cmac = AES_CMAC()
-        computed_mic = cmac.encode(bytes(key), bytes(mic))[:4]
-        return list(map(int, computed_mic))
+        """
+        :param key: NwkSKey or a SessionCrypto
+        """
+        msg = bytes((mhdr.to_raw(),)) + self.mac_payload.to_bytes()
+        if isinstance(key, SessionCrypto):
+            return key.mic(direction, self._fcnt(), msg)
+
+        b0 = self._block_prefix(0x49, direction) + bytes((0x00, len(msg)))
+
+        cmac = AES_CMAC_Context.for_key(key)
+        return cmac.mic(b0 + msg)
+
+    def _nonce(self, direction):
+        fhdr = self.mac_payload.get_fhdr()
+        return AES_CTR.nonce(direction, fhdr.get_devaddr(), self._fcnt().to_bytes(4, 'little'))
 
     def decrypt_payload(self, key, direction, mic):
-        k = int(math.ceil(len(self.payload) / 16.0))
-
-        a = []
-        for i in range(k):
-            a += [0x01]
-            a += [0x00, 0x00, 0x00, 0x00]
-            a += [direction]
-            a += self.mac_payload.get_fhdr().get_devaddr()
-            a += self.mac_payload.get_fhdr().get_fcnt()
-            a += [0x00] # fcnt 32bit
-            a += [0x00] # fcnt 32bit
-            a += [0x00]
-            a += [i+1]
-
-        cipher = AES.new(bytes(key),ENC_MODE)
-        s = cipher.encrypt(bytes(a))
-
-        padded_payload = bytearray()
-        padding=bytearray([0x00] * 16)
-        
-        if type(self.payload) is list:
-            payload=bytearray(self.payload)
-        else:
-            payload=self.payload
-        
-        
-        for i in range(k):
-            idx = (i + 1) * 16
-            padded_payload += (payload[idx - 16:idx] + padding)[:16]
-
-        payload = []
-        for i in range(len(self.payload)):
-            payload += [s[i] ^ padded_payload[i]]
-        return list(map(int, payload))
+        """
+        :param key: AppSKey or a SessionCrypto
+        """
+        if isinstance(key, SessionCrypto):
+            return key.crypt(direction, self._fcnt(), self.payload)
+        return AES_CTR(key).crypt(self._nonce(direction), self.payload)
 
     def encrypt_payload(self, key, direction, data):
-        k = int(math.ceil(len(data) / 16.0))
-
-        a = []
-        for i in range(k):
-            a += [0x01]
-            a += [0x00, 0x00, 0x00, 0x00]
-            a += [direction]
-            a += self.mac_payload.get_fhdr().get_devaddr()
-            a += self.mac_payload.get_fhdr().get_fcnt()
-            a += [0x00] # fcnt 32bit
-            a += [0x00] # fcnt 32bit
-            a += [0x00]
-            a += [i+1]
-
-        cipher = AES.new(bytes(key),ENC_MODE)
-        s = cipher.encrypt(bytes(a))
-        
-        if type(data) is list:
-            data=bytearray(data)
-
-        padded_payload = bytearray()
-        padding=bytearray([0x00]*16)
-        for i in range(k):
-            idx = (i + 1) * 16
-            padded_payload += (data[idx - 16:idx] + padding)[:16]
-
-        payload = []
-        for i in range(len(data)):
-            payload += [s[i] ^ padded_payload[i]]
-        return list(map(int, payload))
+        """
+        :param key: AppSKey or a SessionCrypto
+        """
+        if isinstance(key, SessionCrypto):
+            return key.crypt(direction, self._fcnt(), data)
+        return AES_CTR(key).crypt(self._nonce(direction), data)
@@ -1,82 +1,121 @@
 #
 # fhdr: devaddr(4) fctrl(1) fcnt(2) fopts(0..N)
 #
+# only the low 16 bits of the 32 bit frame counter are sent. The high
+# 16 bits (fcnt_msb) are used in the MIC and encryption blocks.
+#
+# the header is held as one buffer: bytes for created frames or the
+# received mac payload view for read frames. The fields are sliced from
+# it when asked for so a decoded frame keeps no per-field objects.
+#
 from .MalformedPacketException import MalformedPacketException
 from struct import unpack
 from .MHDR import MHDR
 
 class FHDR:
 
+    __slots__ = ('raw', 'fcnt_msb')
+
     def read(self, mac_payload):
         if len(mac_payload) < 7:
             raise MalformedPacketException("Invalid fhdr")
 
-        self.devaddr = mac_payload[:4]
-        self.fctrl = mac_payload[4]
-        self.fcnt = mac_payload[5:7]
-        self.fopts = mac_payload[7:7 + (self.fctrl & 0xf)]
+        # shared with the MacPayload, the fhdr is raw[:self.length()]
+        self.raw = mac_payload
+        self.fcnt_msb = 0 # see set_fcnt32()
+
+    def _build(self, devaddr, fctrl, fcnt, fopts):
+        self.raw = b''.join((devaddr, bytes((fctrl,)), fcnt, fopts))
 
     def create(self, mtype, args):
-        self.devaddr = [0x00, 0x00, 0x00, 0x00]
+        devaddr = b'\x00\x00\x00\x00'
         
         # for downlinks fctrl=[ADR:7,RFU:6,ACK:5,FPending:4,FOptsLen:3-0]
         # for uplinks   fctrl=[ADR:7,ADRACKREQ:6,ACK:5,CLASS_B:4,FOptslen:3-0]
 
         if 'fctrl' in args:
-            self.fctrl=args['fctrl']
+            fctrl=args['fctrl']
         else:
-            self.fctrl = 0x00
+            fctrl = 0x00
 
+        # fcnt may be the full 32 bit counter
         if 'fcnt' in args:
-            self.fcnt = args['fcnt'].to_bytes(2, byteorder='little')
+            fcnt = (args['fcnt'] & 0xFFFF).to_bytes(2, byteorder='little')
+            self.fcnt_msb = (args['fcnt'] >> 16) & 0xFFFF
         else:
-            self.fcnt = [0x00, 0x00]
+            fcnt = b'\x00\x00'
+            self.fcnt_msb = 0
         
         # BNN addition to add any fopts for MAC replies/commands
         if 'fopts' in args:
-            self.fopts = args['fopts'] # should this be little endian?
-            self.fctrl=self.fctrl | (len(self.fopts) & 0x0F)
+            fopts = bytes(args['fopts']) # should this be little endian?
+            fctrl=fctrl | (len(fopts) & 0x0F)
         else:
-            self.fopts = []
+            fopts = b''
             
         if mtype == MHDR.UNCONF_DATA_UP or mtype == MHDR.UNCONF_DATA_DOWN or\
                 mtype == MHDR.CONF_DATA_UP or mtype == MHDR.CONF_DATA_DOWN:
-            self.devaddr = list(reversed(args['devaddr']))
+            devaddr = bytes(reversed(args['devaddr']))
+
+        self._build(devaddr, fctrl, fcnt, fopts)
 
     def length(self):
-        return 4 + 1 + 2 + (self.fctrl & 0xf)
+        return 4 + 1 + 2 + (self.raw[4] & 0xf)
+
+    def to_bytes(self):
+        return self.raw[:self.length()]
 
     def to_raw(self):
-        fhdr = []
-        fhdr += self.devaddr
-        fhdr += [self.fctrl]
-        fhdr += self.fcnt
-        if self.fopts:
-            fhdr += self.fopts
-        return fhdr
+        return list(self.to_bytes())
 
     def get_devaddr(self):
-        return self.devaddr
+        return self.raw[:4]
 
     def set_devaddr(self, devaddr):
-        self.devaddr = devaddr
+        self._build(bytes(devaddr), self.get_fctrl(), self.get_fcnt(), self.get_fopts())
 
     def get_fctrl(self):
-        return self.fctrl
+        return self.raw[4]
 
     def set_fctrl(self, fctrl):
-        self.fctrl = fctrl
+        self._build(self.get_devaddr(), fctrl, self.get_fcnt(), self.get_fopts())
 
     def get_fcnt(self):
-        return self.fcnt
+        return self.raw[5:7]
 
     def set_fcnt(self, fcnt):
-        self.fcnt = fcnt
+        self._build(self.get_devaddr(), self.get_fctrl(), bytes(fcnt), self.get_fopts())
+
+    def get_fcnt32(self):
+        return (self.fcnt_msb << 16) | int.from_bytes(self.get_fcnt(), 'little')
+
+    def set_fcnt32(self, fcnt):
+        """
+        set the full frame counter of a received frame, normally the
+        value returned by FHDR.fcnt32(), before the MIC is checked.
+        The low 16 bits must match the frame.
+        """
+        self.fcnt_msb = (fcnt >> 16) & 0xFFFF
+
+    @staticmethod
+    def fcnt32(last, fcnt):
+        """
+        reconstruct a 32 bit frame counter from the 16 bits received
+
+        :param last: the last 32 bit counter received
+        :param fcnt: the 16 bit counter (int or bytes as on air)
+        :return: the smallest counter >= last with the same low 16 bits
+        """
+        if not isinstance(fcnt, int):
+            fcnt = int.from_bytes(fcnt, 'little')
+        full = (last & 0xFFFF0000) | fcnt
+        if full < last:
+            full += 0x10000 # the 16 bit counter rolled over
+        return full & 0xFFFFFFFF
 
     def get_fopts(self):
-        return self.fopts
+        return self.raw[7:self.length()]
 
     def set_fopts(self, fopts):
-        self.fopts = fopts
         # set the FOptsLen 
-        self.fctrl=self.fctrl | (len(fopts) & 0x0f) 
+        self._build(self.get_devaddr(), self.get_fctrl() | (len(fopts) & 0x0f), self.get_fcnt(), bytes(fopts))
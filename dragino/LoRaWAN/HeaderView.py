@@ -0,0 +1,61 @@
+#
+# header peek for received packets
+#
+# mhdr(1) devaddr(4) fctrl(1) fcnt(2) fopts(0..15) ...
+#
+# reads the MHDR and FHDR fields straight from the received buffer without
+# building any PhyPayload/MacPayload/FHDR objects, so frames for other
+# devices can be dropped before any parsing or crypto.
+#
+from .MHDR import MHDR
+
+class HeaderView:
+
+    __slots__ = ('packet',)
+
+    def __init__(self, packet):
+        """
+        :param packet: received packet (list, bytes or memoryview)
+        """
+        self.packet = packet
+
+    def is_valid(self):
+        """
+        True if the packet is long enough for its header and FOpts
+        and is a LoRaWAN R1 frame
+        """
+        p = self.packet
+        n = len(p)
+        if n < 12 or p[0] & MHDR.MHDR_MAJOR != MHDR.LORAWAN_V1:
+            return False
+        if self.is_data():
+            return n >= 12 + (p[5] & 0x0F)
+        return True
+
+    def is_data(self):
+        mtype = self.packet[0] & MHDR.MHDR_TYPE
+        return mtype == MHDR.UNCONF_DATA_UP or mtype == MHDR.UNCONF_DATA_DOWN or\
+            mtype == MHDR.CONF_DATA_UP or mtype == MHDR.CONF_DATA_DOWN
+
+    def get_mtype(self):
+        return self.packet[0] & MHDR.MHDR_TYPE
+
+    def get_devaddr(self):
+        """
+        :return: DevAddr as an int (MSB first as written in the TTN console)
+        """
+        p = self.packet
+        return p[1] | p[2] << 8 | p[3] << 16 | p[4] << 24
+
+    def get_fctrl(self):
+        return self.packet[5]
+
+    def get_fcnt(self):
+        """
+        :return: the 16 bit frame counter sent on air
+        """
+        p = self.packet
+        return p[6] | p[7] << 8
+
+    def get_fopts_len(self):
+        return self.packet[5] & 0x0F
@@ -2,7 +2,7 @@
 # frm_payload: appnonce(3) netid(3) devaddr(4) dlsettings(1) rxdelay(1) cflist(0..16)
 #
 from .MalformedPacketException import MalformedPacketException
-from .AES_CMAC import AES_CMAC
+from .AES_CMAC import AES_CMAC_Context
 try:
     # no longer supported
     from Crypto.Cipher import AES
@@ -15,10 +15,14 @@ ENC_MODE=AES.MODE_ECB
 
 class JoinAcceptPayload:
 
+    __slots__ = ('encrypted_payload', 'payload', 'appnonce', 'netid', 'devaddr',
+                 'dlsettings', 'rxdelay', 'cflist')
+
     def read(self, payload):
         if len(payload) < 12:
             raise MalformedPacketException("Invalid join accept")
         self.encrypted_payload = payload
+        self.payload = None  # decrypted when first needed
 
     def create(self, args):
         pass
@@ -26,9 +30,12 @@ class JoinAcceptPayload:
     def length(self):
         return len(self.encrypted_payload)
 
-    def to_raw(self):
+    def to_bytes(self):
         return self.encrypted_payload
 
+    def to_raw(self):
+        return list(self.encrypted_payload)
+
     def to_clear_raw(self):
         return self.payload
 
@@ -51,21 +58,24 @@ class JoinAcceptPayload:
         return self.cflist
 
     def compute_mic(self, key, direction, mhdr):
-        mic = []
-        mic += [mhdr.to_raw()]
-        mic += self.to_clear_raw()
+        mic = bytes((mhdr.to_raw(),)) + self.to_clear_raw()
 
-        cmac = AES_CMAC()
-        computed_mic = cmac.encode(bytes(key), bytes(mic))[:4]
-        return list(map(int, computed_mic))
+        cmac = AES_CMAC_Context.for_key(key)
+        return cmac.mic(mic)
 
     def decrypt_payload(self, key, direction, mic):
-        a = []
-        a += self.encrypted_payload
-        a += mic
+        """
+        the join accept, including its MIC, is encrypted as a whole so the
+        MIC cannot be checked without this. The result is kept so calling
+        it again, e.g. from compute_mic(), costs nothing.
+        """
+        if self.payload is not None:
+            return self.payload
+
+        a = bytes(self.encrypted_payload) + bytes(mic)
 
         cipher = AES.new(bytes(key),ENC_MODE)
-        self.payload = cipher.encrypt(bytes(a))[:-4]
+        self.payload = cipher.encrypt(a)[:-4]
 
         self.appnonce = self.payload[:3]
         self.netid = self.payload[3:6]
@@ -76,32 +86,36 @@ class JoinAcceptPayload:
         if self.payload[12:]:
             self.cflist = self.payload[12:]
 
-        return list(map(int, self.payload))
+        return self.payload
 
     def encrypt_payload(self, key, direction, mhdr):
-        a = []
-        a += self.to_clear_raw()
-        a += self.compute_mic(key, direction, mhdr)
+        a = self.to_clear_raw() + self.compute_mic(key, direction, mhdr)
 
         cipher = AES.new(bytes(key),ENC_MODE)
-        return list(map(int, cipher.decrypt(bytes(a))))
+        return cipher.decrypt(a)
 
-    def derive_nwskey(self, key, devnonce):
-        a = [0x01]
-        a += self.get_appnonce()
-        a += self.get_netid()
-        a += devnonce
-        a += [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
+    def _derive_key(self, key, first, devnonce):
+        # session keys are cached as JSON so are returned as lists
+        a = b''.join((bytes((first,)), self.get_appnonce(), self.get_netid(),
+                      bytes(devnonce), b'\x00' * 7))
 
         cipher = AES.new(bytes(key),ENC_MODE)
-        return list(map(int, cipher.encrypt(bytes(a))))
+        return list(cipher.encrypt(a))
+
+    def derive_nwskey(self, key, devnonce):
+        return self._derive_key(key, 0x01, devnonce)
 
     def derive_appskey(self, key, devnonce):
-        a = [0x02]
-        a += self.get_appnonce()
-        a += self.get_netid()
-        a += devnonce
-        a += [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
+        return self._derive_key(key, 0x02, devnonce)
+
+    def derive_session_keys(self, key, devnonce):
+        """
+        derive both session keys with one cipher call
+
+        :return: (nwkskey, appskey) as lists
+        """
+        tail = b''.join((self.get_appnonce(), self.get_netid(), bytes(devnonce), b'\x00' * 7))
 
         cipher = AES.new(bytes(key),ENC_MODE)
-        return list(map(int, cipher.encrypt(bytes(a))))
+        keys = cipher.encrypt(b'\x01' + tail + b'\x02' + tail)
+        return list(keys[:16]), list(keys[16:])
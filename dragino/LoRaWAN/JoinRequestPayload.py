@@ -2,7 +2,7 @@
 # frm_payload: appeui(8) deveui(8) devnonce(2)
 #
 from .MalformedPacketException import MalformedPacketException
-from .AES_CMAC import AES_CMAC
+from .AES_CMAC import AES_CMAC_Context
 try:
     # no longer supported
     from Crypto.Cipher import AES
@@ -13,6 +13,8 @@ except:
 
 class JoinRequestPayload:
 
+    __slots__ = ('deveui', 'appeui', 'devnonce')
+
     def read(self, payload):
         if len(payload) != 18:
             raise MalformedPacketException("Invalid join request");
@@ -21,19 +23,18 @@ class JoinRequestPayload:
         self.devnonce = payload[16:18]
 
     def create(self, args):
-        self.deveui = list(reversed(args['deveui']))
-        self.appeui = list(reversed(args['appeui']))
-        self.devnonce = args['devnonce']
+        self.deveui = bytes(reversed(args['deveui']))
+        self.appeui = bytes(reversed(args['appeui']))
+        self.devnonce = bytes(args['devnonce'])
 
     def length(self):
         return 18
 
+    def to_bytes(self):
+        return b''.join((self.appeui, self.deveui, self.devnonce))
+
     def to_raw(self):
-        payload = []
-        payload += self.appeui
-        payload += self.deveui
-        payload += self.devnonce
-        return payload
+        return list(self.to_bytes())
 
     def get_appeui(self):
         return self.appeui
@@ -45,15 +46,13 @@ class JoinRequestPayload:
         return self.devnonce
 
     def compute_mic(self, key, direction, mhdr):
-        mic = [mhdr.to_raw()]
-        mic += self.to_raw()
+        mic = bytes((mhdr.to_raw(),)) + self.to_bytes()
 
-        cmac = AES_CMAC()
-        computed_mic = cmac.encode(bytes(key), bytes(mic))[:4]
-        return list(map(int, computed_mic))
+        cmac = AES_CMAC_Context.for_key(key)
+        return cmac.mic(mic)
 
     def decrypt_payload(self, key, direction, mic):
-        return self.to_raw()
+        return self.to_bytes()
 
 if __name__=="__main__":
     jrp=JoinRequestPayload()
@@ -2,6 +2,8 @@ from .MalformedPacketException import MalformedPacketException
 
 class MHDR:
 
+    __slots__ = ('mhdr',)
+
     LORAWAN_V1 = 0x00;
 
     MHDR_TYPE = 0xE0;
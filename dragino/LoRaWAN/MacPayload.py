@@ -10,11 +10,14 @@ from .DataPayload import DataPayload
 
 class MacPayload:
 
+    __slots__ = ('mtype', 'fhdr', 'fport', 'frm_payload')
+
     def read(self, mtype, mac_payload):
 
         if len(mac_payload) < 1:
             raise MalformedPacketException("Invalid mac payload")
 
+        self.mtype = mtype
         self.fhdr = FHDR()
         self.fhdr.read(mac_payload)
 
@@ -38,6 +41,7 @@ class MacPayload:
             self.frm_payload.read(self, mac_payload[self.fhdr.length() + 1:])
 
     def create(self, mtype, key, args):
+        self.mtype = mtype
         self.fhdr = FHDR()
         self.fhdr.create(mtype, args)
         
@@ -61,18 +65,24 @@ class MacPayload:
             self.frm_payload.create(self, key, args)
 
     def length(self):
-        return len(self.to_raw())
+        return len(self.to_bytes())
 
-    def to_raw(self):
-        mac_payload = []
-        if self.fhdr.get_devaddr() != [0x00, 0x00, 0x00, 0x00]:
-            mac_payload += self.fhdr.to_raw()
+    def to_bytes(self):
+        # join messages have no fhdr or fport
+        if self.mtype == MHDR.JOIN_REQUEST or self.mtype == MHDR.JOIN_ACCEPT:
+            if self.frm_payload is None:
+                return b''
+            return bytes(self.frm_payload.to_bytes())
+
+        parts = [self.fhdr.to_bytes()]
         if self.frm_payload != None:
-            if self.fhdr.get_devaddr() != [0x00, 0x00, 0x00, 0x00]:
-                if self.fport is not None: # BNN
-                    mac_payload += [self.fport]
-            mac_payload += self.frm_payload.to_raw()
-        return mac_payload
+            if self.fport is not None: # BNN
+                parts.append(bytes((self.fport,)))
+            parts.append(self.frm_payload.to_bytes())
+        return b''.join(parts)
+
+    def to_raw(self):
+        return list(self.to_bytes())
 
     def get_fhdr(self):
         return self.fhdr
@@ -1,6 +1,9 @@
 #
 # lorawan packet: mhdr(1) mac_payload(1..N) mic(4)
 #
+# A received packet is held once as bytes. The FHDR, FOpts and FRMPayload
+# are memoryview slices of that buffer so decoding does not copy the frame.
+#
 from .MalformedPacketException import MalformedPacketException
 from .MHDR import MHDR
 from .Direction import Direction
@@ -8,6 +11,8 @@ from .MacPayload import MacPayload
 
 class PhyPayload:
 
+    __slots__ = ('nwkey', 'appkey', 'mhdr', 'mic', 'direction', 'mac_payload')
+
     def __init__(self, nwkey, appkey):
         self.nwkey = nwkey
         self.appkey = appkey
@@ -15,13 +20,17 @@ class PhyPayload:
     def read(self, packet):
         if len(packet) < 12:
             raise MalformedPacketException("Invalid lorawan packet")
-        
+
+        if not isinstance(packet, (bytes, memoryview)):
+            packet = bytes(packet)  # list callers
+        view = memoryview(packet)
+
         self.mhdr = MHDR(packet[0])
-        self.mic = packet[-4:]
+        self.mic = bytes(view[-4:])
         self.set_direction()
         try:
             self.mac_payload = MacPayload()
-            self.mac_payload.read(self.get_mhdr().get_mtype(), packet[1:-4])
+            self.mac_payload.read(self.get_mhdr().get_mtype(), view[1:-4])
         except Exception as e:
             raise MalformedPacketException(f"cannot read packet {e}");
 
@@ -33,13 +42,19 @@ class PhyPayload:
         self.mic = None
 
     def length(self):
-        return len(self.to_raw())
+        return len(self.to_bytes())
+
+    def to_bytes(self):
+        return b''.join((bytes((self.get_mhdr().to_raw(),)),
+                         self.mac_payload.to_bytes(),
+                         self.get_mic()))
 
     def to_raw(self):
-        phy_payload = [self.get_mhdr().to_raw()]
-        phy_payload += self.mac_payload.to_raw()
-        phy_payload += self.get_mic()
-        return phy_payload
+        """
+        the packet as a list of ints, as used by existing callers.
+        Use to_bytes() to avoid the conversion.
+        """
+        return list(self.to_bytes())
 
     def get_mhdr(self):
         return self.mhdr;
@@ -60,24 +75,27 @@ class PhyPayload:
         self.mac_payload = mac_payload
 
     def get_mic(self):
-        if self.mic == None:
+        if self.mic is None:
             self.set_mic(self.compute_mic())
         return self.mic
 
     def set_mic(self, mic):
-        self.mic = mic
+        self.mic = bytes(mic)
 
     def compute_mic(self):
         if self.get_mhdr().get_mtype() == MHDR.JOIN_ACCEPT:
-            return self.mac_payload.frm_payload.encrypt_payload(self.appkey, self.get_direction(), self.get_mhdr())[-4:]
+            frm_payload = self.mac_payload.frm_payload
+            frm_payload.decrypt_payload(self.appkey, self.get_direction(), self.mic)
+            return frm_payload.encrypt_payload(self.appkey, self.get_direction(), self.get_mhdr())[-4:]
         else:
             return self.mac_payload.frm_payload.compute_mic(self.nwkey, self.get_direction(), self.get_mhdr())
 
     def valid_mic(self):
-        if self.get_mhdr().get_mtype() == MHDR.JOIN_ACCEPT:
-            return self.get_mic() == self.mac_payload.frm_payload.encrypt_payload(self.appkey, self.get_direction(), self.get_mhdr())[-4:]
-        else:
-            return self.get_mic() == self.mac_payload.frm_payload.compute_mic(self.nwkey, self.get_direction(), self.get_mhdr())
+        """
+        True if the MIC is correct. Data frames are checked without
+        decrypting the FRMPayload so call this before get_payload().
+        """
+        return self.get_mic() == self.compute_mic()
 
     def get_devaddr(self):
         if self.get_mhdr().get_mtype() == MHDR.JOIN_ACCEPT:
@@ -85,7 +103,7 @@ class PhyPayload:
         else:
             return self.mac_payload.fhdr.get_devaddr()
 
-    def get_payload(self):
+    def get_payload_bytes(self):
         try:
             
             return self.mac_payload.frm_payload.decrypt_payload(self.appkey, self.get_direction(), self.mic)
@@ -94,8 +112,17 @@ class PhyPayload:
             #print("mac_payload does not have a frm_payload")
             return None
 
+    def get_payload(self):
+        payload = self.get_payload_bytes()
+        if payload is None:
+            return None
+        return list(payload)
+
     def derive_nwskey(self, devnonce):
         return self.mac_payload.frm_payload.derive_nwskey(self.appkey, devnonce)
 
     def derive_appskey(self, devnonce):
         return self.mac_payload.frm_payload.derive_appskey(self.appkey, devnonce)
+
+    def derive_session_keys(self, devnonce):
+        return self.mac_payload.frm_payload.derive_session_keys(self.appkey, devnonce)
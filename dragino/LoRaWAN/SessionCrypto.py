@@ -0,0 +1,78 @@
+#
+# crypto state for one LoRaWAN session
+#
+# After a join (or for ABP) the NwkSKey, AppSKey and DevAddr do not change
+# so the ciphers, CMAC subkeys and the constant part of the B0 (MIC) and
+# A_i (encryption) blocks are built once. Each frame then only adds its
+# FCnt, the message length or the block index.
+#
+from .AES_CMAC import AES_CMAC_Context
+from .AES_CTR import AES_CTR, xor_bytes
+
+class SessionCrypto:
+
+    def __init__(self, nwkskey, appskey, devaddr):
+        """
+        :param nwkskey: 16 byte network session key
+        :param appskey: 16 byte application session key
+        :param devaddr: 4 byte device address MSB first (as cached)
+        """
+        self.nwkskey = bytes(nwkskey)
+        self.appskey = bytes(appskey)
+        self.devaddr = bytes(reversed(devaddr))     # as sent on air
+
+        self.cmac = AES_CMAC_Context(self.nwkskey)
+        self.ctr = AES_CTR(self.appskey)
+
+        # templates indexed by direction 0=up 1=down
+        self.b0 = [bytes((0x49, 0x00, 0x00, 0x00, 0x00, d)) + self.devaddr for d in (0, 1)]
+        self.a = [bytes((0x01, 0x00, 0x00, 0x00, 0x00, d)) + self.devaddr for d in (0, 1)]
+
+    def mic(self, direction, fcnt, msg):
+        """
+        :param direction: 0 uplink, 1 downlink
+        :param fcnt: frame counter (int)
+        :param msg: MHDR + MACPayload bytes
+        :return: 4 byte MIC
+        """
+        b0 = b''.join((self.b0[direction], fcnt.to_bytes(4, 'little'), bytes((0x00, len(msg)))))
+        return self.cmac.mic(b0 + msg)
+
+    def crypt(self, direction, fcnt, data):
+        """
+        encrypt or decrypt a FRMPayload
+        """
+        return self.ctr.crypt(self.a[direction] + fcnt.to_bytes(4, 'little') + b'\x00', data)
+
+    def crypt_many(self, direction, fcnt, payloads):
+        """
+        encrypt payloads sent with consecutive frame counters. The
+        keystream for all of them is generated in one cipher call.
+
+        :param fcnt: frame counter of the first payload
+        :return: list of encrypted payloads
+        """
+        blocks = [self.ctr.blocks(self.a[direction] + (fcnt + i).to_bytes(4, 'little') + b'\x00', len(p))
+                  for i, p in enumerate(payloads)]
+        stream = self.ctr.cipher.encrypt(b''.join(blocks))
+
+        result = []
+        pos = 0
+        for p, b in zip(payloads, blocks):
+            result.append(xor_bytes(p, stream[pos:pos + len(p)]) if p else b'')
+            pos += len(b)
+        return result
+
+    def mic_many(self, direction, fcnt, msgs):
+        """
+        MICs for messages sent with consecutive frame counters. The B0
+        blocks of all of them are encrypted in one cipher call.
+
+        :param fcnt: frame counter of the first message
+        :return: list of 4 byte MICs
+        """
+        b0 = b''.join([b''.join((self.b0[direction], (fcnt + i).to_bytes(4, 'little'), bytes((0x00, len(m)))))
+                       for i, m in enumerate(msgs)])
+        x = self.cmac.cipher.encrypt(b0)
+        return [self.cmac.encode(m, int.from_bytes(x[i * 16:i * 16 + 16], 'big'))[:4]
+                for i, m in enumerate(msgs)]
@@ -0,0 +1,63 @@
+#
+# preassembled uplink: mhdr(1) devaddr(4) fctrl(1) fcnt(2) fport(1) frm_payload(length) mic(4)
+#
+# Sensors usually send the same fport and payload length every time. The
+# frame is built once for a (session, fport, length) and each uplink only
+# rewrites FCnt, the encrypted payload and the MIC in place.
+#
+# The frame has no FOpts and no ACK bit. Uplinks which need them are
+# built with PhyPayload.create() instead.
+#
+from .MHDR import MHDR
+from .Direction import Direction
+
+class UplinkTemplate:
+
+    __slots__ = ('session', 'fport', 'length', 'direction', 'frame', 'view')
+
+    FCNT = slice(6, 8)
+    PAYLOAD = 9
+
+    def __init__(self, session, fport, length, fctrl=0x00, mtype=MHDR.UNCONF_DATA_UP):
+        """
+        :param session: SessionCrypto for the current session
+        :param fport: 1..254
+        :param length: FRMPayload length
+        :param fctrl: FCtrl flags (ADR etc). FOptsLen and ACK are cleared
+        :param mtype: MHDR.UNCONF_DATA_UP or MHDR.CONF_DATA_UP
+        """
+        self.session = session
+        self.fport = fport
+        self.length = length
+        self.direction = Direction.DIRECTION[mtype]
+
+        self.frame = bytearray(self.PAYLOAD + length + 4)
+        self.frame[0] = mtype
+        self.frame[1:5] = session.devaddr
+        self.frame[5] = fctrl & 0xD0
+        self.frame[8] = fport
+        self.view = memoryview(self.frame)
+
+    def matches(self, session, fport, length):
+        """
+        True if this template can encode the uplink
+        """
+        return self.session is session and self.fport == fport and self.length == length
+
+    def encode(self, fcnt, data):
+        """
+        rewrite the frame for the next uplink
+
+        :param fcnt: 32 bit FCntUp, the low 16 bits are sent
+        :param data: FRMPayload, length bytes
+        :return: the frame (bytearray). It is overwritten by the next
+                 call so must be sent (or copied) before then
+        """
+        if len(data) != self.length:
+            raise ValueError(f"payload length {len(data)} does not match template length {self.length}")
+
+        frame = self.frame
+        frame[self.FCNT] = (fcnt & 0xFFFF).to_bytes(2, 'little')
+        frame[self.PAYLOAD:-4] = self.session.crypt(self.direction, fcnt, bytes(data))
+        frame[-4:] = self.session.mic(self.direction, fcnt, self.view[:-4])
+        return frame
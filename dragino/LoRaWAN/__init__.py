@@ -1,4 +1,15 @@
 from .PhyPayload import PhyPayload
+from .SessionCrypto import SessionCrypto
+from .BatchEncoder import encode_uplinks
+from .HeaderView import HeaderView
+from .UplinkTemplate import UplinkTemplate
 
 def new(nwkey = [], appkey = []):
     return PhyPayload(nwkey, appkey)
+
+def new_session(session):
+    """
+    create a PhyPayload which encrypts and computes MICs with
+    a SessionCrypto instead of the raw keys
+    """
+    return PhyPayload(session, session)
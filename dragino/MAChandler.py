@@ -21,8 +21,11 @@ To start over, delete the cache file before instantiating this class.
 
 import logging
 import json
+import os
 import toml
 from .Strings import *
+from .LoRaWAN.SessionCrypto import SessionCrypto
+from .LoRaWAN.FHDR import FHDR
 import random
 
 
@@ -66,6 +69,7 @@ class MAC_commands(object):
         self.config=config
 
         self.cache={} # TTN dynamic settings
+        self.session=None # SessionCrypto, built when first needed
 
         # jump table for MAC commands taken from spec 1.0.4
         # REQ are commands from the server requesting some info/changes
@@ -176,8 +180,20 @@ class MAC_commands(object):
         except:
             return [0x00,0x00,0x00,0x00]
     
+    def getDevAddrInt(self):
+        """
+        the DevAddr as an int, 0 if not assigned
+
+        used to compare against HeaderView.get_devaddr()
+        """
+        d=self.getDevAddr()
+        if len(d)!=4:
+            return 0
+        return d[0]<<24 | d[1]<<16 | d[2]<<8 | d[3]
+
     def setDevAddr(self,DevAddr):
         self.cache[DEVADDR]=DevAddr
+        self.session=None
         self.saveCache()
         
     def getNwkSKey(self):
@@ -185,6 +201,7 @@ class MAC_commands(object):
 
     def setNwkSKey(self,key):
         self.cache[NWKSKEY]=key
+        self.session=None
         self.saveCache()
         
     def getAppSKey(self):
@@ -192,7 +209,20 @@ class MAC_commands(object):
 
     def setAppSKey(self,appskey):
         self.cache[APPSKEY]=appskey
+        self.session=None
         self.saveCache()
+
+    def getSessionCrypto(self):
+        """
+        returns the SessionCrypto holding the session key ciphers and
+        block templates.
+
+        It is built on first use and rebuilt after setDevAddr(),
+        setNwkSKey() or setAppSKey() change the session.
+        """
+        if self.session is None:
+            self.session=SessionCrypto(self.getNwkSKey(),self.getAppSKey(),self.getDevAddr())
+        return self.session
         
     def getAppKey(self):
         return self.cache[APPKEY]
@@ -204,22 +234,70 @@ class MAC_commands(object):
         return self.cache[DEVEUI]
 
     def getFCntUp(self):
+        """
+        the 32 bit uplink frame counter, only the low
+        16 bits are sent
+        """
         return self.cache[FCNTUP]
         
     def setFCntUp(self,count):
         self.cache[FCNTUP]=count
         self.saveCache()
 
-    def getJoinSettings(self):
+    def getFCntDn(self):
+        return self.cache[FCNTDN]
+
+    def setFCntDn(self,count):
+        self.cache[FCNTDN]=count
+        self.cache[FCNTDN_SEEN]=False # e.g. 0 after joining, the first downlink may reuse it
+        self.saveCache()
+
+    def getFCntDn32(self,fcnt):
+        """
+        reconstruct the 32 bit downlink frame counter from the
+        16 bits received
+
+        :param fcnt: FCnt from the frame header (bytes or int)
+        :return: the full FCntDn to use for the MIC and decryption
+        """
+        return FHDR.fcnt32(self.cache[FCNTDN],fcnt)
+
+    def reserveFCntUp(self,count):
+        """
+        reserve a block of consecutive uplink frame counters
+        and save the cache once
+
+        :param count: number of frames to be sent
+        :return: the first FCntUp of the block
+        """
+        first=self.cache[FCNTUP]
+        self.cache[FCNTUP]=first+count
+        self.saveCache()
+        return first
+
+    def _pickChannel(self,freqs,exclude=()):
+        """
+        random channel, avoiding the frequencies in exclude
+        unless that leaves none
+
+        :param freqs: list of channel frequencies
+        :param exclude: frequencies to avoid e.g. found busy
+        :return: index into freqs
+        """
+        choices=[i for i,f in enumerate(freqs) if f not in exclude] or range(len(freqs))
+        return random.choice(choices)
+
+    def getJoinSettings(self,exclude=()):
         """
         When joining only the first three frequencies
         should be used
         
         max duty cycle is also selected
         
+        :param exclude: frequencies to avoid, see _pickChannel()
         :return (freq,sf,bw)
         """
-        self.currentChannel=random.randint(0,len(self.cache[CHANNEL_JOIN_FREQS])-1)
+        self.currentChannel=self._pickChannel(self.cache[CHANNEL_JOIN_FREQS],exclude)
 
         freq=self.cache[CHANNEL_JOIN_FREQS][self.currentChannel]
 
@@ -233,13 +311,19 @@ class MAC_commands(object):
     def getDataRate(self):
         return self.cache[DATA_RATE]
 
+    def getDataRates(self):
+        """
+        :return: the frequency plan's data_rates, [(sf,bw)...] indexed by data rate
+        """
+        return self.config[self.frequency_plan][DATA_RATES]
+
     def getLastSendSettings(self):
         """
         :return tuple: (freq,sf,bw)
         """
         return self.lastSendSettings
         
-    def getSendSettings(self):
+    def getSendSettings(self,exclude=()):
         """
         randomly choose a frequency (channel)
         
@@ -247,9 +331,10 @@ class MAC_commands(object):
         
         Use current data rate
         
+        :param exclude: frequencies to avoid, see _pickChannel()
         :return (freq,sf,bw)
         """
-        self.currentChannel=random.randint(0,len(self.cache[CHANNEL_TX_FREQS])-1)
+        self.currentChannel=self._pickChannel(self.cache[CHANNEL_TX_FREQS],exclude)
 
         freq=self.cache[CHANNEL_TX_FREQS][self.currentChannel]
         self.cache[MAX_DUTY_CYCLE]=self.getMaxDutyCycle(freq)
@@ -298,6 +383,35 @@ class MAC_commands(object):
 
         return freq,sf,bw
         
+    def getRadioPlan(self):
+        """
+        every radio setting the get*Settings() methods can currently return
+
+        used to precompute the radio register images
+
+        :return (tx,rx): lists of (freq,sf,bw) for JOIN/SEND and for RX1/RX2
+        """
+        dataRates=self.config[self.frequency_plan][DATA_RATES]
+
+        txFreqs=set(self.cache[CHANNEL_JOIN_FREQS]) | set(self.cache[CHANNEL_TX_FREQS])
+        rxFreqs=set(self.cache[CHANNEL_RX1_FREQS]) | {self.cache[RX2_FREQUENCY]}
+        if self.cache[RX1_FREQ_FIXED]:
+            rxFreqs.add(self.cache[RX1_FREQUENCY])
+
+        tx=[(freq,sf,bw) for freq in sorted(txFreqs) for sf,bw in dataRates]
+        rx=[(freq,sf,bw) for freq in sorted(rxFreqs) for sf,bw in dataRates]
+        return tx,rx
+
+    def getRadioPlanKey(self):
+        """
+        the cached settings getRadioPlan() depends on. Cheaper than the plan
+        itself, compare it before and after MAC commands to see if the
+        radio profiles need rebuilding
+        """
+        c=self.cache
+        return (tuple(c[CHANNEL_JOIN_FREQS]),tuple(c[CHANNEL_TX_FREQS]),tuple(c[CHANNEL_RX1_FREQS]),
+                c[RX2_FREQUENCY],c[RX1_FREQ_FIXED],c.get(RX1_FREQUENCY))
+
     def getMaxDutyCycle(self,freq=None):
         """
         return the max duty cycle for a given frequency
@@ -484,6 +598,7 @@ class MAC_commands(object):
         # frame counts - will be reset on OTAA joining
         self.cache[FCNTUP]=self.config[TTN][FCNTUP]
         self.cache[FCNTDN]=self.config[TTN][FCNTDN]
+        self.cache[FCNTDN_SEEN]=False
              
         self.logger.info("MAC default settings finished")
         
@@ -512,17 +627,23 @@ class MAC_commands(object):
         
     def checkFcntDn(self,fcntdn):
         """
-        fcntdn should be incrementing
+        fcntdn should be incrementing, a frame which repeats or goes back
+        is a replay and must be dropped
+
+        :param fcntdn: 32 bit FCntDn of a downlink which passed the MIC check
+        :return: True if the frame is new, the counter is then saved
         """
         prev=self.cache[FCNTDN]
-        
-        if fcntdn<=prev:
-            self.logger.warn("received downlink FCntDn < or = previous")
-            return
-        
+        seen=self.cache.get(FCNTDN_SEEN,prev>0)
+
+        if fcntdn<prev or (fcntdn==prev and seen):
+            self.logger.warning(f"received downlink FCntDn {fcntdn} < or = previous {prev} - ignoring")
+            return False
 
         self.cache[FCNTDN]=fcntdn
+        self.cache[FCNTDN_SEEN]=True
         self.saveCache()
+        return True
             
     def loadCache(self):
         """
@@ -543,6 +664,13 @@ class MAC_commands(object):
                 self.logger.warning("cached MAC settings is empty. Could be first run?")
                 return
 
+            # before the 32 bit counters FCntDn was cached as the two FCnt
+            # bytes from the frame header
+            fcntdn=settings.get(FCNTDN)
+            if isinstance(fcntdn,list):
+                settings[FCNTDN]=int.from_bytes(bytes(fcntdn),'little')
+                self.logger.info(f"converted cached FCntDn {fcntdn} to {settings[FCNTDN]}")
+
             self.cache=settings
     
             self.logger.info("cached settings loaded ok")
@@ -551,6 +679,58 @@ class MAC_commands(object):
             self.logger.error(f"cached settings load failed {e}. Saving current defaults")
             self.saveCache()
 
+    def getRadioCachePath(self):
+        """
+        the radio register snapshot is kept next to the MAC cache. radio_cache
+        names the file, it defaults to <mac_cache>_radio.json
+
+        :return: path or None if disabled (radio_cache="")
+        """
+        path=self.config[TTN].get(RADIO_CACHE)
+        if path is None:
+            path=os.path.splitext(self.config[TTN][MAC_CACHE])[0]+"_radio.json"
+        return path or None
+
+    def saveRadioSnapshot(self,snapshot):
+        """
+        :param snapshot: from LoRa.snapshot()
+        """
+        path=self.getRadioCachePath()
+        if path is None:
+            return
+        try:
+            self.logger.info("Saving radio snapshot")
+
+            with open(path, "w") as f:
+                json.dump(snapshot, f)
+
+        except Exception as e:
+            self.logger.error(f"Saving radio snapshot failed {e}.")
+
+    def loadRadioSnapshot(self):
+        """
+        :return: the snapshot saved by saveRadioSnapshot() or None
+        """
+        path=self.getRadioCachePath()
+        if path is None:
+            return None
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+
+        except Exception as e:
+            self.logger.warning(f"radio snapshot load failed {e}. Could be first run?")
+            return None
+
+    def getFOptsLen(self):
+        """
+        length of the MAC replies the next uplink will carry, unlike
+        getFOpts() they are not cleared
+
+        :return: bytes
+        """
+        return len(self.macReplies)
+
     def getFOpts(self):
         """
         these are the MAC replies. The spec says the server can send multiple
@@ -612,12 +792,14 @@ class MAC_commands(object):
             self.logger.debug("handle MAC command No FOpts to process")
             return
 
-        FCnt=macPayload.get_fhdr().get_fcnt() # frame downlink frame counter
+        # 32 bit downlink frame counter, see getFCntDn32()
+        FCnt=macPayload.get_fhdr().get_fcnt32()
         self.logger.debug(f"received frame FCnt={FCnt} FCntDn={self.cache[FCNTDN]}")
   
         self.cache[FCNTDN]=FCnt
     
-        FOpts=macPayload.get_fhdr().get_fopts()
+        # FOpts may be a view into the received packet
+        FOpts=bytes(macPayload.get_fhdr().get_fopts())
 
 
 
@@ -23,16 +23,20 @@
 
 
 import sys
+import threading
+from contextlib import contextmanager
 from .constants import *
 from .board_config import BOARD
+from .mode_transition import ModeTransition
+from .spi_trace import SpiTracer
+from .tick_clock import TickClock
 import time
-import pigpio
 
 
 ################################################## Some utility functions ##############################################
-def raiseException(msg):
+def raiseException(msg, board=BOARD):
     """Make sure the GPIOs & SPI etc are reset before terminating."""
-    BOARD.teardown()
+    board.teardown()
     raise Exception(msg)
     
 def hexStr(num):
@@ -60,6 +64,38 @@ def set_bit(value, index, new_bit):
     return value
 
 
+# Configuration registers which only change when written. Their values are
+# kept in LoRa.shadow so reads are served from memory and writes of an
+# unchanged value are skipped. Every other register (mode, IRQ flags, FIFO
+# pointers, RSSI, SNR, counters, LNA gain set by the AGC, FSK registers used
+# by rx_chain_calibration) always goes to the chip.
+SHADOWED = frozenset([
+    REG.LORA.FR_MSB, REG.LORA.FR_MID, REG.LORA.FR_LSB,
+    REG.LORA.PA_CONFIG, REG.LORA.PA_RAMP, REG.LORA.OCP,
+    REG.LORA.FIFO_TX_BASE_ADDR, REG.LORA.FIFO_RX_BASE_ADDR,
+    REG.LORA.IRQ_FLAGS_MASK,
+    REG.LORA.MODEM_CONFIG_1, REG.LORA.MODEM_CONFIG_2, REG.LORA.SYMB_TIMEOUT_LSB,
+    REG.LORA.PREAMBLE_MSB, REG.LORA.PREAMBLE_MSB + 1,
+    REG.LORA.PAYLOAD_LENGTH, REG.LORA.MAX_PAYLOAD_LENGTH, REG.LORA.HOP_PERIOD,
+    REG.LORA.MODEM_CONFIG_3, REG.LORA.PPM_CORRECTION,
+    REG.LORA.DETECT_OPTIMIZE, REG.LORA.INVERT_IQ, REG.LORA.DETECTION_THRESH, REG.LORA.SYNC_WORD,
+    REG.LORA.DIO_MAPPING_1, REG.LORA.DIO_MAPPING_2,
+    REG.LORA.TCXO, REG.LORA.PA_DAC,
+])
+
+# the FIFO is 256 bytes, FIFO transfer buffers also hold the address byte
+FIFO_SIZE = 256
+
+# transaction() joins two runs of register writes into one burst if there
+# are no more than this many known SHADOWED registers between them
+MAX_BURST_GAP = 4
+
+# snapshot() saves, and restore() writes back in one burst, the LoRa mode
+# registers from the carrier frequency to PaDac
+SNAPSHOT_FIRST = REG.LORA.FR_MSB
+SNAPSHOT_LAST = REG.LORA.PA_DAC
+
+
 def getter(register_address):
     """ The getter decorator reads the register content and calls the decorated function to do
         post-processing.
@@ -69,7 +105,7 @@ def getter(register_address):
     """
     def decorator(func):
         def wrapper(self):
-            return func(self, self.spi.xfer([register_address, 0])[1])
+            return func(self, self._get_reg(register_address))
         return wrapper
     return decorator
 
@@ -83,7 +119,7 @@ def setter(register_address):
     """
     def decorator(func):
         def wrapper(self, val):
-            return self.spi.xfer([register_address | 0x80, func(self, val)])[1]
+            return self._set_reg(register_address, func(self, val))
         return wrapper
     return decorator
 
@@ -93,38 +129,94 @@ def setter(register_address):
 class LoRa(object):
 
     verbose = False
-    dio_mapping = [None] * 6          # store the dio mapping here
 
-    def __init__(self, verbose=True, do_calibration=True, calibration_freq=868):
+    # SPI transfers are counted against these, see spi_trace.py
+    TRACED_OPERATIONS = ('set_mode', 'write_payload', 'read_payload', 'reset_ptr_rx', 'set_freq',
+                         'write_profile', 'set_dio_mapping', 'clear_irq_flags', 'rx_chain_calibration',
+                         'get_all_registers', 'snapshot', 'restore')
+
+    def __init__(self, verbose=True, do_calibration=True, calibration_freq=868, board=None, snapshot=None):
         """ Init the object
         
         Send the device to sleep, read all registers, and do the calibration (if do_calibration=True)
         :param verbose: Set the verbosity True/False
         :param calibration_freq: call rx_chain_calibration with this parameter. Default is 868
         :param do_calibration: Call rx_chain_calibration, default is True.
+        :param board: the Board the radio is wired to, default BOARD (the Dragino HAT)
+        :param snapshot: a register image from snapshot(), saved by an earlier run. If the chip
+                         has the same version and is still in LoRa mode (not reset since) the image
+                         is restored instead of the calibration and set up. See self.warm_start
         """
         self.verbose = verbose
-        
-        self.spi=BOARD.SpiDev()
+        self.board = BOARD if board is None else board
+        self.dio_mapping = [None] * 6          # store the dio mapping here
+
+        # register values last read or written, None if not known. See SHADOWED
+        self.shadow = [None] * 0x80
+
+        # SHADOWED register writes waiting to be sent, see transaction()
+        self.pending = None
+        self.transaction_depth = 0
+
+        # the radio interrupt callbacks, the RX2/join retry timers and the
+        # caller all reach the registers. A transaction holds this from start
+        # to flush so no other thread adds to, sends or sees its writes
+        self.register_lock = threading.RLock()
+
+        # counts SPI transfers per operation, see self.spi.report()
+        self.spi=SpiTracer(self.board.SpiDev())
+        self.spi.instrument(self, self.TRACED_OPERATIONS)
+
+        # FIFO transfer buffers, allocated once. See write_payload() and read_payload()
+        self.fifo_write = bytearray(FIFO_SIZE + 1)
+        self.fifo_write[0] = REG.LORA.FIFO | 0x80
+        self.fifo_write_view = memoryview(self.fifo_write)
+        self.fifo_read_cmd = memoryview(bytes([REG.LORA.FIFO]) + bytes(FIFO_SIZE))
+        self.fifo_read = bytearray(FIFO_SIZE + 1)
+        self.fifo_read_view = memoryview(self.fifo_read)
+        # spidev 3.4+ writes any buffer without converting it to a list
+        self.writebytes2 = self.spi.supports('writebytes2')
+
+        # the time of the DIO edge which caused the callback being run, see _stamp()
+        self.tick_clock = TickClock(self.board.get_tick)
+        self.irq_tick = None
+        self.irq_time = None
+
+        # waits for mode changes, using ModeReady on DIO5 if the board has it
+        self.mode_transition = ModeTransition(self, self.board.DIO5, self.board.read_pin)
         
         # check SPI works
         vsn=self.get_version()
         if vsn==0:
-            raiseException("SPI is not working or the RFM has an invalid version. Got 0x00")
+            raiseException("SPI is not working or the RFM has an invalid version. Got 0x00", self.board)
         else:
             print(f"SX127x chip version is {hexStr(vsn)}")
         
         # sometimes the start up mode has the low frequency bit set
         # seen after a soft restart
 
-        print(f"initial mode is {modeStr(self.get_mode())}")
+        mode=self.get_mode()
+        print(f"initial mode is {modeStr(mode)}")
+
+        # the image calibration survives as long as the chip is powered, a
+        # chip which is still in LoRa mode has not been reset since the snapshot
+        self.warm_start = self._snapshot_fits(snapshot, vsn, mode)
 
-        self.set_mode(MODE.HF_FSK_STDBY) # start from a known point
+        if not self.warm_start:
+            self.set_mode(MODE.HF_FSK_STDBY) # start from a known point
             
-        print(f"initial mode changed to {modeStr(self.get_mode())}")
+            print(f"initial mode changed to {modeStr(self.get_mode())}")
             
         # set the callbacks for DIO0..5 IRQs.
-        BOARD.add_events(self._dio0, self._dio1, self._dio2, self._dio3, self._dio4, self._dio5)
+        self.board.add_events(self._dio0, self._dio1, self._dio2, self._dio3, self._dio4, self._dio5)
+
+        if self.warm_start:
+            print("restoring the register snapshot")
+            self.set_mode(MODE.HF_LORA_SLEEP)
+            self.restore(snapshot)
+            self.get_dio_mapping_1()    # from the shadow
+            self.get_dio_mapping_2()
+            return
 
         # more setup work:
         if do_calibration:
@@ -132,17 +224,162 @@ class LoRa(object):
             
         self.set_mode(MODE.HF_LORA_SLEEP) # LoRa mode
         
-        # set the dio_ mapping by calling the two get_dio_mapping_* functions
-        self.get_dio_mapping_1()
-        self.get_dio_mapping_2()
-
-        self.set_fifo_tx_base_addr(0)
-        self.set_fifo_rx_base_addr(0)
+        with self.transaction():
+            # set the dio_ mapping by calling the two get_dio_mapping_* functions
+            # both registers are fetched in one read
+            self._get_regs(REG.LORA.DIO_MAPPING_1, 2)
+            self.get_dio_mapping_1()
+            self.get_dio_mapping_2()
+
+            self.set_fifo_tx_base_addr(0)
+            self.set_fifo_rx_base_addr(0)
         
         time.sleep(0.1)
 
     def reset_radio(self):
-        BOARD.resetRadio()
+        self.board.reset_radio()
+        self.invalidate_shadow()
+
+    ###########################################
+    #
+    # Register access with the shadow cache
+    #
+    ###########################################
+    def invalidate_shadow(self):
+        """ Forget the shadowed register values, e.g. after the chip has been reset.
+        They are read from the chip again when next needed.
+        """
+        self.shadow = [None] * 0x80
+
+    @contextmanager
+    def transaction(self):
+        """ Collect SHADOWED register writes and send them as burst transfers
+
+        Writes are held until the outermost transaction ends, or until a register
+        which is not SHADOWED (mode, IRQ flags, FIFO pointer...) is written, so they
+        still reach the chip before any write that depends on them. Reads in the
+        transaction see the new values. Runs of registers are written in a single
+        transfer using the chip's address auto-increment; small gaps are filled
+        with the known value of the registers in between.
+
+        Other threads wait for the outermost transaction to end before they
+        access the registers, see register_lock.
+
+        usage:
+            with self.transaction():
+                self.set_freq(f)
+                self.set_spreading_factor(sf)
+        """
+        with self.register_lock:
+            if self.pending is None:
+                self.pending = {}
+            self.transaction_depth += 1
+            try:
+                yield self
+            finally:
+                self.transaction_depth -= 1
+                if self.transaction_depth == 0:
+                    try:
+                        self.flush()
+                    finally:
+                        self.pending = None
+
+    def flush(self):
+        """ Send any register writes collected by transaction() """
+        with self.register_lock:
+            if not self.pending:
+                return
+            addrs = sorted(self.pending)
+            self.pending = {}
+            start = prev = addrs[0]
+            for addr in addrs[1:] + [None]:
+                if addr is not None and self._can_fill(prev + 1, addr):
+                    prev = addr
+                    continue
+                vals = self.shadow[start:prev + 1]
+                self.spi.xfer([start | 0x80] + vals)
+                if addr is not None:
+                    start = prev = addr
+
+    def _can_fill(self, first, last):
+        """ True if registers first..last-1 can be rewritten with their known values """
+        if last - first > MAX_BURST_GAP:
+            return False
+        return all(r in SHADOWED and self.shadow[r] is not None for r in range(first, last))
+
+    def _get_reg(self, addr):
+        """ Read a register, from the shadow if it is a SHADOWED register already known
+        :param addr: Register address
+        :return: Register value
+        """
+        with self.register_lock:
+            if addr in SHADOWED:
+                val = self.shadow[addr]
+                if val is None:
+                    val = self.shadow[addr] = self.spi.xfer([addr, 0])[1]
+                return val
+            return self.spi.xfer([addr & 0x7F, 0])[1]
+
+    def _set_reg(self, addr, val):
+        """ Write a register. Writes to a SHADOWED register are skipped if the value is unchanged.
+        :param addr: Register address
+        :param val: New value
+        :return: Previous register value
+        """
+        with self.register_lock:
+            if addr in SHADOWED:
+                old = self.shadow[addr]
+                if old == val:
+                    return val
+                if self.pending is not None:
+                    self.shadow[addr] = self.pending[addr] = val
+                    return old
+                old = self.spi.xfer([addr | 0x80, val])[1]
+                self.shadow[addr] = val
+                return old
+            self.flush()
+            old = self.spi.xfer([addr | 0x80, val])[1]
+            if addr == REG.LORA.OP_MODE and (old ^ val) & 0x80:
+                # registers 0x0D..0x3F mean different things in LoRa and FSK modes
+                self.invalidate_shadow()
+            return old
+
+    def _get_regs(self, addr, count):
+        """ Read consecutive registers in one transfer unless all are shadowed and known
+        :return: list of register values
+        """
+        with self.register_lock:
+            regs = range(addr, addr + count)
+            if all(r in SHADOWED and self.shadow[r] is not None for r in regs):
+                return [self.shadow[r] for r in regs]
+            vals = self.spi.xfer([addr] + [0] * count)[1:]
+            for i, r in enumerate(regs):
+                if self.pending and r in self.pending:
+                    vals[i] = self.shadow[r]    # not written yet
+                elif r in SHADOWED:
+                    self.shadow[r] = vals[i]
+            return vals
+
+    def _set_regs(self, addr, vals):
+        """ Write consecutive registers in one transfer, skipped if all are shadowed and unchanged
+        :return: list of the previous register values
+        """
+        with self.register_lock:
+            regs = range(addr, addr + len(vals))
+            if all(r in SHADOWED and self.shadow[r] == v for r, v in zip(regs, vals)):
+                return list(vals)
+            if self.pending is not None and all(r in SHADOWED for r in regs):
+                old = [self.shadow[r] for r in regs]
+                for r, v in zip(regs, vals):
+                    if self.shadow[r] != v:
+                        self.shadow[r] = self.pending[r] = v
+                return old
+            self.flush()
+            old = self.spi.xfer([addr | 0x80] + list(vals))[1:]
+            for r, v in zip(regs, vals):
+                if r in SHADOWED:
+                    self.shadow[r] = v
+            return old
         
     ###########################################
     #
@@ -172,11 +409,28 @@ class LoRa(object):
 
     # Internal callbacks for add_events()
 
+    def _stamp(self, tick):
+        """ Record when the DIO edge happened so the on_*() callbacks can use it
+        :param tick: pigpio tick of the edge
+        """
+        self.irq_tick = tick
+        self.irq_time = self.tick_clock.to_monotonic(tick)
+
+    def take_irq_time(self):
+        """ The time.monotonic() time of the DIO edge being handled, now if there is none.
+        It is cleared so a later call not caused by an edge is not given a stale time.
+        :return: seconds
+        """
+        when = self.irq_time
+        self.irq_time = None
+        return time.monotonic() if when is None else when
+
     #def _dio0(self, channel):
     def _dio0(self, gpio,level,tick):
         # DIO0 00: RxDone
         # DIO0 01: TxDone
         # DIO0 10: CadDone
+        self._stamp(tick)
         if self.dio_mapping[0] == 0:
             self.on_rx_done()
         elif self.dio_mapping[0] == 1:
@@ -184,13 +438,14 @@ class LoRa(object):
         elif self.dio_mapping[0] == 2:
             self.on_cad_done()
         else:
-            raiseException(f"unknown dio0 mapping! {self.dio_mapping}")
+            raiseException(f"unknown dio0 mapping! {self.dio_mapping}", self.board)
 
     #def _dio1(self, channel):
     def _dio1(self, gpio,level,tick):
         # DIO1 00: RxTimeout
         # DIO1 01: FhssChangeChannel
         # DIO1 10: CadDetected
+        self._stamp(tick)
         if self.dio_mapping[1] == 0:
             self.on_rx_timeout()
         elif self.dio_mapping[1] == 1:
@@ -198,13 +453,14 @@ class LoRa(object):
         elif self.dio_mapping[1] == 2:
             self.on_CadDetected()
         else:
-            raiseException(f"unknown dio1 mapping! {self.dio_mapping}")
+            raiseException(f"unknown dio1 mapping! {self.dio_mapping}", self.board)
 
     #def _dio2(self, channel):
     def _dio2(self,gpio,level,tick):
         # DIO2 00: FhssChangeChannel
         # DIO2 01: FhssChangeChannel
         # DIO2 10: FhssChangeChannel
+        self._stamp(tick)
         self.on_fhss_change_channel()
 
     #def _dio3(self, channel):
@@ -212,6 +468,7 @@ class LoRa(object):
         # DIO3 00: CadDone
         # DIO3 01: ValidHeader
         # DIO3 10: PayloadCrcError
+        self._stamp(tick)
         if self.dio_mapping[3] == 0:
             self.on_cad_done()
         elif self.dio_mapping[3] == 1:
@@ -219,15 +476,15 @@ class LoRa(object):
         elif self.dio_mapping[3] == 2:
             self.on_payload_crc_error()
         else:
-            raiseException(f"unknown dio3 mapping! {self.dio_mapping}")
+            raiseException(f"unknown dio3 mapping! {self.dio_mapping}", self.board)
 
     #def _dio4(self, channel):
     def _dio4(self, gpio,level,tick):
-        raiseException("DIO4 is not used")
+        raiseException("DIO4 is not used", self.board)
 
     #def _dio5(self, channel):
     def _dio5(self, gpio,level,tick):
-        raiseException("DIO5 is not used")
+        raiseException("DIO5 is not used", self.board)
 
     # All the set/get/read/write functions
 
@@ -235,7 +492,7 @@ class LoRa(object):
         """ Get the mode
         :return:    New mode
         """
-        return self.spi.xfer([REG.LORA.OP_MODE, 0])[1]
+        return self._get_reg(REG.LORA.OP_MODE)
     
     def check_mode_ready(self,req_mode,timeout=.5):
         """check mode ready
@@ -252,7 +509,7 @@ class LoRa(object):
         while current_mode!=req_mode:
             current_mode=self.get_mode()
             if time.monotonic()>(start+timeout):
-                raiseException(f"check_mode_ready() timeout current_mode={modeStr(current_mode)} ({hexStr(current_mode)}) req_mode={modeStr(req_mode)} ({hexStr(req_mode)})")
+                raiseException(f"check_mode_ready() timeout current_mode={modeStr(current_mode)} ({hexStr(current_mode)}) req_mode={modeStr(req_mode)} ({hexStr(req_mode)})", self.board)
             time.sleep(0.0001) # typical empirical max when switching from sleep to other
             #print(".",end="")
         #print("Mode was changed")
@@ -295,34 +552,35 @@ class LoRa(object):
                 # we are transitioning to LoRA
                 if prev_mode!=MODE.HF_FSK_SLEEP:
                     #print("set_mode Switching to FSK SLEEP before switching to LORA_SLEEP")
-                    self.spi.xfer([REG.LORA.OP_MODE | 0x80, MODE.HF_FSK_SLEEP])
-                    self.check_mode_ready(MODE.HF_FSK_SLEEP)
+                    self.mode_transition.change(prev_mode, MODE.HF_FSK_SLEEP)
+                    prev_mode=MODE.HF_FSK_SLEEP
                 #print("set_mode Switching to MODE.HF_LORA_SLEEP")
-                self.spi.xfer([REG.LORA.OP_MODE | 0x80, MODE.HF_LORA_SLEEP])
-                self.check_mode_ready(MODE.HF_LORA_SLEEP)
+                self.mode_transition.change(prev_mode, MODE.HF_LORA_SLEEP)
+                prev_mode=MODE.HF_LORA_SLEEP
             else:
                 # we are transitioning to FSK (rx_chain_calibration needs it)
                 #print("set_mode Switching to mode HF_FSK_SLEEP")
                 if prev_mode!=MODE.HF_LORA_SLEEP:
-                    self.spi.xfer([REG.LORA.OP_MODE | 0x80, MODE.HF_LORA_SLEEP])
-                    self.check_mode_ready(MODE.HF_LORA_SLEEP)
+                    self.mode_transition.change(prev_mode, MODE.HF_LORA_SLEEP)
+                    prev_mode=MODE.HF_LORA_SLEEP
                 #print("set_mode Switching to FSK.SLEEP")
-                self.spi.xfer([REG.LORA.OP_MODE | 0x80, MODE.HF_FSK_SLEEP])
-                self.check_mode_ready(MODE.HF_FSK_SLEEP)
+                self.mode_transition.change(prev_mode, MODE.HF_FSK_SLEEP)
+                prev_mode=MODE.HF_FSK_SLEEP
 
         # set the new mode
         #print(f"set_mode finally changing mode to {modeStr(new_mode)}")
 
-        self.spi.xfer([REG.LORA.OP_MODE | 0x80, new_mode])
-        self.check_mode_ready(new_mode)
+        if new_mode != prev_mode:
+            self.mode_transition.change(prev_mode, new_mode)
         
         #print(f"set_mode FINISHED mode={modeStr(self.get_mode())}")
         return
 
     def write_payload(self, payload):
         """ Get FIFO ready for TX: Set FifoAddrPtr to FifoTxBaseAddr. The transceiver is put into STDBY mode.
-        :param payload: Payload to write (list)
-        :return:    Written payload
+        The payload is copied into a preallocated buffer behind the FIFO address byte and sent
+        in one transfer.
+        :param payload: Payload to write (list, bytes, bytearray or memoryview)
         """
         payload_size = len(payload)
         self.set_payload_length(payload_size)
@@ -330,9 +588,13 @@ class LoRa(object):
         self.set_mode(MODE.HF_LORA_STDBY)
         base_addr = self.get_fifo_tx_base_addr()
         self.set_fifo_addr_ptr(base_addr)
-        self.spi.xfer([REG.LORA.FIFO | 0x80] + payload)
-    
-        
+
+        self.fifo_write[1:payload_size + 1] = payload
+        frame = self.fifo_write_view[:payload_size + 1]
+        if self.writebytes2:
+            self.spi.writebytes2(frame)
+        else:
+            self.spi.xfer2(frame)
 
     def reset_ptr_rx(self):
         """ Get FIFO ready for RX: Set FifoAddrPtr to FifoRxBaseAddr. The transceiver is put into STDBY mode. """
@@ -351,23 +613,37 @@ class LoRa(object):
     def read_payload(self , nocheck = False):
         """ Read the payload from FIFO
         :param nocheck: If True then check rx_is_good()
-        :return: Payload
-        :rtype: list[int]
+        :return: Payload, a view of a preallocated buffer which the next read_payload() overwrites.
+                 Copy it (bytes(payload)) to keep it.
+        :rtype: memoryview
         """
         if not nocheck and not self.rx_is_good():
             return None
         rx_nb_bytes = self.get_rx_nb_bytes()
         fifo_rx_current_addr = self.get_fifo_rx_current_addr()
         self.set_fifo_addr_ptr(fifo_rx_current_addr)
-        payload = self.spi.xfer([REG.LORA.FIFO] + [0] * rx_nb_bytes)[1:]
-        return payload
+        # the byte clocked out with the address is kept in fifo_read[0]
+        self.fifo_read[:rx_nb_bytes + 1] = self.spi.xfer2(self.fifo_read_cmd[:rx_nb_bytes + 1])
+        return self.fifo_read_view[1:rx_nb_bytes + 1]
+
+    def readinto_payload(self, buf, nocheck=False):
+        """ Read the payload from FIFO into buf
+        :param buf: bytearray (or writable memoryview) of at least the payload length
+        :param nocheck: If True then check rx_is_good()
+        :return: number of bytes read, None if rx_is_good() failed
+        """
+        payload = self.read_payload(nocheck)
+        if payload is None:
+            return None
+        buf[:len(payload)] = payload
+        return len(payload)
 
     def get_freq(self):
         """ Get the frequency (MHz)
         :return:    Frequency in MHz
         :rtype:     float
         """
-        msb, mid, lsb = self.spi.xfer([REG.LORA.FR_MSB, 0, 0, 0])[1:]
+        msb, mid, lsb = self._get_regs(REG.LORA.FR_MSB, 3)
         f = lsb + 256*(mid + 256*msb)
         return f / 16384.
 
@@ -392,10 +668,24 @@ class LoRa(object):
         mid = i // 256
         i -= mid * 256
         lsb = i
-        return self.spi.xfer([REG.LORA.FR_MSB | 0x80, msb, mid, lsb])
+        return [0] + self._set_regs(REG.LORA.FR_MSB, [msb, mid, lsb])
+
+    def write_profile(self, image):
+        """ Write a precomputed register image, see radio_profiles.py
+        The radio is put in STDBY first unless it is in SLEEP or STDBY.
+        :param image: tuple of (first register, values, keep masks)
+        """
+        if self.get_mode() & 0x07 not in (0, 1):
+            self.set_mode(MODE.HF_LORA_STDBY)
+        with self.transaction():
+            for addr, vals, keep in image:
+                if any(keep):
+                    vals = [v | (self._get_reg(addr + i) & k) if k else v
+                            for i, (v, k) in enumerate(zip(vals, keep))]
+                self._set_regs(addr, vals)
 
     def get_pa_config(self, convert_dBm=False):
-        v = self.spi.xfer([REG.LORA.PA_CONFIG, 0])[1]
+        v = self._get_reg(REG.LORA.PA_CONFIG)
         pa_select    = v >> 7
         max_power    = v >> 4 & 0b111
         output_power = v & 0b1111
@@ -420,7 +710,7 @@ class LoRa(object):
         current = self.get_pa_config()
         loc = {s: current[s] if loc[s] is None else loc[s] for s in loc}
         val = (loc['pa_select'] << 7) | (loc['max_power'] << 4) | (loc['output_power'])
-        return self.spi.xfer([REG.LORA.PA_CONFIG | 0x80, val])[1]
+        return self._set_reg(REG.LORA.PA_CONFIG, val)
 
     @getter(REG.LORA.PA_RAMP)
     def get_pa_ramp(self, val):
@@ -431,7 +721,7 @@ class LoRa(object):
         return val & 0b1111
 
     def get_ocp(self, convert_mA=False):
-        v = self.spi.xfer([REG.LORA.OCP, 0])[1]
+        v = self._get_reg(REG.LORA.OCP)
         ocp_on = v >> 5 & 0x01
         ocp_trim = v & 0b11111
         if convert_mA:
@@ -448,16 +738,16 @@ class LoRa(object):
 
     def set_ocp_trim(self, I_mA):
         assert(I_mA >= 45 and I_mA <= 240)
-        ocp_on = self.spi.xfer([REG.LORA.OCP, 0])[1] >> 5 & 0x01
+        ocp_on = self._get_reg(REG.LORA.OCP) >> 5 & 0x01
         if I_mA <= 120:
             v = int(round((I_mA-45.)/5.))
         else:
             v = int(round((I_mA+30.)/10.))
         v = set_bit(v, 5, ocp_on)
-        return self.spi.xfer([REG.LORA.OCP | 0x80, v])[1]
+        return self._set_reg(REG.LORA.OCP, v)
 
     def get_lna(self):
-        v = self.spi.xfer([REG.LORA.LNA, 0])[1]
+        v = self._get_reg(REG.LORA.LNA)
         return dict(
                 lna_gain     = v >> 5,
                 lna_boost_lf = v >> 3 & 0b11,
@@ -474,7 +764,7 @@ class LoRa(object):
         current = self.get_lna()
         loc = {s: current[s] if loc[s] is None else loc[s] for s in loc}
         val = (loc['lna_gain'] << 5) | (loc['lna_boost_lf'] << 3) | (loc['lna_boost_hf'])
-        retval = self.spi.xfer([REG.LORA.LNA | 0x80, val])[1]
+        retval = self._set_reg(REG.LORA.LNA, val)
         if lna_gain is not None:
             # agc_auto_on must track lna_gain: GAIN=NOT_USED -> agc_auto=ON, otherwise =OFF
             self.set_agc_auto_on(lna_gain == GAIN.NOT_USED)
@@ -484,31 +774,31 @@ class LoRa(object):
         self.set_lna(lna_gain=lna_gain)
 
     def get_fifo_addr_ptr(self):
-        return self.spi.xfer([REG.LORA.FIFO_ADDR_PTR, 0])[1]
+        return self._get_reg(REG.LORA.FIFO_ADDR_PTR)
 
     def set_fifo_addr_ptr(self, ptr):
-        return self.spi.xfer([REG.LORA.FIFO_ADDR_PTR | 0x80, ptr])[1]
+        return self._set_reg(REG.LORA.FIFO_ADDR_PTR, ptr)
 
     def get_fifo_tx_base_addr(self):
-        return self.spi.xfer([REG.LORA.FIFO_TX_BASE_ADDR, 0])[1]
+        return self._get_reg(REG.LORA.FIFO_TX_BASE_ADDR)
 
     def set_fifo_tx_base_addr(self, ptr):
-        return self.spi.xfer([REG.LORA.FIFO_TX_BASE_ADDR | 0x80, ptr])[1]
+        return self._set_reg(REG.LORA.FIFO_TX_BASE_ADDR, ptr)
 
     def get_fifo_rx_base_addr(self):
-        return self.spi.xfer([REG.LORA.FIFO_RX_BASE_ADDR, 0])[1]
+        return self._get_reg(REG.LORA.FIFO_RX_BASE_ADDR)
 
     def set_fifo_rx_base_addr(self, ptr):
-        return self.spi.xfer([REG.LORA.FIFO_RX_BASE_ADDR | 0x80, ptr])[1]
+        return self._set_reg(REG.LORA.FIFO_RX_BASE_ADDR, ptr)
 
     def get_fifo_rx_current_addr(self):
-        return self.spi.xfer([REG.LORA.FIFO_RX_CURR_ADDR, 0])[1]
+        return self._get_reg(REG.LORA.FIFO_RX_CURR_ADDR)
 
     def get_fifo_rx_byte_addr(self):
-        return self.spi.xfer([REG.LORA.FIFO_RX_BYTE_ADDR, 0])[1]
+        return self._get_reg(REG.LORA.FIFO_RX_BYTE_ADDR)
 
     def get_irq_flags_mask(self):
-        v = self.spi.xfer([REG.LORA.IRQ_FLAGS_MASK, 0])[1]
+        v = self._get_reg(REG.LORA.IRQ_FLAGS_MASK)
         return dict(
                 rx_timeout     = v >> 7 & 0x01,
                 rx_done        = v >> 6 & 0x01,
@@ -524,16 +814,16 @@ class LoRa(object):
                            rx_timeout=None, rx_done=None, crc_error=None, valid_header=None, tx_done=None,
                            cad_done=None, fhss_change_ch=None, cad_detected=None):
         loc = locals()
-        v = self.spi.xfer([REG.LORA.IRQ_FLAGS_MASK, 0])[1]
+        v = self._get_reg(REG.LORA.IRQ_FLAGS_MASK)
         for i, s in enumerate(['cad_detected', 'fhss_change_ch', 'cad_done', 'tx_done', 'valid_header',
                                'crc_error', 'rx_done', 'rx_timeout']):
             this_bit = locals()[s]
             if this_bit is not None:
                 v = set_bit(v, i, this_bit)
-        return self.spi.xfer([REG.LORA.IRQ_FLAGS_MASK | 0x80, v])[1]
+        return self._set_reg(REG.LORA.IRQ_FLAGS_MASK, v)
 
     def get_irq_flags(self):
-        v = self.spi.xfer([REG.LORA.IRQ_FLAGS, 0])[1]
+        v = self._get_reg(REG.LORA.IRQ_FLAGS)
         return dict(
                 rx_timeout     = v >> 7 & 0x01,
                 rx_done        = v >> 6 & 0x01,
@@ -548,13 +838,13 @@ class LoRa(object):
     def set_irq_flags(self,
                       rx_timeout=None, rx_done=None, crc_error=None, valid_header=None, tx_done=None,
                       cad_done=None, fhss_change_ch=None, cad_detected=None):
-        v = self.spi.xfer([REG.LORA.IRQ_FLAGS, 0])[1]
+        v = self._get_reg(REG.LORA.IRQ_FLAGS)
         for i, s in enumerate(['cad_detected', 'fhss_change_ch', 'cad_done', 'tx_done', 'valid_header',
                                'crc_error', 'rx_done', 'rx_timeout']):
             this_bit = locals()[s]
             if this_bit is not None:
                 v = set_bit(v, i, this_bit)
-        return self.spi.xfer([REG.LORA.IRQ_FLAGS | 0x80, v])[1]
+        return self._set_reg(REG.LORA.IRQ_FLAGS, v)
 
     def clear_irq_flags(self,
                         RxTimeout=None, RxDone=None, PayloadCrcError=None, 
@@ -567,22 +857,22 @@ class LoRa(object):
             this_bit = locals()[s]
             if this_bit is not None:
                 v = set_bit(v, eval('MASK.IRQ_FLAGS.' + s), this_bit)
-        return self.spi.xfer([REG.LORA.IRQ_FLAGS | 0x80, v])[1]
+        return self._set_reg(REG.LORA.IRQ_FLAGS, v)
 
 
     def get_rx_nb_bytes(self):
-        return self.spi.xfer([REG.LORA.RX_NB_BYTES, 0])[1]
+        return self._get_reg(REG.LORA.RX_NB_BYTES)
 
     def get_rx_header_cnt(self):
-        msb, lsb = self.spi.xfer([REG.LORA.RX_HEADER_CNT_MSB, 0, 0])[1:]
+        msb, lsb = self._get_regs(REG.LORA.RX_HEADER_CNT_MSB, 2)
         return lsb + 256 * msb
 
     def get_rx_packet_cnt(self):
-        msb, lsb = self.spi.xfer([REG.LORA.RX_PACKET_CNT_MSB, 0, 0])[1:]
+        msb, lsb = self._get_regs(REG.LORA.RX_PACKET_CNT_MSB, 2)
         return lsb + 256 * msb
 
     def get_modem_status(self):
-        status = self.spi.xfer([REG.LORA.MODEM_STAT, 0])[1]
+        status = self._get_reg(REG.LORA.MODEM_STAT)
         return dict(
                 rx_coding_rate    = status >> 5 & 0x03,
                 modem_clear       = status >> 4 & 0x01,
@@ -593,19 +883,19 @@ class LoRa(object):
             )
 
     def get_pkt_snr_value(self):
-        v = self.spi.xfer([REG.LORA.PKT_SNR_VALUE, 0])[1]
+        v = self._get_reg(REG.LORA.PKT_SNR_VALUE)
         return float(256-v) / 4.
 
     def get_pkt_rssi_value(self):
-        v = self.spi.xfer([REG.LORA.PKT_RSSI_VALUE, 0])[1]
+        v = self._get_reg(REG.LORA.PKT_RSSI_VALUE)
         return v - 157
 
     def get_rssi_value(self):
-        v = self.spi.xfer([REG.LORA.RSSI_VALUE, 0])[1]
+        v = self._get_reg(REG.LORA.RSSI_VALUE)
         return v - 157
 
     def get_hop_channel(self):
-        v = self.spi.xfer([REG.LORA.HOP_CHANNEL, 0])[1]
+        v = self._get_reg(REG.LORA.HOP_CHANNEL)
         return dict(
                 pll_timeout          = v >> 7,
                 crc_on_payload       = v >> 6 & 0x01,
@@ -613,7 +903,7 @@ class LoRa(object):
             )
 
     def get_modem_config_1(self):
-        val = self.spi.xfer([REG.LORA.MODEM_CONFIG_1, 0])[1]
+        val = self._get_reg(REG.LORA.MODEM_CONFIG_1)
         return dict(
                 bw = val >> 4 & 0x0F,
                 coding_rate = val >> 1 & 0x07,
@@ -625,7 +915,7 @@ class LoRa(object):
         current = self.get_modem_config_1()
         loc = {s: current[s] if loc[s] is None else loc[s] for s in loc}
         val = loc['implicit_header_mode'] | (loc['coding_rate'] << 1) | (loc['bw'] << 4)
-        return self.spi.xfer([REG.LORA.MODEM_CONFIG_1 | 0x80, val])[1]
+        return self._set_reg(REG.LORA.MODEM_CONFIG_1, val)
 
     def set_bw(self, bw):
         """ Set the bandwidth 0=7.8kHz ... 9=500kHz
@@ -646,7 +936,7 @@ class LoRa(object):
         self.set_modem_config_1(implicit_header_mode=implicit_header_mode)
         
     def get_modem_config_2(self, include_symb_timout_lsb=False):
-        val = self.spi.xfer([REG.LORA.MODEM_CONFIG_2, 0])[1]
+        val = self._get_reg(REG.LORA.MODEM_CONFIG_2)
         d = dict(
                 spreading_factor = val >> 4 & 0x0F,
                 tx_cont_mode = val >> 3 & 0x01,
@@ -662,7 +952,7 @@ class LoRa(object):
         current = self.get_modem_config_2(include_symb_timout_lsb=True)
         loc = {s: current[s] if loc[s] is None else loc[s] for s in loc}
         val = (loc['spreading_factor'] << 4) | (loc['tx_cont_mode'] << 3) | (loc['rx_crc'] << 2) | current['symb_timout_lsb']
-        return self.spi.xfer([REG.LORA.MODEM_CONFIG_2 | 0x80, val])[1]
+        return self._set_reg(REG.LORA.MODEM_CONFIG_2, val)
 
     def set_spreading_factor(self, spreading_factor):
         self.set_modem_config_2(spreading_factor=spreading_factor)
@@ -672,7 +962,7 @@ class LoRa(object):
         self.set_modem_config_2(rx_crc=rx_crc)
 
     def get_modem_config_3(self):
-        val = self.spi.xfer([REG.LORA.MODEM_CONFIG_3, 0])[1]
+        val = self._get_reg(REG.LORA.MODEM_CONFIG_3)
         return dict(
                 low_data_rate_optim = val >> 3 & 0x01,
                 agc_auto_on = val >> 2 & 0x01
@@ -683,7 +973,7 @@ class LoRa(object):
         current = self.get_modem_config_3()
         loc = {s: current[s] if loc[s] is None else loc[s] for s in loc}
         val = (loc['low_data_rate_optim'] << 3) | (loc['agc_auto_on'] << 2)
-        return self.spi.xfer([REG.LORA.MODEM_CONFIG_3 | 0x80, val])[1]
+        return self._set_reg(REG.LORA.MODEM_CONFIG_3, val)
 
     @setter(REG.LORA.INVERT_IQ)
     def set_invert_iq(self, invert):
@@ -714,27 +1004,27 @@ class LoRa(object):
 
     def get_symb_timeout(self):
         SYMB_TIMEOUT_MSB = REG.LORA.MODEM_CONFIG_2
-        msb, lsb = self.spi.xfer([SYMB_TIMEOUT_MSB, 0, 0])[1:]    # the MSB bits are stored in REG.LORA.MODEM_CONFIG_2
+        msb, lsb = self._get_regs(SYMB_TIMEOUT_MSB, 2)    # the MSB bits are stored in REG.LORA.MODEM_CONFIG_2
         msb = msb & 0b11
         return lsb + 256 * msb
 
     def set_symb_timeout(self, timeout):
-        bkup_reg_modem_config_2 = self.spi.xfer([REG.LORA.MODEM_CONFIG_2, 0])[1]
+        bkup_reg_modem_config_2 = self._get_reg(REG.LORA.MODEM_CONFIG_2)
         msb = timeout >> 8 & 0b11    # bits 8-9
         lsb = timeout - 256 * msb    # bits 0-7
         reg_modem_config_2 = bkup_reg_modem_config_2 & 0xFC | msb    # bits 2-7 of bkup_reg_modem_config_2 ORed with the two msb bits
-        old_msb = self.spi.xfer([REG.LORA.MODEM_CONFIG_2  | 0x80, reg_modem_config_2])[1] & 0x03
-        old_lsb = self.spi.xfer([REG.LORA.SYMB_TIMEOUT_LSB | 0x80, lsb])[1]
+        old_msb = self._set_reg(REG.LORA.MODEM_CONFIG_2, reg_modem_config_2) & 0x03
+        old_lsb = self._set_reg(REG.LORA.SYMB_TIMEOUT_LSB, lsb)
         return old_lsb + 256 * old_msb
 
     def get_preamble(self):
-        msb, lsb = self.spi.xfer([REG.LORA.PREAMBLE_MSB, 0, 0])[1:]
+        msb, lsb = self._get_regs(REG.LORA.PREAMBLE_MSB, 2)
         return lsb + 256 * msb
 
     def set_preamble(self, preamble):
         msb = preamble >> 8
         lsb = preamble - msb * 256
-        old_msb, old_lsb = self.spi.xfer([REG.LORA.PREAMBLE_MSB | 0x80, msb, lsb])[1:]
+        old_msb, old_lsb = self._set_regs(REG.LORA.PREAMBLE_MSB, [msb, lsb])
         return old_lsb + 256 * old_msb
         
     @getter(REG.LORA.PAYLOAD_LENGTH)
@@ -762,7 +1052,7 @@ class LoRa(object):
         return hop_period
 
     def get_fei(self):
-        msb, mid, lsb = self.spi.xfer([REG.LORA.FEI_MSB, 0, 0, 0])[1:]
+        msb, mid, lsb = self._get_regs(REG.LORA.FEI_MSB, 3)
         msb &= 0x0F
         freq_error = lsb + 256 * (mid + 256 * msb)
         return freq_error
@@ -920,7 +1210,7 @@ class LoRa(object):
         elif pa_dac == 0x07:
             return True
         else:
-            raiseException(f"Bad PA_DAC value {hexStr(pa_dac)}")
+            raiseException(f"Bad PA_DAC value {hexStr(pa_dac)}", self.board)
 
     @setter(REG.LORA.PA_DAC)
     def set_pa_dac(self, pa_dac):
@@ -981,27 +1271,71 @@ class LoRa(object):
         return result_list
 
     def get_register(self, register_address):
-        return self.spi.xfer([register_address & 0x7F, 0])[1]
+        return self._get_reg(register_address & 0x7F)
 
     def set_register(self, register_address, val):
-        return self.spi.xfer([register_address | 0x80, val])[1]
+        return self._set_reg(register_address & 0x7F, val)
 
-    def get_all_registers(self):
-        # read all registers
-        reg = [0] + self.spi.xfer([1]+[0]*0x3E)[1:]
+    def get_all_registers(self, last=0x3F):
+        # read all registers, 0x01..last in one transfer
+        self.flush()
+        reg = [0] + self.spi.xfer([1]+[0]*last)[1:]
         return reg
 
+    def snapshot(self):
+        """ Read the configuration registers in one burst, for restore() or LoRa(snapshot=...)
+        Call in LoRa SLEEP or STDBY mode once the radio has been set up.
+        :return: dict with the chip version, the first register address and the register values
+        """
+        reg = self.get_all_registers(SNAPSHOT_LAST)
+        return dict(version=reg[REG.LORA.VERSION], first=SNAPSHOT_FIRST, registers=reg[SNAPSHOT_FIRST:])
+
+    def restore(self, snapshot):
+        """ Write a snapshot() back in one burst and prime the shadow with it
+        The chip must be in LoRa SLEEP or STDBY mode. Read only registers ignore the
+        write, the IRQ flags are all cleared.
+        :param snapshot: from snapshot()
+        """
+        first = snapshot['first']
+        vals = list(snapshot['registers'])
+        vals[REG.LORA.IRQ_FLAGS - first] = 0xFF
+        with self.register_lock:
+            self.flush()
+            self.spi.xfer([first | 0x80] + vals)
+            for r, v in enumerate(vals, first):
+                if r in SHADOWED:
+                    self.shadow[r] = v
+
+    def matches_snapshot(self, snapshot):
+        """ True if the known SHADOWED registers hold the values in snapshot, i.e.
+        nothing has been reconfigured since it was taken or restored
+        """
+        first = snapshot['first']
+        return all(self.shadow[r] in (None, v) for r, v in enumerate(snapshot['registers'], first)
+                   if r in SHADOWED)
+
+    @staticmethod
+    def _snapshot_fits(snapshot, version, mode):
+        """ True if snapshot can be restored to a chip with this version in this mode """
+        try:
+            return (mode & 0x80 == 0x80
+                    and snapshot['version'] == version
+                    and snapshot['first'] == SNAPSHOT_FIRST
+                    and len(snapshot['registers']) == SNAPSHOT_LAST - SNAPSHOT_FIRST + 1)
+        except (TypeError, KeyError):
+            return False
+
     def __del__(self):
         # test if SPI was closed, if not close it
         vsn=self.get_version()
         if vsn!=0:
-            BOARD.teardown()
+            self.board.teardown()
 
     def __str__(self):
         # don't use __str__ while in any mode other that SLEEP or STDBY
         cur_mode=self.get_mode()
         if not cur_mode & 0x07 in [0,1]:
-            raiseException("__str__() should only be used on STDBY or SLEEP")
+            raiseException("__str__() should only be used on STDBY or SLEEP", self.board)
 
         onoff = lambda i: 'ON' if i else 'OFF'
         f = self.get_freq()
@@ -1075,7 +1409,7 @@ class LoRa(object):
         bw=cfg1["bw"]
 
         bwHz = BANDWIDTH_HZ[bw]
-        symbolTime = 1000.0 * (sf ** 2) / bwHz  # ms
+        symbolTime = 1000.0 * (1 << sf) / bwHz  # ms
 
         if symbolTime > 16.0:
             self.set_low_data_rate_optim(1)
@@ -22,13 +22,22 @@
 # Modified 2018-01-10 Philip Basford to be compatible with the dragino LoRa HAT
 # modified 2024-08-09 Brian Norman to use pigpio on Bookworm 
 
-import pigpio
-import spidev
+import os
 import time
 
+# DRAGINO_EMULATOR=1 runs on the software model of the SX127x, see emulator.py
+EMULATOR=os.environ.get("DRAGINO_EMULATOR","") not in ("","0")
+
+if EMULATOR:
+    from . import emulator as pigpio
+    from . import emulator as spidev
+else:
+    import pigpio
+    import spidev
+
 GPIO=pigpio.pi()
 
-class BOARD:
+class Board:
     """ 
 	Board initialisation/teardown and pin configuration is kept here.
     This is the Raspberry Pi board with a Dragino LoRa/GPS HAT
@@ -39,80 +48,139 @@ class BOARD:
 	but the HAT uses GPIO2 for the CS
 	
 	NOTE ALSO the PIN values below are BCM numbers which pigpio uses
+
+    Each radio module has its own Board with its own pins, SPI device and
+    DIO callbacks. BOARD, below, is the Dragino HAT and the default for
+    LoRa and Dragino. A second module e.g. on the other chip select is
+
+        board2 = Board(rst=..., dio0=..., dio1=..., dio2=..., spi_cs=1)
+        D2 = Dragino("dragino2.toml", board=board2)
 	"""
 	
+    # Dragino HAT defaults
     RST = 11	# Pin 23
     DIO0 = 4    # Pin 7 
     DIO1 = 23   # Pin 16
     DIO2 = 24   # Pin 18
     DIO3 = None # Not connected on dragino header
+    DIO5 = None # ModeReady, not connected on dragino header
+    SPI_BUS = 0 # Pi SPI bus 0 (MOSI,MISO,SCLK)
     SPI_CS = 2  # Pin 3 - Chip Select pin to use
-	
-    # The spi object (channel 0) is kept here
-    spi = None
 
-    @staticmethod
-    def setup():
+    open_count = 0  # SPI devices open on all boards, the pigpio connection is stopped when the last closes
+
+    def __init__(self, rst=RST, dio0=DIO0, dio1=DIO1, dio2=DIO2, dio3=DIO3, dio5=DIO5,
+                 spi_bus=SPI_BUS, spi_cs=SPI_CS, pi=None):
+        """
+        :param rst: BCM pin of the radio reset, None if not connected
+        :param dio0..dio5: BCM pins of the DIO outputs, None if not connected
+        :param spi_bus: The RPi SPI bus to use: 0 or 1
+        :param spi_cs: The RPi SPI chip select to use
+        :param pi: pigpio.pi connection, default the shared one
+        """
+        self.RST = rst
+        self.DIO0 = dio0
+        self.DIO1 = dio1
+        self.DIO2 = dio2
+        self.DIO3 = dio3
+        self.DIO5 = dio5
+        self.SPI_BUS = spi_bus
+        self.SPI_CS = spi_cs
+        self.gpio = GPIO if pi is None else pi
+
+        # The spi object is kept here
+        self.spi = None
+        # pigpio callbacks of the DIO pins, cancelled by teardown()
+        self.callbacks = []
+
+        if EMULATOR:
+            pigpio.connect(spi_bus, spi_cs, [dio0, dio1, dio2, dio3, None, dio5], rst)
+
+    def setup(self):
         """ Configure the Raspberry GPIOs
         :rtype : None
         """
         print("Configuring GPIOs")
         
         # DIOx
-        for gpio_pin in [BOARD.DIO0, BOARD.DIO1, BOARD.DIO2, BOARD.DIO3]:
+        for gpio_pin in [self.DIO0, self.DIO1, self.DIO2, self.DIO3]:
             if gpio_pin is not None:
-                GPIO.set_mode(gpio_pin, pigpio.INPUT)
-                GPIO.set_pull_up_down(gpio_pin,pigpio.PUD_DOWN)
+                self.gpio.set_mode(gpio_pin, pigpio.INPUT)
+                self.gpio.set_pull_up_down(gpio_pin,pigpio.PUD_DOWN)
                 
-    @staticmethod
-    def reset_radio():
+    def reset_radio(self):
         print("BOARD.reset_radio()")
         try:
-            GPIO.set_mode(BOARD.RST,pigpio.OUTPUT)
-            GPIO.write(BOARD.RST, pigpio.LOW)
+            self.gpio.set_mode(self.RST,pigpio.OUTPUT)
+            self.gpio.write(self.RST, pigpio.LOW)
             time.sleep(0.001) # must be > 100us
-            GPIO.write(BOARD.RST, pigpio.HIGH)
+            self.gpio.write(self.RST, pigpio.HIGH)
             time.sleep(0.01) # chip needs 5ms to reset
         except Exception as e:
             print(f"Unable to reset the RFM95. Reason {e}")
 
-    @staticmethod
-    def teardown():
-        """ Cleanup GPIO and SpiDev """
+    def teardown(self):
+        """ Cleanup the DIO callbacks and SpiDev, the shared pigpio connection once no board uses it """
+        for cb in self.callbacks:
+            cb.cancel()
+        self.callbacks = []
+        if self.spi is None:
+            return
         print("\nClosing SPI")
-        BOARD.spi.close()
-        GPIO.stop()
+        self.spi.close()
+        self.spi = None
+        Board.open_count -= 1
+        if self.gpio is GPIO and Board.open_count == 0:
+            GPIO.stop()
 
-    @staticmethod
-    def SpiDev(spi_bus=0, spi_cs=SPI_CS):
+    def SpiDev(self, spi_bus=None, spi_cs=None):
         """ Init and return the SpiDev object
         :return: SpiDev object
-        :param spi_bus: The RPi SPI bus to use: 0 or 1
-        :param spi_cs: The RPi SPI chip select to use: 0 or 1
+        :param spi_bus: The RPi SPI bus to use, default the board's
+        :param spi_cs: The RPi SPI chip select to use, default the board's
         :rtype: SpiDev
         """
-        BOARD.spi = spidev.SpiDev()
-        BOARD.spi.open(spi_bus, spi_cs)
+        if self.spi is None:
+            Board.open_count += 1
+        else:
+            self.spi.close()
+        self.spi = spidev.SpiDev()
+        self.spi.open(self.SPI_BUS if spi_bus is None else spi_bus,
+                      self.SPI_CS if spi_cs is None else spi_cs)
         print("BOARD SpiDev created")
-        return BOARD.spi
+        return self.spi
+
+    def read_pin(self, gpio):
+        """ Read the level of an input pin e.g. DIO5 (ModeReady)
+        :param gpio: BCM pin number
+        :return: 0 or 1
+        """
+        return self.gpio.read(gpio)
 
-    @staticmethod
-    def add_event_detect(dio_number, callback):
+    def get_tick(self):
+        """ The pigpio tick, microseconds since boot wrapping at 2**32, as passed to the DIO callbacks
+        :return: int
+        """
+        return self.gpio.get_current_tick()
+
+    def add_event_detect(self, dio_number, callback):
         """ Wraps around the GPIO.add_event_detect function
         :param dio_number: DIO pin 0...5
         :param callback: The function to call when the DIO triggers an IRQ.
         :return: None
         """
-        GPIO.callback(dio_number, pigpio.RISING_EDGE, callback)
-
-    @staticmethod
-    def add_events(cb_dio0, cb_dio1, cb_dio2, cb_dio3, cb_dio4, cb_dio5, switch_cb=None):
-        if BOARD.DIO0 is not None:
-            cb0=BOARD.add_event_detect(BOARD.DIO0, callback=cb_dio0)
-        if BOARD.DIO1 is not None:
-            cb1=BOARD.add_event_detect(BOARD.DIO1, callback=cb_dio1)
-        if BOARD.DIO2 is not None:
-            cb2=BOARD.add_event_detect(BOARD.DIO2, callback=cb_dio2)
-        if BOARD.DIO3 is not None:
-            cb3=BOARD.add_event_detect(BOARD.DIO3, callback=cb_dio3)
+        self.callbacks.append(self.gpio.callback(dio_number, pigpio.RISING_EDGE, callback))
+
+    def add_events(self, cb_dio0, cb_dio1, cb_dio2, cb_dio3, cb_dio4, cb_dio5, switch_cb=None):
+        if self.DIO0 is not None:
+            self.add_event_detect(self.DIO0, callback=cb_dio0)
+        if self.DIO1 is not None:
+            self.add_event_detect(self.DIO1, callback=cb_dio1)
+        if self.DIO2 is not None:
+            self.add_event_detect(self.DIO2, callback=cb_dio2)
+        if self.DIO3 is not None:
+            self.add_event_detect(self.DIO3, callback=cb_dio3)
+
 
+# the Dragino LoRa/GPS HAT, used by LoRa and Dragino unless given another Board
+BOARD = Board()
@@ -0,0 +1,153 @@
+""" Mode transition engine for the SX127x.
+
+Changing the mode (SLEEP, STDBY, TX, RX...) is not instant. The chip needs
+up to about 250us to start its oscillator when leaving SLEEP and about 60us
+to lock the PLL when entering FSTX/FSRX, TX or RX.
+
+A transition is complete when either
+
+    - the board has DIO5 wired and mapped to ModeReady (DIO5 mapping 00)
+      and the pin goes high. The pin is polled, not the SPI bus. Or
+
+    - after a calibrated wait the mode register reads back as requested.
+      The wait for each (from, to) pair starts at INITIAL_WAIT and is
+      tuned as transitions are made: shortened a little each time the
+      first read succeeds, lengthened to the measured latency when it
+      doesn't. So most transitions cost a single SPI read.
+
+Either way the latency of every transition is recorded in a histogram per
+(from, to) pair, see report().
+"""
+
+import time
+from .constants import MODE, REG
+
+
+def mode_name(mode):
+    return MODE.lookup.get(mode, "0x%0.2X" % mode)
+
+
+class ModeTransition(object):
+
+    # histogram bucket upper limits in microseconds, the last bucket is everything above
+    BUCKETS_US = (50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+    INITIAL_WAIT = 0.0001       # seconds before the first read of a new (from, to) pair
+    MIN_WAIT = 0.00002
+    SHRINK = 0.9                # wait is multiplied by this after a first time success
+    POLL_INTERVAL = 0.0001      # between reads if the first read fails
+
+    def __init__(self, lora, mode_ready_pin=None, read_pin=None, timeout=.5):
+        """
+        :param lora: the LoRa object whose mode is changed
+        :param mode_ready_pin: GPIO of DIO5 if the board has it connected, else None
+        :param read_pin: function(gpio) returning the pin level, e.g. BOARD.read_pin
+        :param timeout: seconds before a transition is declared to have failed
+        """
+        self.lora = lora
+        self.mode_ready_pin = mode_ready_pin if read_pin is not None else None
+        self.read_pin = read_pin
+        self.timeout = timeout
+
+        self.wait = {}          # (from, to) -> seconds to wait before reading the mode
+        self.histogram = {}     # (from, to) -> counts per BUCKETS_US, plus one for longer
+        self.total = {}         # (from, to) -> [count, total seconds, max seconds, spi reads]
+
+    def change(self, prev_mode, new_mode):
+        """ Write the new mode and wait for the chip to reach it
+
+        :param prev_mode: mode before the change (for the statistics)
+        :param new_mode: requested mode
+        :return: latency in seconds
+        """
+        self.lora._set_reg(REG.LORA.OP_MODE, new_mode)
+        start = time.monotonic()
+
+        if self.mode_ready_pin is not None:
+            reads = self._wait_pin(new_mode, start)
+        else:
+            reads = self._wait_then_verify(prev_mode, new_mode, start)
+
+        latency = time.monotonic() - start
+        self._record((prev_mode, new_mode), latency, reads)
+        return latency
+
+    def _wait_pin(self, new_mode, start):
+        """ poll ModeReady on DIO5 then confirm the mode with one read """
+        while not self.read_pin(self.mode_ready_pin):
+            self._check_timeout(new_mode, start)
+        self._verify(new_mode, start)
+        return 1
+
+    def _wait_then_verify(self, prev_mode, new_mode, start):
+        """ wait the calibrated time then read the mode until it matches """
+        key = (prev_mode, new_mode)
+        wait = self.wait.get(key, self.INITIAL_WAIT)
+        time.sleep(wait)
+
+        reads = self._verify(new_mode, start)
+
+        if reads == 1:
+            # try a little shorter next time to find the real latency
+            self.wait[key] = max(self.MIN_WAIT, wait * self.SHRINK)
+        else:
+            self.wait[key] = time.monotonic() - start
+        return reads
+
+    def _verify(self, new_mode, start):
+        """ :return: number of SPI reads needed to see the new mode """
+        reads = 1
+        while self.lora.get_mode() != new_mode:
+            self._check_timeout(new_mode, start)
+            time.sleep(self.POLL_INTERVAL)
+            reads += 1
+        return reads
+
+    def _check_timeout(self, new_mode, start):
+        if time.monotonic() > start + self.timeout:
+            current = self.lora.get_mode()
+            raise Exception(f"mode change timeout current_mode={mode_name(current)} req_mode={mode_name(new_mode)}")
+
+    def _record(self, key, latency, reads):
+        us = latency * 1e6
+        counts = self.histogram.get(key)
+        if counts is None:
+            counts = self.histogram[key] = [0] * (len(self.BUCKETS_US) + 1)
+            self.total[key] = [0, 0.0, 0.0, 0]
+        i = 0
+        while i < len(self.BUCKETS_US) and us > self.BUCKETS_US[i]:
+            i += 1
+        counts[i] += 1
+
+        total = self.total[key]
+        total[0] += 1
+        total[1] += latency
+        total[2] = max(total[2], latency)
+        total[3] += reads
+
+    def reset_stats(self):
+        """ clear the histograms, the calibrated waits are kept """
+        self.histogram = {}
+        self.total = {}
+
+    def report(self):
+        """ The latency histograms
+
+        :return: dict keyed by "FROM->TO" mode names, each with count, mean_us, max_us,
+                 spi_reads (mean per transition), wait_us (calibrated wait) and
+                 buckets {"<=50us": n, ..., ">10000us": n}
+        """
+        labels = [f"<={b}us" for b in self.BUCKETS_US] + [f">{self.BUCKETS_US[-1]}us"]
+        result = {}
+        for key, counts in self.histogram.items():
+            count, total, longest, reads = self.total[key]
+            wait = self.wait.get(key)
+            result[f"{mode_name(key[0])}->{mode_name(key[1])}"] = dict(
+                count=count,
+                mean_us=round(total / count * 1e6, 1),
+                max_us=round(longest * 1e6, 1),
+                spi_reads=round(reads / count, 2),
+                wait_us=None if wait is None else round(wait * 1e6, 1),
+                buckets=dict(zip(labels, counts)),
+            )
+        return result
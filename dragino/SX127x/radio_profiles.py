@@ -0,0 +1,73 @@
+""" Precomputed register images for the SX127x.
+
+A profile is everything that changes when the radio is switched between
+join, uplink and receive window settings: frequency, PA config, bandwidth,
+spreading factor, low data rate optimisation and IQ inversion. Working these
+out takes a few dozen Python operations and some register reads, so they
+are computed once per (role, frequency, sf, bw) and kept. Switching is then
+a dictionary lookup plus LoRa.write_profile(), which sends the image in one
+transaction (three burst transfers).
+
+An image is a tuple of runs (first register, values, keep) where keep is a
+mask per register of the bits left as they are on the chip, e.g. the coding
+rate in MODEM_CONFIG_1.
+"""
+
+from .constants import REG, BANDWIDTH_HZ
+
+TX = 0      # uplinks, IQ not inverted
+RX = 1      # receive windows, IQ inverted
+
+
+def freq_bytes(f):
+    """ :return: (msb, mid, lsb) of the frequency registers for f MHz, as LoRa.set_freq() """
+    i = int(f * 16384.)    # choose floor
+    return i >> 16 & 0xFF, i >> 8 & 0xFF, i & 0xFF
+
+
+def low_data_rate_optim(sf, bw):
+    """ :return: 1 if the symbol time is over 16ms, as LoRa._set_low_data_rate() """
+    return 1 if 1000.0 * (1 << sf) / BANDWIDTH_HZ[bw] > 16.0 else 0
+
+
+class RadioProfiles(object):
+
+    def __init__(self, pa_select=1, max_power=0x0F, output_power=0x0E):
+        """
+        :param pa_select, max_power, output_power: PA config, see LoRa.set_pa_config()
+        """
+        self.pa_config = (pa_select << 7) | (max_power << 4) | output_power
+        self.images = {}
+
+    def build(self, tx_settings, rx_settings):
+        """ Replace the cached images
+
+        :param tx_settings: iterable of (freq, sf, bw) used for joining and uplinks
+        :param rx_settings: iterable of (freq, sf, bw) used for RX1 and RX2
+        :return: number of images
+        """
+        self.images = {}
+        for role, settings in ((TX, tx_settings), (RX, rx_settings)):
+            for freq, sf, bw in settings:
+                self.get(role, freq, sf, bw)
+        return len(self.images)
+
+    def get(self, role, freq, sf, bw):
+        """ :return: the image for the settings, computed now if it is not cached """
+        key = (role, freq, sf, bw)
+        image = self.images.get(key)
+        if image is None:
+            image = self.images[key] = self.image(role, freq, sf, bw)
+        return image
+
+    def image(self, role, freq, sf, bw):
+        """ :return: a new image, see the module docstring """
+        msb, mid, lsb = freq_bytes(freq)
+        return (
+            (REG.LORA.FR_MSB, (msb, mid, lsb, self.pa_config), (0, 0, 0, 0)),
+            # keep coding rate/implicit header and tx_cont_mode/rx_crc/SymbTimeout MSB
+            (REG.LORA.MODEM_CONFIG_1, (bw << 4, sf << 4), (0x0F, 0x0F)),
+            # keep agc_auto_on
+            (REG.LORA.MODEM_CONFIG_3, (low_data_rate_optim(sf, bw) << 3,), (0x04,)),
+            (REG.LORA.INVERT_IQ, (0x27 | role << 6,), (0,)),
+        )
@@ -0,0 +1,197 @@
+""" SPI transaction counting and tracing for the SX127x driver.
+
+LoRa wraps its SpiDev in an SpiTracer. Every transfer is counted against the
+driver operations (set_mode, configureRadio, on_tx_done, read_payload...)
+running when it is made, so the cost of each operation can be measured
+rather than guessed. Operations nest, a transfer made by set_mode() called
+from configureRadio() counts for both.
+
+Counting is always on and costs a few dictionary updates per transfer.
+start_trace() also records each transfer (time, register, direction, bytes,
+duration and operation) in a ring buffer which dump() writes as JSON.
+
+usage:
+
+    D.spi.reset()
+    D.send("hello")
+    print(D.spi.report())
+
+    D.spi.start_trace(4096)
+    ...
+    D.spi.dump("trace.json")
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from functools import wraps
+from .constants import REG
+
+OTHER = "other"     # transfers made outside any traced operation
+
+
+def register_name(addr):
+    return REG.LORA.lookup.get(addr, "0x%0.2X" % addr)
+
+
+class SpiTracer(object):
+
+    def __init__(self, spi):
+        """
+        :param spi: the SpiDev to wrap
+        """
+        self.spi = spi
+        self.local = threading.local()  # operation stack per thread, ISRs run on another
+        self.trace = None
+        self.reset()
+
+    def reset(self):
+        """ clear the counters and any trace """
+        self.ops = {}       # operation -> [calls, transfers, bytes, seconds]
+        if self.trace is not None:
+            self.trace.clear()
+
+    def instrument(self, obj, names):
+        """ Wrap methods of obj so transfers made while they run are counted against them
+        :param obj: e.g. the LoRa instance
+        :param names: method names, those obj does not have are skipped
+        """
+        for name in names:
+            method = getattr(obj, name, None)
+            if method is not None:
+                setattr(obj, name, self._wrap(name, method))
+
+    def _wrap(self, name, method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            stack = self._stack()
+            stack.append(name)
+            start = time.monotonic()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                counts = self.ops.get(name)
+                if counts is None:
+                    counts = self.ops[name] = [0, 0, 0, 0.0]
+                counts[0] += 1
+                counts[3] += time.monotonic() - start
+                stack.pop()
+        return wrapper
+
+    def _stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def _count(self, data, seconds=None):
+        stack = self._stack()
+        nbytes = len(data)
+        for name in stack or (OTHER,):
+            counts = self.ops.get(name)
+            if counts is None:
+                counts = self.ops[name] = [0, 0, 0, 0.0]
+            counts[1] += 1
+            counts[2] += nbytes
+        if seconds is not None:
+            self.trace.append((time.time(), data[0] if nbytes else None, nbytes, seconds,
+                               stack[-1] if stack else OTHER))
+
+    # SpiDev interface
+
+    def xfer(self, data):
+        if self.trace is None:
+            self._count(data)
+            return self.spi.xfer(data)
+        start = time.monotonic()
+        result = self.spi.xfer(data)
+        self._count(data, time.monotonic() - start)
+        return result
+
+    def xfer2(self, data):
+        if self.trace is None:
+            self._count(data)
+            return self.spi.xfer2(data)
+        start = time.monotonic()
+        result = self.spi.xfer2(data)
+        self._count(data, time.monotonic() - start)
+        return result
+
+    def writebytes(self, data):
+        if self.trace is None:
+            self._count(data)
+            return self.spi.writebytes(data)
+        start = time.monotonic()
+        result = self.spi.writebytes(data)
+        self._count(data, time.monotonic() - start)
+        return result
+
+    def writebytes2(self, data):
+        if self.trace is None:
+            self._count(data)
+            return self.spi.writebytes2(data)
+        start = time.monotonic()
+        result = self.spi.writebytes2(data)
+        self._count(data, time.monotonic() - start)
+        return result
+
+    def supports(self, name):
+        """ True if the wrapped SpiDev has the method, e.g. writebytes2 which older spidev lacks """
+        return hasattr(self.spi, name)
+
+    def __getattr__(self, name):
+        # open, close, max_speed_hz...
+        return getattr(self.spi, name)
+
+    # detailed trace
+
+    def start_trace(self, size=4096):
+        """ record the last size transfers """
+        self.trace = deque(maxlen=size)
+
+    def stop_trace(self):
+        """ :return: the recorded transfers, see records() """
+        records = self.records()
+        self.trace = None
+        return records
+
+    def records(self):
+        """ :return: list of dicts: time, register, direction, bytes, us, operation """
+        result = []
+        for t, first, nbytes, seconds, op in self.trace or ():
+            result.append(dict(
+                time=round(t, 6),
+                register=None if first is None else register_name(first & 0x7F),
+                direction=None if first is None else ("write" if first & 0x80 else "read"),
+                bytes=nbytes,
+                us=round(seconds * 1e6, 1),
+                operation=op,
+            ))
+        return result
+
+    # results
+
+    def report(self):
+        """ SPI cost per operation
+
+        :return: dict keyed by operation, each with calls, spi_xfers, spi_bytes,
+                 xfers_per_call, bytes_per_call and mean_us (wall time per call)
+        """
+        result = {}
+        for name, (calls, xfers, nbytes, seconds) in sorted(self.ops.items()):
+            per = calls or 1
+            result[name] = dict(
+                calls=calls,
+                spi_xfers=xfers,
+                spi_bytes=nbytes,
+                xfers_per_call=round(xfers / per, 2),
+                bytes_per_call=round(nbytes / per, 1),
+                mean_us=round(seconds / per * 1e6, 1),
+            )
+        return result
+
+    def dump(self, path):
+        """ write the report and any trace as JSON """
+        with open(path, "w") as f:
+            json.dump({'report': self.report(), 'trace': self.records()}, f, indent=4)
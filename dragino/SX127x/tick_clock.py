@@ -0,0 +1,45 @@
+""" Converts pigpio ticks to time.monotonic() seconds.
+
+pigpio passes each GPIO callback the microsecond tick at which the edge was
+seen, taken by the pigpio daemon, not when Python got round to the callback.
+The tick is a 32 bit counter which wraps every 71.6 minutes and has its own
+origin, so the clock keeps a (tick, monotonic) reference pair and converts
+ticks relative to it. The pair is renewed every RECALIBRATE seconds which
+bounds the drift between the two clocks and keeps ticks within half a wrap.
+"""
+
+import time
+
+WRAP = 1 << 32
+
+
+class TickClock(object):
+
+    RECALIBRATE = 60.0      # seconds between reference pairs
+
+    def __init__(self, get_tick):
+        """
+        :param get_tick: function returning the current tick, e.g. BOARD.get_tick
+        """
+        self.get_tick = get_tick
+        self.calibrate()
+
+    def calibrate(self):
+        """ take a new reference pair, the monotonic time is the middle of the tick read """
+        before = time.monotonic()
+        tick = self.get_tick()
+        after = time.monotonic()
+        self.ref_tick = tick
+        self.ref_time = (before + after) / 2
+
+    def to_monotonic(self, tick):
+        """
+        :param tick: pigpio tick (microseconds, 32 bit)
+        :return: the same moment in time.monotonic() seconds
+        """
+        if time.monotonic() - self.ref_time > self.RECALIBRATE:
+            self.calibrate()
+        delta = (tick - self.ref_tick) % WRAP
+        if delta >= WRAP // 2:
+            delta -= WRAP   # tick is before the reference
+        return self.ref_time + delta / 1e6
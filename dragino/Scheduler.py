@@ -0,0 +1,69 @@
+"""
+Scheduler.py
+
+Runs Dragino's delayed calls: the switch to RX2 and the join retry after
+each transmission.
+
+ThreadScheduler, the default, starts a threading.Timer for each.
+LoopScheduler runs them on an asyncio event loop instead, see AsyncDragino.py.
+
+Both have call_later(delay, func) which may be called from any thread,
+including the radio interrupt callbacks, and returns a handle with cancel().
+"""
+
+import threading
+import time
+
+
+class ThreadScheduler:
+
+    def call_later(self, delay, func):
+        """
+        :param delay: seconds
+        :param func: called with no arguments on a new thread
+        :return: handle with cancel()
+        """
+        timer = threading.Timer(delay, function=func)
+        timer.start()
+        return timer
+
+
+class LoopScheduler:
+
+    def __init__(self, loop):
+        """
+        :param loop: the asyncio event loop to run the calls on
+        """
+        self.loop = loop
+
+    def call_later(self, delay, func):
+        """
+        :param delay: seconds, from now rather than from when the loop gets to it
+        :param func: called with no arguments on the loop
+        :return: handle with cancel()
+        """
+        timer = _LoopTimer(self.loop, time.monotonic() + delay, func)
+        self.loop.call_soon_threadsafe(timer.start)
+        return timer
+
+
+class _LoopTimer:
+
+    def __init__(self, loop, when, func):
+        self.loop = loop
+        self.when = when            # time.monotonic()
+        self.func = func
+        self.handle = None
+        self.cancelled = False
+
+    def start(self):
+        if not self.cancelled:
+            self.handle = self.loop.call_later(max(0.0, self.when - time.monotonic()), self.func)
+
+    def cancel(self):
+        self.cancelled = True
+        self.loop.call_soon_threadsafe(self._cancel)
+
+    def _cancel(self):
+        if self.handle is not None:
+            self.handle.cancel()
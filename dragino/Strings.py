@@ -20,6 +20,7 @@ GPSD="GPSD"
 DEVICE_CLASS="device_class"
 FCNTUP="fCntUp"
 FCNTDN="fCntDn"
+FCNTDN_SEEN="fCntDnSeen"  # a downlink with FCNTDN has been accepted
 RX1_DELAY="rx1_delay"
 RX2_DELAY="rx2_delay"
 
@@ -68,6 +69,12 @@ CH_MASK_CTL="ch_Mask_Ctrl"
 NB_TRANS="nb_Trans"
 RX_CRC="rx_crc"
 
+# listen before talk, see ChannelActivity.py
+LBT="lbt"
+LBT_CHANNELS="lbt_channels"
+LBT_ROUNDS="lbt_rounds"
+LBT_BACKOFF="lbt_backoff"
+
 DATA_RATES="data_rates"
 DATA_RATE="data_rate"
 ADR_DATA_RATE="ADR_data_rate"
@@ -83,6 +90,7 @@ MAX_EIRP="maxEIRP"
 SYNC_WORD="sync_word"
 SERVER_TIME="server_time"
 MAC_CACHE="mac_cache"
+RADIO_CACHE="radio_cache"
 CFLIST="cfList"
 MAX_DR_OFFSET="max_dr_offset"
 MAX_DR_INDEX="max_dr_index"
@@ -1 +1,14 @@
-from .dragino import Dragino, DraginoError
+"""
+Dragino and DraginoError are imported when first used, so the codec
+(dragino.LoRaWAN), the MAC cache and the capture decoder can be used
+without pigpio and spidev, e.g. by the benchmarks on a build machine.
+"""
+
+__all__ = ["Dragino", "DraginoError"]
+
+
+def __getattr__(name):
+    if name in __all__:
+        from . import dragino
+        return getattr(dragino, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -23,11 +23,20 @@ from random import randrange
 from .SX127x.LoRa import LoRa, MODE
 from .SX127x.board_config import BOARD
 from .SX127x.constants import BW
+from .SX127x.radio_profiles import RadioProfiles, TX, RX
+from .Airtime import AirtimeTable, UPLINK_OVERHEAD, symbol_time
+from .ChannelActivity import ChannelActivity
+from .Scheduler import ThreadScheduler
 from .LoRaWAN import new as lorawan_msg
+from .LoRaWAN import new_session as lorawan_session_msg
+from .LoRaWAN import encode_uplinks
+from .LoRaWAN import HeaderView
+from .LoRaWAN import UplinkTemplate
 from .LoRaWAN import MalformedPacketException
 from .LoRaWAN.MHDR import MHDR
 
-from time import time
+from time import monotonic, sleep
+import inspect
 from .MAChandler import MAC_commands
 from .Config import TomlConfig
 from .Strings import *
@@ -47,6 +56,8 @@ sys.path.append(parentDir)
 #################################
 DEFAULT_LOG_LEVEL = logging.DEBUG 	# Change after finishing development
 DEFAULT_RETRIES = 3 				# How many attempts to send the message
+CAD_TIMEOUT_SYMBOLS = 4             # CAD takes about 2 symbols
+CAD_TIMEOUT_MARGIN = 0.05           # seconds, allows for callback latency
 
 
 class radioSettings:
@@ -66,11 +77,22 @@ class Dragino(LoRa):
     """
         Class to provide an interface to the dragino LoRa/GPS HAT
     """
+
+    TRACED_OPERATIONS = LoRa.TRACED_OPERATIONS + (
+        'configureRadio', 'switchToRX2', 'on_tx_done', 'on_rx_done', '_transmit', '_tryToJoin')
+
     def __init__(
             self, config_filename,
             logging_level=DEFAULT_LOG_LEVEL,
-            enableGPS=False
+            enableGPS=False,
+            board=None,
+            scheduler=None
             ):
+        """
+        :param config_filename: dragino.toml or another config. Each radio needs its own, with its own mac_cache
+        :param board: SX127x.board_config.Board the radio is wired to, default BOARD (the Dragino HAT)
+        :param scheduler: runs the RX2 and join retry timers, default a ThreadScheduler. See Scheduler.py
+        """
 
         self.confirmWithNextUplink=False # for confirmed data down
 
@@ -83,14 +105,21 @@ class Dragino(LoRa):
             Create the class to interface with the board
         """
 
-        BOARD.setup()
-        
-        super(Dragino, self).__init__() # LoRa init
-
         self.TC=TomlConfig(config_filename)                 # load user config
         self.config=self.TC.getConfig()                     # get the config dictionary
         self.MAC=MAC_commands(self.config,logging_level)    # loads cached MAC info (if any) otherwise config values
 
+        (BOARD if board is None else board).setup()
+
+        # a snapshot of the registers saved by the last run skips the
+        # calibration and most of the set up if the chip hasn't been reset
+        radioSnapshot=self.MAC.loadRadioSnapshot()
+
+        super(Dragino, self).__init__(board=board,snapshot=radioSnapshot) # LoRa init
+
+        if self.warm_start:
+            self.logger.info("radio registers restored from the snapshot")
+
         # setup GPS
         if enableGPS:
             from .GPShandler import GPS
@@ -124,15 +153,49 @@ class Dragino(LoRa):
             self.logger.error(f"error initialising radio config {e}. Check config values are not strings")
 
         self.set_agc_auto_on(1)
+
+        # register images for every channel and data rate
+        self.radioProfiles=RadioProfiles(
+            pa_select=1,
+            max_power=self.config[TTN][MAX_POWER],
+            output_power=self.config[TTN][OUTPUT_POWER]
+            )
+        self.rx1Settings=None       # chosen with the JOIN/SEND settings so on_tx_done()
+        self.rx1Profile=None        # can switch to RX1 without asking the MAC
+        self.buildRadioProfiles()
+
+        # time on air of every frame length at each data rate
+        self.airtimes=AirtimeTable(self.MAC.getDataRates(),crc=self.config[TTN][RX_CRC])
+
+        # listen before talk, see D.channelActivity.report()
+        self.channelActivity=ChannelActivity.fromConfig(self.config[TTN])
+        self.cadDone=threading.Event()
+        self.cadDetected=False
+        self.txConfig=None          # radioSettings.JOIN or SEND, last configured
+        self.txSettings=None        # and its (freq,sf,bw)
         
         # for downlink DATA messages
         self.downlinkCallback=None
+        self.downlinkTimestamp=False    # True if the callback takes a timestamp
+
+        # preassembled frame for uplinks without FOpts or ACK
+        self.uplinkTemplate=None
         
         # status
         self.transmitting=False
         self.validMsgRecvd=False     # used to detect valid msg receive in RX1
         self.txStart=None          # used to compute last airTime
-        self.txEnd=None
+        self.txEnd=None            # time.monotonic() of the TxDone edge
+        self.txAirTime=None        # predicted time on air of the last transmission
+        self.rxTime=None           # time.monotonic() of the last RxDone edge
+        self.rx2Timer=None         # cancelled by the next transmission
+        self.joining=False         # a JOIN_REQUEST is waiting for its JOIN_ACCEPT
+        self.scheduler=ThreadScheduler() if scheduler is None else scheduler
+
+        # the config writes above are skipped by the register shadow when the
+        # snapshot already had them, otherwise save the new set up for next time
+        if not (self.warm_start and self.matches_snapshot(radioSnapshot)):
+            self.MAC.saveRadioSnapshot(self.snapshot())
 
         self.logger.info("__init__ done")
 
@@ -144,6 +207,10 @@ class Dragino(LoRa):
         decodedPayload will be a bytearray.
         mtype will be MHDR.UNCONF_DATA_DOWN or MHDR.CONF_DATA_DOWN.
 
+        If the function has a timestamp parameter (or **kwargs) it is also
+        passed timestamp, the time.monotonic() time the packet finished
+        arriving, taken from the RxDone interrupt.
+
         See test_downlink.py for usage.
 
         func: function to call when a downlink message is received
@@ -151,48 +218,87 @@ class Dragino(LoRa):
         if hasattr(func,'__call__'):
             self.logger.info("Setting downlinkCallback to %s",func)
             self.downlinkCallback=func
+            try:
+                params=inspect.signature(func).parameters.values()
+                self.downlinkTimestamp=any(p.name=="timestamp" or p.kind==p.VAR_KEYWORD for p in params)
+            except (TypeError, ValueError):
+                self.downlinkTimestamp=False
         else:
             self.logger.info("downlinkCallback is not callable")
 
 
-    def configureRadio(self,cfg):
+    def configureRadio(self,cfg,exclude=()):
         """
         change radio settings
 
         called whenever there's a change of radio settings
 
         :param cfg: (see radioSettings class)
+        :param exclude: JOIN/SEND frequencies to avoid, e.g. found busy
         """
-        freq,sf,bw=0,0,0
+        if cfg==radioSettings.RX1 and self.rx1Profile is not None:
+            # looked up when the uplink channel was chosen
+            settings,profile=self.rx1Settings,self.rx1Profile
+        else:
+            if cfg==radioSettings.JOIN:
+                settings=self.MAC.getJoinSettings(exclude)
+            elif cfg==radioSettings.SEND:
+                settings=self.MAC.getSendSettings(exclude)
+            elif cfg==radioSettings.RX1:
+                settings=self.MAC.getRX1Settings()
+            else:
+                settings=self.MAC.getRX2Settings()
+
+            role=TX if cfg in (radioSettings.JOIN,radioSettings.SEND) else RX
+            profile=self.radioProfiles.get(role,*settings)
+
+            if role==TX:
+                self.txConfig,self.txSettings=cfg,settings
+
+                # RX1 follows the uplink channel
+                self.rx1Settings=self.MAC.getRX1Settings()
+                self.rx1Profile=self.radioProfiles.get(RX,*self.rx1Settings)
 
-        if cfg==radioSettings.JOIN:
-            freq,sf,bw=self.MAC.getJoinSettings()
-        elif cfg==radioSettings.SEND:
-            freq,sf,bw=self.MAC.getSendSettings()
-        elif cfg==radioSettings.RX1:
-            freq,sf,bw=self.MAC.getRX1Settings()
-        elif cfg==radioSettings.RX2:
-            freq,sf,bw=self.MAC.getRX2Settings()
+        # the register writes are sent as burst transfers
+        # before the mode is changed at the end
+        with self.transaction():
+            self.write_profile(profile)
+            self.set_mode(MODE.HF_LORA_RXCONT)
 
+        freq,sf,bw=settings
         self.logger.info(f" freq={freq} sf={sf} bw={bw}")
 
-        self.set_pa_config(
-            pa_select=1,
-            max_power=self.config[TTN][MAX_POWER],
-            output_power=self.config[TTN][OUTPUT_POWER]
-            )
-   
-        # now configure the radio
-        self.set_mode(MODE.HF_LORA_SLEEP)
-        self.set_freq(freq)
-        self.set_spreading_factor(sf)
-        self.set_bw(bw)
-        self.set_mode(MODE.HF_LORA_RXCONT)
+    def buildRadioProfiles(self):
+        """
+        precompute the radio register images for every channel and
+        data rate the MAC may ask for.
+
+        called at startup and after MAC changes to channels or data rates
+        """
+        tx,rx=self.MAC.getRadioPlan()
+        count=self.radioProfiles.build(tx,rx)
+        self.rx1Settings=None
+        self.rx1Profile=None
+        self.logger.debug(f"built {count} radio profiles")
+
+
+    ###########################################
+    #
+    # Overridable functions, called on the radio
+    # interrupt or scheduler thread
+    #
+    ###########################################
+    def on_joined(self):
+        """ a JOIN_ACCEPT was processed, registered() is now True """
+        pass
 
+    def on_join_failed(self):
+        """ no JOIN_ACCEPT arrived after the last join retry """
+        pass
 
     def switchToRX2(self):
         """
-            called by threading timer elapsing after rx1_delay+1 following
+            called by the scheduler rx1_delay+rx_window after the end of
             a transmission
 
             device remains listening in rx2 until the next transmission
@@ -223,8 +329,10 @@ class Dragino(LoRa):
             appkey=self.MAC.getAppKey()
             lorawan = lorawan_msg([], appkey)
             lorawan.read(rawPayload)
+            if not lorawan.valid_mic():
+                self.logger.info("JOIN_ACCEPT MIC check failed - ignoring")
+                return
             decodedPayload=lorawan.get_payload()
-            lorawan.valid_mic() # throws an exception if MIC not valid
 
             self.logger.debug(f"decoded JOIN_ACCEPT payload {decodedPayload}")
 
@@ -261,8 +369,7 @@ class Dragino(LoRa):
         # self.MAC.handleCFlist(cflist)
 
         devaddr=lorawan.get_devaddr()
-        nwkskey=lorawan.derive_nwskey(self.devnonce)
-        appskey=lorawan.derive_appskey(self.devnonce)
+        nwkskey,appskey=lorawan.derive_session_keys(self.devnonce)
 
 
         self.MAC.setDevAddr(devaddr)
@@ -274,10 +381,20 @@ class Dragino(LoRa):
         self.logger.debug(f"appskey: {appskey}")
 
         self.MAC.setFCntUp(1)
+        self.MAC.setFCntDn(0)
 
         # cache changed values
         self.MAC.saveCache()
 
+        # build the session ciphers now rather than on the first uplink
+        self.MAC.getSessionCrypto()
+
+        # the DL settings change the RX data rates
+        self.buildRadioProfiles()
+
+        self.joining=False
+        self.on_joined()
+
         # finally process any MAC commands (if any)
         #self.MAC.handleCommand(lorawan.get_mac_payload())
 
@@ -303,7 +420,7 @@ class Dragino(LoRa):
 
             FOptsLen=rawPayload[5] & 0x0F
 
-            self.logger.debug(f"process_DATA_DOWN Fopts len={FOptsLen}")
+            self.logger.debug("process_DATA_DOWN Fopts len=%d", FOptsLen)
 
             # message format - only FRM_PAYLOAD (if any) is encoded in MAC 1.0.x
             # parts enclosed in [] are optional. Size in bytes is enclosed in ()
@@ -317,29 +434,47 @@ class Dragino(LoRa):
 
             # looks like a proper downlink with data sent to me
             # so lets try to understand it
-            nwkskey=self.MAC.getNwkSKey()
-            appskey=self.MAC.getAppSKey()
-
-            lorawan = lorawan_msg(nwkskey,appskey)
+            lorawan = lorawan_session_msg(self.MAC.getSessionCrypto())
             lorawan.read(rawPayload)
 
-            decodedPayload=lorawan.get_payload() # must call before valid_mic()
-            lorawan.valid_mic() # raises an exception if not
+            # only 16 bits of FCnt are sent, the MIC uses all 32
+            fhdr=lorawan.get_mac_payload().get_fhdr()
+            fhdr.set_fcnt32(self.MAC.getFCntDn32(fhdr.get_fcnt()))
+
+            # check the MIC first, frames which fail are dropped without
+            # decrypting them or letting their FOpts change the MAC state
+            if not lorawan.valid_mic():
+                self.logger.info("downlink MIC check failed - ignoring")
+                return
+
+            if not self.MAC.checkFcntDn(fhdr.get_fcnt32()):
+                return
+
+            decodedPayload=lorawan.get_payload()
 
             self.validMsgRecvd=True
 
             self.MAC.setLastSNR(self.get_pkt_snr_value()) # used for MAC status reply
 
             fport=lorawan.get_mac_payload().get_fport()
-            fOpts = lorawan.get_mac_payload().get_fhdr().get_fopts()
+            fOpts = bytes(lorawan.get_mac_payload().get_fhdr().get_fopts())
 
-            self.logger.debug(f"process DATADOWN validMsgRecvd fport={fport} fOpts={fOpts} FOptsLen={FOptsLen}")
+            self.logger.debug("process DATADOWN validMsgRecvd fport=%s fOpts=%s FOptsLen=%d", fport, fOpts, FOptsLen)
+
+            # finally process any MAC commands, they may change the channels
+            # or data rates (NewChannelReq, LinkADRReq, RXParamSetupReq...)
+            plan=self.MAC.getRadioPlanKey() if FOptsLen>0 else None
 
-            # finally process any MAC commands
             self.MAC.handleCommand(lorawan.get_mac_payload()) # calls self.MAC.processFopts(fOpts)
 
+            if plan is not None and self.MAC.getRadioPlanKey()!=plan:
+                self.buildRadioProfiles()
+
             if self.downlinkCallback is not None:
-                self.downlinkCallback(decodedPayload,mtype,fport)
+                if self.downlinkTimestamp:
+                    self.downlinkCallback(decodedPayload,mtype,fport,timestamp=self.rxTime)
+                else:
+                    self.downlinkCallback(decodedPayload,mtype,fport)
 
             # we may need to ACK
             if mtype==MHDR.CONF_DATA_DOWN:
@@ -353,54 +488,60 @@ class Dragino(LoRa):
         """
             Callback on RX complete, signalled by I/O
 
+            The header is peeked first so that malformed frames and frames
+            for other devices are dropped before any objects are built or
+            any crypto is done.
+
             Several calls may throw errors, we ignore the payload if any occur
         """
+        self.rxTime=self.take_irq_time()
         self.clear_irq_flags(RxDone=1)
-        self.logger.debug("Received message...")
+        if self.txEnd is not None:
+            self.logger.debug("Received message %.3fs after TxDone", self.rxTime-self.txEnd)
+        else:
+            self.logger.debug("Received message...")
 
         # read the payload from the radio
         # this may or may not be a valid lorawan message
         rawPayload = self.read_payload(nocheck=True)
-        decodedPayload=bytearray() # keeps the compiler happy
 
         if rawPayload is None:
             self.logger.debug("rawPayload is None")
             return
 
+        # hex() builds a string, only worth it if the line is logged
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("raw payload = %s", rawPayload.hex())
+
+        header=HeaderView(rawPayload)
+
         # 12 bytes is the absolute minimum rawPayload length
-        if len(rawPayload)<12:
-            self.logger.debug(f"received invalid message. Too small.")
+        if not header.is_valid():
+            self.logger.debug("received invalid message. Too small or malformed.")
             return
 
-        self.logger.debug(f"raw payload {rawPayload}")
-
         # MHDR is not encoded and is first byte of the rawPayload
-        mtype=rawPayload[0] & 0xE0
+        mtype=header.get_mtype()
 
         if mtype==MHDR.JOIN_ACCEPT:
             self.process_JOIN_ACCEPT(rawPayload)
             return
 
-        # don't process any other messages till we have registered
-        # since we don't have the keys to decode FRM payloads they may
-        # come from dubious sources
-        if not self.registered():
-            self.logger.debug(f"received a message mtype={mtype} but we haven't joined yet. Ignored")
+        if mtype!=MHDR.UNCONF_DATA_DOWN and mtype!=MHDR.CONF_DATA_DOWN:
+            self.logger.debug("Unhandled mtype %s. Message ignored.", mtype)
             return
 
-        # check the devaddr
-        if list(reversed(rawPayload[1:5]))!=self.MAC.getDevAddr():
+        # don't process any other messages till we have registered
+        # since we don't have the keys to decode FRM payloads they may
+        # come from dubious sources. An unassigned devaddr is 0 and
+        # never matches.
+        devaddr=self.MAC.getDevAddrInt()
+        if devaddr==0 or header.get_devaddr()!=devaddr:
             # message is not for me
-            self.logger.info("downlink message is not addressed to me")
-            return
-
-        # process any other downlink messages
-        if mtype==MHDR.UNCONF_DATA_DOWN or mtype==MHDR.CONF_DATA_DOWN:
-            self.process_DATA_DOWN(rawPayload)
+            self.logger.debug("downlink message is not addressed to me")
             return
 
-        self.logger.debug(f"Unhandled mtype {mtype}. Message ignored.")
-        return
+        self.process_DATA_DOWN(rawPayload)
 
 
     def lastAirTime(self):
@@ -415,6 +556,20 @@ class Dragino(LoRa):
             return self.txEnd-self.txStart
         return 0
 
+    def uplinkAirTime(self,length,dr=None):
+        """
+            predicted time on air of an uplink, usable before it is sent
+            to budget the duty cycle or fair use policy
+
+        :param length: message length in bytes
+        :param dr: data rate, None for the current one
+        :return: seconds, including the LoRaWAN header, MIC and any
+                 MAC replies waiting to go with the next uplink
+        """
+        if dr is None:
+            dr=self.MAC.getDataRate()
+        return self.airtimes.airtime(dr,UPLINK_OVERHEAD+self.MAC.getFOptsLen()+length)
+
     def on_tx_done(self):
         """
             ISR. Callback on TX complete.
@@ -423,55 +578,126 @@ class Dragino(LoRa):
             join if no reply.
 
         """
+        self.txEnd=self.take_irq_time() # enables computation of actual TX time
         self.clear_irq_flags(TxDone=1)
-        self.txEnd=time()               # enables computation of actual TX time
         self.transmitting=False         # let callers know we are done
         self.validMsgRecvd=False        # waiting for valid downlink msg
-        self.set_mode(MODE.HF_LORA_STDBY)
-        self.set_dio_mapping([0, 0, 0, 0, 0, 0])
-        self.set_invert_iq(1)
-        self.reset_ptr_rx()
 
-        # RX1 settings can be changed by MAC commands
-        self.logger.info("switching to RX1")
-        self.configureRadio(radioSettings.RX1)
+        with self.transaction():
+            self.set_mode(MODE.HF_LORA_STDBY)
+            self.set_dio_mapping([0, 0, 0, 0, 0, 0])
+            self.reset_ptr_rx()
+
+            # the RX1 profile (IQ inverted) was looked up with the uplink settings
+            self.configureRadio(radioSettings.RX1)
+
+        # see self.mode_transition.report() for the individual mode changes
+        self.logger.debug("RX1 listening %.2fms after TxDone", 1000*(monotonic()-self.txEnd))
+        if self.txAirTime is not None:
+            self.logger.debug("airtime %.3fs predicted %.3fs", self.lastAirTime(), self.txAirTime)
 
-        # set a timer ready to switch to RX2 after rx1_delay + rx_window (normally 1 second)
-        # this may not be accurate and delay may need to be slightly smaller
+        # set a timer ready to switch to RX2 rx1_delay + rx_window (normally 1 second)
+        # after the end of the transmission, not after this callback started
         delay=self.MAC.getRX1Delay()+self.config[TTN][RX_WINDOW]
         self.logger.info(f"setting timer delay {delay} to switch to RX2")
 
-        t1=threading.Timer(delay,function=self.switchToRX2)
-        t1.start()
+        self.rx2Timer=self.scheduler.call_later(self._sinceTxEnd(delay),self.switchToRX2)
 
-        # check if retries have expired
-        # this will be the case for a normal packet send after joining
-
-        if self.join_retries==0:
+        # only join requests are retried
+        if not self.joining:
             return
 
         # if we never receive a JOIN_ACCEPT we should retry
-        t2=threading.Timer(self.config[TTN][JOIN_TIMEOUT],function=self._retryJoin)
-        t2.start()
+        self.scheduler.call_later(self._sinceTxEnd(self.config[TTN][JOIN_TIMEOUT]),self._retryJoin)
+
+    def _sinceTxEnd(self,delay):
+        """
+        :param delay: seconds after the end of the last transmission
+        :return: seconds from now, at least 0
+        """
+        return max(0.0,self.txEnd+delay-monotonic())
+
+    def on_cad_done(self):
+        """
+            ISR. Channel activity detection finished, see _channelClear()
+        """
+        self.cadDetected=bool(self.get_irq_flags()['cad_detected'])
+        self.cadDone.set()
+
+    def _channelClear(self):
+        """
+        run channel activity detection on the configured uplink channel
+
+        :return: True if no LoRa preamble was detected
+        """
+        freq,sf,bw=self.txSettings
+        self.cadDone.clear()
+        self.cadDetected=False
+
+        self.set_mode(MODE.HF_LORA_STDBY)       # CAD starts from standby
+        self.set_dio_mapping([2, 0, 0, 0, 0, 0])    # DIO0 CadDone
+        self.set_mode(MODE.HF_LORA_CAD)
+
+        if self.cadDone.wait(CAD_TIMEOUT_SYMBOLS*symbol_time(sf,bw)+CAD_TIMEOUT_MARGIN):
+            busy=self.cadDetected
+        else:
+            self.logger.warning(f"no CadDone on {freq}, assuming the channel is clear")
+            self.channelActivity.timeouts+=1
+            busy=False
+            self.set_mode(MODE.HF_LORA_STDBY)
+
+        self.clear_irq_flags(CadDone=1,CadDetected=1)
+        self.channelActivity.record(freq,busy)
+        return not busy
+
+    def _listenBeforeTalk(self):
+        """
+        wait for a clear channel, see ChannelActivity.py
+
+        A busy channel is swapped for another. When channelActivity.channels
+        channels were busy the send backs off a random time and starts again.
+        After channelActivity.rounds it goes ahead on the busy channel.
+        """
+        lbt=self.channelActivity
+        busy=set()
+        for backoffs in range(lbt.rounds):
+            if backoffs>0:
+                delay=lbt.backoffDelay()
+                self.logger.info(f"channels {sorted(busy)} busy, backing off {delay:.2f}s")
+                sleep(delay)
+                busy.clear()
+            for changes in range(lbt.channels):
+                if changes>0:
+                    self.configureRadio(self.txConfig,exclude=busy)
+                if self._channelClear():
+                    lbt.done(backoffs,changes)
+                    return
+                busy.add(self.txSettings[0])
+
+        self.logger.warning(f"channels {sorted(busy)} busy, sending anyway")
+        lbt.done(backoffs,changes,clear=False)
 
     def _retryJoin(self):
         """
-        called by a thread timer after a timeout waiting for a JOIN_ACCEPT
+        called by the scheduler after a timeout waiting for a JOIN_ACCEPT
 
         """
-        if self.registered():
+        if self.registered() or not self.joining:
             return
 
-        self.logger.info(f"retrying join  # {self.join_retries}")
-
         if self.join_retries>0:
+            self.logger.info(f"retrying join  # {self.join_retries}")
             self.join_retries-=1
             self._tryToJoin()
+        else:
+            self.logger.warning("no JOIN_ACCEPT, join retries exhausted")
+            self.joining=False
+            self.on_join_failed()
 
     def getFcntUp(self):
         '''
-        returns the Fcnt for uplinks. The limit is 65535 after that the LoRaWAN code
-        will throw an error which can only be fixed by rejoining TTN
+        returns the Fcnt for uplinks. This is the full 32 bit counter,
+        only the low 16 bits are sent, so a session lasts for 2^32 uplinks
         '''
         return self.MAC.getFCntUp()
 
@@ -485,36 +711,41 @@ class Dragino(LoRa):
         NOTE: bandwidth (BW) range is defined in dragino/SX127x/constants.py and is essentially
         an int in range 0..9 determined by the radio not TTN but limited by TTN
 
+        :return: True if a JOIN_REQUEST was sent, False if already joined or not using OTAA
         """
 
         # have we already joined?
         # this will be true if using ABP
         if self.registered():
             self.logger.info("Already joined, nothing to do")
-            return
+            return False
 
         mode=self.config[TTN][AUTH_MODE]
 
         if mode != AUTH_OTAA:
             self.logger.error(f"Unknown auth_mode {mode}")
-            return
+            return False
 
         self.logger.info("Performing OTAA Join")
 
-        self.configureRadio(radioSettings.JOIN)
-
         self.join_retries=self.config[TTN][JOIN_RETRIES]
+        self.joining=True
 
         return self._tryToJoin()
 
     def _tryToJoin(self):
         """
             Perform the OTAA auth in order to get the keys required to transmit
+
+            :return: True if the JOIN_REQUEST was sent
         """
         self.logger.info("trying to join TTN")
         if self.registered():
             self.logger.debug("already joined")
-            return
+            return False
+
+        # retries follow RX1/RX2 so the join settings are needed every time
+        self.configureRadio(radioSettings.JOIN)
 
         self.devnonce = [randrange(256), randrange(256)] #random devnonce 2 bytes
 
@@ -533,16 +764,7 @@ class Dragino(LoRa):
                     MHDR.JOIN_REQUEST,
                     {'deveui': deveui, 'appeui': appeui, 'devnonce': self.devnonce})
 
-        packet=lorawan.to_raw()
-        self.write_payload(packet)
-
-        self.logger.debug(f"sending packet {packet}")
-        self.set_mode(MODE.HF_LORA_TX)
-        self.transmitting=True
-        self.validMsgRecvd=False
-        # used to calculate air time
-        self.txStart=time()
-        self.txEnd=None
+        return self._transmit(lorawan.to_bytes())
 
     def getDutyCycle(self,freq=None):
         """
@@ -604,6 +826,7 @@ class Dragino(LoRa):
 
         :param message: bytearray
         :param port: 1..254
+        :return: True if the uplink was sent
         """
 
         try:
@@ -611,17 +834,13 @@ class Dragino(LoRa):
             # check if joined
             if not self.registered():
                 self.logger.warn("attempt to send uplink but not joined")
-                return
+                return False
 
             # disable retry timeout
             self.join_retries=0
 
             self.configureRadio(radioSettings.SEND)
 
-            nwkskey=self.MAC.getNwkSKey()
-            appskey=self.MAC.getAppSKey()
-            lorawan = lorawan_msg(nwkskey,appskey)
-
             try:
 
                 FCntUp=self.MAC.getFCntUp()
@@ -635,40 +854,32 @@ class Dragino(LoRa):
 
             #lorawan.create(MHDR.UNCONF_DATA_UP, {'devaddr': devaddr, 'fcnt': FCntUp, 'data': message})
             if FOptsLen>0:
+                lorawan = lorawan_session_msg(self.MAC.getSessionCrypto())
                 lorawan.create(MHDR.UNCONF_DATA_UP,{
                     'devaddr': devaddr,
                     'fcnt': FCntUp,
                     'data': message,
                     'fport':port,
                     'fopts':FOpts})
-            else:
-                FCtrl=0;
-                if self.confirmWithNextUplink:
-                    self.confirmWithNextUplink=False
-                    FCtrl=0x20 # bit 5 is an ACK
+                raw_payload=lorawan.to_bytes()
+
+            elif self.confirmWithNextUplink:
+                self.confirmWithNextUplink=False
                 # we never send confirmed up so the last downlink must have come from the server
                 # if someone accidentally set the confirmed checkbox on the V3 messaging
                 # panel
+                lorawan = lorawan_session_msg(self.MAC.getSessionCrypto())
                 lorawan.create(MHDR.UNCONF_DATA_UP,
-                {'devaddr': devaddr, 'fcnt': FCntUp, 'data': message, 'fport': port, 'fctrl': FCtrl})
-
-            self.MAC.setFCntUp(FCntUp+1)
-
-            # encode the packet
-            raw_payload=lorawan.to_raw()
+                {'devaddr': devaddr, 'fcnt': FCntUp, 'data': message, 'fport': port, 'fctrl': 0x20}) # bit 5 is an ACK
+                raw_payload=lorawan.to_bytes()
 
-            # load into radio fifo
-            self.write_payload(raw_payload)
-            self.logger.debug(f"Sending packet raw payload = {raw_payload}")
+            else:
+                # no FOpts or ACK so the preassembled frame can be used
+                raw_payload=self._getUplinkTemplate(port,len(message)).encode(FCntUp,message)
 
-            self.set_dio_mapping([1, 0, 0, 0, 0, 0])
+            self.MAC.setFCntUp(FCntUp+1)
 
-            self.transmitting=True
-            self.validMsgRecvd=False
-            self.set_mode(MODE.HF_LORA_TX)
-            # used to calculate air time
-            self.txStart=time()
-            self.txEnd=None
+            return self._transmit(raw_payload)
 
         except ValueError as err:
             self.logger.exception(err)
@@ -681,25 +892,116 @@ class Dragino(LoRa):
             #self.logger.error(f"packet error {exp}")
             self.logger.exception(exp)
 
+        return False
+
+    def _getUplinkTemplate(self,port,length):
+        """
+        the UplinkTemplate for this port and payload length, a new one
+        is made if the port, length or session (keys or DevAddr) changed
+
+        :param port: 1..254
+        :param length: payload length
+        """
+        session=self.MAC.getSessionCrypto()
+        if self.uplinkTemplate is None or not self.uplinkTemplate.matches(session,port,length):
+            self.uplinkTemplate=UplinkTemplate(session,port,length)
+        return self.uplinkTemplate
+
+    def _transmit(self,raw_payload):
+        """
+        load an encoded uplink into the radio and start transmitting
+
+        :param raw_payload: PHY payload bytes
+        :return: True
+        """
+        # the receive windows of the last uplink are over
+        if self.rx2Timer is not None:
+            self.rx2Timer.cancel()
+            self.rx2Timer=None
+
+        if self.channelActivity.enabled:
+            self._listenBeforeTalk()
+
+        # load into radio fifo
+        self.write_payload(raw_payload)
+        self.txAirTime=self.airtimes.airtime(self.MAC.getDataRate(),len(raw_payload))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Sending packet raw payload = %s", raw_payload.hex())
+
+        self.set_dio_mapping([1, 0, 0, 0, 0, 0])
+
+        self.transmitting=True
+        self.validMsgRecvd=False
+        # used to calculate air time. Set first as TxDone can
+        # arrive before set_mode() returns
+        self.txStart=monotonic()
+        self.txEnd=None
+        self.set_mode(MODE.HF_LORA_TX)
+        return True
+
+    def encode_backlog(self,frames):
+        """
+        encode a backlog of queued uplinks in one go, for example
+        readings stored while the gateway was out of reach.
+
+        The FCntUp range is reserved in one step and the frames are
+        numbered consecutively. They carry no FOpts or ACK, any pending
+        MAC replies go with the next send().
+
+        Send the result one at a time with send_encoded(), respecting
+        the duty cycle.
+
+        :param frames: list of (port, message) pairs, message is bytes or a list of ints
+        :return: list of encoded uplinks (bytes)
+        """
+        if not self.registered():
+            self.logger.warning("attempt to encode uplinks but not joined")
+            return []
+
+        first=self.MAC.reserveFCntUp(len(frames))
+        return encode_uplinks(self.MAC.getSessionCrypto(),frames,first)
+
+    def send_encoded(self,raw_payload):
+        """
+        transmit an uplink prepared by encode_backlog()
+
+        :param raw_payload: bytes
+        :return: True if the uplink was sent
+        """
+        if not self.registered():
+            self.logger.warning("attempt to send uplink but not joined")
+            return False
+
+        # disable retry timeout
+        self.join_retries=0
+
+        self.configureRadio(radioSettings.SEND)
+        return self._transmit(raw_payload)
+
     def send_bytes(self, message,port=1):
         """
             Send a list of bytes over the LoRaWAN channel
 
             called by send("message") to create a byte array or directly if message
             is already a byte array
+
+            returns True if the uplink was sent, False if not (not joined,
+            no session keys or an encoding error, see the log)
         """
         attempt = 0
         if self.MAC.getNwkSKey() is None or self.MAC.getAppSKey() is None:
             self.logger.error("no nwkSKey or AppSKey")
-            return
+            return False
 
-        self._sendPacket(message,port)
+        return self._sendPacket(message,port)
 
     def send(self, message, port=1):
         """
             Send a string message over the channel
+
+            returns True if the uplink was sent, see send_bytes()
         """
-        self.send_bytes(list(map(ord, str(message))),port)
+        return self.send_bytes(list(map(ord, str(message))),port)
 
     def get_gps(self):
         if self.GPS is None:
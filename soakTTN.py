@@ -35,16 +35,8 @@ print("\nJoined")
 # calculate how many transmissions we can
 # make per 24 hours
 # FUP limits us to 30s per 24h
-D.send(msg)
-sleep(10)
-airTime=D.lastAirTime()
-while airTime==0:
-    D.send(msg)
-    sleep(10)
-    airTime=D.lastAirTime()
-
-    
-    
+airTime=D.uplinkAirTime(len(msg))
+
 numTxPer30s=30/airTime
 interval=24*60*60/numTxPer30s - airTime # time between transmissions
 
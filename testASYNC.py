@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+    asyncio version of testTTN.py - joins then sends a short message N times,
+    printing the outcome of each receive window, and adheres to a 1% duty
+    cycle. Downlinks are printed as they arrive by a second task.
+
+    A third task checks the event loop is never blocked: join retries and
+    listen before talk back offs (lbt=true) must run off the loop. The
+    longest stall is printed after the join and at the end.
+
+    cache.json will be created if it doesn't exist
+"""
+import asyncio
+import logging
+from dragino.AsyncDragino import AsyncDragino
+
+base_msg="A"
+N=1000
+LOG="testASYNC.log"
+TICK=0.05           # seconds between event loop checks
+MAX_STALL=0.1       # seconds, longer stalls are reported as blocking the loop
+
+logLevel=logging.DEBUG
+logging.basicConfig(filename=LOG, filemode="w", format='%(asctime)s - %(funcName)s - %(lineno)d - %(levelname)s - %(message)s', level=logLevel)
+
+
+async def printDownlinks(D):
+    async for downlink in D.downlinks():
+        print(f"downlink fport={downlink.fport} payload={downlink.payload.hex()} in {downlink.window}")
+
+
+async def watchLoop(stall):
+    """ keep the longest time the loop was late waking this task up in stall[0] """
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(TICK)
+        stall[0] = max(stall[0], loop.time() - start - TICK)
+
+
+def checkStall(stall, when):
+    if stall[0] > MAX_STALL:
+        print(f"FAIL the event loop was blocked for {stall[0]:.3f}s {when}")
+    else:
+        print(f"ok   longest event loop stall {stall[0]:.3f}s {when}")
+
+
+async def main():
+    D = AsyncDragino("dragino.toml", logging_level=logLevel)
+
+    stall = [0.0]
+    asyncio.create_task(watchLoop(stall))
+
+    print("Joining")
+    await D.join()
+    print("Joined TTN")
+    checkStall(stall, "while joining")
+
+    asyncio.create_task(printDownlinks(D))
+
+    TotalAirTime=0 # keep track to keep within TTN FUP
+    for i in range(N):
+        msg=f"{base_msg} {i}"
+        outcome=await D.send(msg)
+        print(f"Sent message {msg} airTime={outcome.airtime:.3f} reply in {outcome.window}")
+        TotalAirTime+=outcome.airtime
+        if TotalAirTime>30:
+            print("Reached fair use limit")
+            checkStall(stall, "while sending")
+            return
+        await asyncio.sleep(99*outcome.airtime) # limit to 1% duty cycle in EU
+
+
+asyncio.run(main())
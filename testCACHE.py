@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+    checks the downlink frame counter handling of the MAC cache, no
+    hardware needed:
+
+    - a cache.json written by older versions, which cached fCntDn as the
+      two FCnt bytes from the frame header, loads as a 32 bit counter
+    - downlinks which repeat or go back in FCntDn are rejected
+    - after a join (FCntDn reset to 0) the first downlink, FCnt 0, is accepted
+
+    the cache is written to a temporary folder, cache.json is not touched
+"""
+import json
+import logging
+import os
+import sys
+import tempfile
+
+from dragino.Config import TomlConfig
+from dragino.MAChandler import MAC_commands
+from dragino.Strings import *
+
+failures = 0
+
+
+def check(what, got, expected):
+    global failures
+    ok = got == expected
+    failures += not ok
+    print(f"{'ok  ' if ok else 'FAIL'} {what}: {got!r}" + ("" if ok else f" expected {expected!r}"))
+
+
+config = TomlConfig("dragino.toml").getConfig()
+
+with tempfile.TemporaryDirectory() as folder:
+    config[TTN][MAC_CACHE] = os.path.join(folder, "cache.json")
+
+    with open(config[TTN][MAC_CACHE], "w") as f:
+        json.dump({FCNTUP: 7, FCNTDN: [0x34, 0x12]}, f)
+
+    MAC = MAC_commands(config, logging.WARNING)
+
+    check("legacy fCntDn [0x34, 0x12]", MAC.getFCntDn(), 0x1234)
+    check("32 bit FCntDn of FCnt 0x1235", MAC.getFCntDn32(b'\x35\x12'), 0x1235)
+    check("new downlink accepted", MAC.checkFcntDn(0x1235), True)
+    check("replayed downlink rejected", MAC.checkFcntDn(0x1235), False)
+    check("older downlink rejected", MAC.checkFcntDn(0x1234), False)
+
+    with open(config[TTN][MAC_CACHE], "r") as f:
+        check("cached fCntDn", json.load(f)[FCNTDN], 0x1235)
+
+    MAC.setFCntDn(0)    # as after a join
+    check("first downlink after a join accepted", MAC.checkFcntDn(0), True)
+    check("its replay rejected", MAC.checkFcntDn(0), False)
+
+sys.exit(1 if failures else 0)